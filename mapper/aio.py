@@ -0,0 +1,284 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import asyncio
+import os
+import socket
+try:
+	import certifi
+	import ssl
+except ImportError:
+	ssl = None
+import threading
+
+from .mapper import USER_DATA, MUD_DATA, Mapper
+from .mpi import MPI
+from .parser import ServerParser
+from .utils import getDirectoryPath, touch
+from .world import World
+
+
+LISTENING_STATUS_FILE = os.path.join(getDirectoryPath("."), "mapper_ready.ignore")
+
+
+class StreamSender(object):
+	"""Gives an asyncio stream writer the sendall method which the mapper and MPI code expect from a socket."""
+	def __init__(self, writer, loop):
+		self._writer = writer
+		self._loop = loop
+		self._threadId = threading.get_ident()
+		# Older versions of asyncio only allow one coroutine at a time to wait for a writer to drain.
+		self._drainLock = asyncio.Lock()
+
+	def sendall(self, data):
+		if self._writer.is_closing():
+			raise EnvironmentError("Connection closed.")
+		elif threading.get_ident() == self._threadId:
+			self._writer.write(bytes(data))
+		else:
+			# Called from outside the event loop, for example by the GUI.
+			self._loop.call_soon_threadsafe(self._writer.write, bytes(data))
+
+	async def drain(self):
+		"""Wait until the data which was sent is within the limit of the writer's buffer, so that a slow connection holds up whatever is sending to it, rather than the buffer growing without limit."""
+		async with self._drainLock:
+			await self._writer.drain()
+
+
+class AsyncMapper(Mapper):
+	"""A mapper which runs as a coroutine on an event loop instead of in its own thread."""
+	def __init__(self, loop, **kwargs):
+		self._loop = loop
+		Mapper.__init__(self, **kwargs)
+		self.queue = asyncio.Queue()
+
+	def callLater(self, delay, function, *args):
+		self._loop.call_later(delay, function, *args)
+
+	def notify(self, text):
+		# The queue can only be used from the event loop.
+		self._loop.call_soon_threadsafe(Mapper.notify, self, text)
+
+	async def runAsync(self):
+		handler = self.dataHandler()
+		next(handler)
+		queue = self.queue
+		while True:
+			dataType, data = await queue.get()
+			if data is None:
+				break
+			with self.mapLock:
+				handler.send((dataType, data))
+		handler.close()
+		self.stopNotifications()
+		self.clientSend("Exiting mapper thread.")
+
+
+async def proxyClient(clientReader, server, mapper):
+	"""Forward data from the client to the server, or to the mapper if it's a mapper command."""
+	userCommands = [func[len("user_command_"):].encode("us-ascii", "ignore") for func in dir(mapper) if func.startswith("user_command_")]
+	while True:
+		try:
+			data = await clientReader.read(4096)
+		except EnvironmentError:
+			break
+		if not data:
+			break
+		elif data.strip() and data.strip().split()[0] in userCommands:
+			mapper.queue.put_nowait((USER_DATA, data))
+		else:
+			try:
+				server.sendall(data)
+				await server.drain()
+			except EnvironmentError:
+				break
+
+
+async def proxyServer(serverReader, client, server, mapper, outputFormat, promptTerminator):
+	"""Parse data from the server, forwarding the results to the client, server, and mapper."""
+	tinTinFormat = outputFormat == "tintin"
+	mpiTasks = []
+	parser = ServerParser(outputFormat=outputFormat, promptTerminator=promptTerminator)
+	while True:
+		try:
+			data = await serverReader.read(4096)
+		except EnvironmentError:
+			break
+		if not data:
+			break
+		clientData, serverReplies, events = parser.feed(data)
+		try:
+			for reply in serverReplies:
+				server.sendall(reply)
+			if serverReplies:
+				await server.drain()
+		except EnvironmentError:
+			break
+		mapperEvents = []
+		for event, eventData in events:
+			if event == "mpi":
+				mpiCommand, mpiData = eventData
+				mpi = MPI(client=client, server=server, isTinTin=tinTinFormat, command=mpiCommand, data=mpiData)
+				mpiTasks.append(asyncio.ensure_future(mpi.runAsync()))
+			else:
+				mapperEvents.append((event, eventData))
+		if mapperEvents:
+			mapper.queue.put_nowait((MUD_DATA, mapperEvents))
+		try:
+			client.sendall(clientData)
+			await client.drain()
+		except EnvironmentError:
+			break
+	if mpiTasks:
+		await asyncio.gather(*mpiTasks, return_exceptions=True)
+
+
+def createSSLContext():
+	context = ssl.create_default_context(cafile=certifi.where())
+	# The certificate host is checked against 'mume.org' after connecting, regardless of the remote host given.
+	context.check_hostname = False
+	context.verify_mode = ssl.CERT_REQUIRED
+	return context
+
+
+async def acceptClient(localHost, localPort):
+	"""Wait for a single client connection, and stop listening once it is made."""
+	loop = asyncio.get_event_loop()
+	connected = loop.create_future()
+
+	def onClientConnected(reader, writer):
+		if connected.done():
+			writer.close()
+		else:
+			connected.set_result((reader, writer))
+
+	listener = await asyncio.start_server(onClientConnected, host=localHost, port=localPort, reuse_address=True)
+	touch(LISTENING_STATUS_FILE)
+	try:
+		return await connected
+	finally:
+		listener.close()
+
+
+async def connectServer(remoteHost, remotePort, noSsl):
+	context = createSSLContext() if not noSsl and ssl is not None else None
+	reader, writer = await asyncio.open_connection(remoteHost, remotePort, ssl=context)
+	serverSocket = writer.get_extra_info("socket")
+	if serverSocket is not None:
+		serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+		serverSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	if context is not None:
+		# Validating server identity with ssl module
+		# See https://wiki.python.org/moin/SSL
+		for field in writer.get_extra_info("peercert")["subject"]:
+			if field[0][0] == "commonName":
+				certhost = field[0][1]
+				if certhost != "mume.org":
+					writer.close()
+					raise ssl.SSLError("Host name 'mume.org' doesn't match certificate host '{}'".format(certhost))
+	return reader, writer
+
+
+async def runSession(clientReader, clientWriter, outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, remoteHost, remotePort, noSsl, sharedWorld=None, worlds=None):
+	loop = asyncio.get_event_loop()
+	clientSocket = clientWriter.get_extra_info("socket")
+	if clientSocket is not None:
+		clientSocket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+		clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	client = StreamSender(clientWriter, loop)
+	try:
+		serverReader, serverWriter = await connectServer(remoteHost, remotePort, noSsl)
+	except (TimeoutError, asyncio.TimeoutError):
+		try:
+			client.sendall(b"\r\nError: server connection timed out!\r\n")
+			client.sendall(b"\r\n")
+			await clientWriter.drain()
+		except EnvironmentError:
+			pass
+		clientWriter.close()
+		return
+	server = StreamSender(serverWriter, loop)
+	mapper = AsyncMapper(loop=loop, client=client, server=server, outputFormat=outputFormat, interface=interface, promptTerminator=promptTerminator, gagPrompts=gagPrompts, findFormat=findFormat, findLimit=findLimit, sharedWorld=sharedWorld)
+	if sharedWorld is None:
+		if worlds is not None:
+			worlds.append(mapper)
+		mapper.autosaver.start()
+	mapperTask = asyncio.ensure_future(mapper.runAsync())
+	clientTask = asyncio.ensure_future(proxyClient(clientReader, server, mapper))
+	serverTask = asyncio.ensure_future(proxyServer(serverReader, client, server, mapper, outputFormat, promptTerminator))
+	# The session ends as soon as either side closes the connection.
+	await asyncio.wait([clientTask, serverTask], return_when=asyncio.FIRST_COMPLETED)
+	clientTask.cancel()
+	serverWriter.close()
+	await serverTask
+	if interface != "text":
+		# Shutdown the gui
+		with mapper._gui_queue_lock:
+			mapper._gui_queue.put(None)
+	mapper.queue.put_nowait((None, None))
+	await mapperTask
+	if sharedWorld is None:
+		# Waiting for the save to finish mustn't hold up the event loop.
+		await loop.run_in_executor(None, mapper.saveOnExit)
+	try:
+		client.sendall(b"\r\n")
+		await clientWriter.drain()
+	except EnvironmentError:
+		pass
+	clientWriter.close()
+
+
+async def serveClients(localHost, localPort, sessionArgs, worlds=None):
+	"""Accept client connections until cancelled, running a separate session for each client which shares a single copy of the map."""
+	sharedWorld = World(interface="text")
+	if worlds is not None:
+		worlds.append(sharedWorld)
+	sharedWorld.autosaver.start()
+	sessions = set()
+
+	def onClientConnected(reader, writer):
+		session = asyncio.ensure_future(runSession(reader, writer, *sessionArgs, sharedWorld=sharedWorld))
+		sessions.add(session)
+		session.add_done_callback(sessions.discard)
+
+	listener = await asyncio.start_server(onClientConnected, host=localHost, port=localPort, reuse_address=True)
+	touch(LISTENING_STATUS_FILE)
+	try:
+		await listener.serve_forever()
+	finally:
+		listener.close()
+		if sessions:
+			await asyncio.gather(*sessions, return_exceptions=True)
+		await asyncio.get_event_loop().run_in_executor(None, sharedWorld.saveOnExit)
+
+
+async def run(outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, localHost, localPort, remoteHost, remotePort, noSsl, multiClient=False, worlds=None):
+	"""Run the proxy. The maps which are loaded are added to worlds, if it's given, so that they can be saved if the event loop is stopped before the sessions finish."""
+	sessionArgs = (outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, remoteHost, remotePort, noSsl)
+	try:
+		if multiClient:
+			await serveClients(localHost, localPort, sessionArgs, worlds)
+		else:
+			clientReader, clientWriter = await acceptClient(localHost, localPort)
+			await runSession(clientReader, clientWriter, *sessionArgs, worlds=worlds)
+	finally:
+		try:
+			os.remove(LISTENING_STATUS_FILE)
+		except:  # NOQA: E722
+			pass
+
+
+def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, localHost, localPort, remoteHost, remotePort, noSsl, multiClient=False):
+	"""Run the proxy, mapper, timers, and MPI sessions as coroutines on a single event loop. Only the text interface is supported, since pyglet needs the main thread."""
+	loop = asyncio.new_event_loop()
+	worlds = []
+	coroutine = run(outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, localHost, localPort, remoteHost, remotePort, noSsl, multiClient, worlds)
+	try:
+		loop.run_until_complete(coroutine)
+	finally:
+		# A session which was interrupted, for example by Ctrl+C or an error, didn't get to save its map. Saving a map which was already saved only waits for the save to finish.
+		for world in worlds:
+			world.saveOnExit()
+		loop.close()
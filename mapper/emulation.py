@@ -11,27 +11,29 @@ import threading
 
 from .world import DIRECTIONS, TERRAIN_SYMBOLS, World
 from .clock import Clock
+from .roomdata.objects import VNUM_DEATH, VNUM_UNDEFINED
 from .utils import page, getDirectoryPath
 
 
 class EmulatedWorld(World):
 	"""The main emulated world class"""
-	def __init__(self, interface, findFormat):
+	def __init__(self, interface, findFormat, findLimit):
 		self.output("Welcome to Mume Map Emulation!")
 		self.output("Loading the world database.")
 		World.__init__(self, interface=interface)
 		self.output("Loaded {0} rooms.".format(len(self.rooms)))
 		self.findFormat = findFormat
+		self.findLimit = findLimit
 		self.config = {}
 		dataDirectory = getDirectoryPath("data")
 		self.configFile = os.path.join(dataDirectory, "emulation_config.json")
 		self.sampleConfigFile = os.path.join(dataDirectory, "emulation_config.json.sample")
 		self.loadConfig()
 		# Set the initial room to the room that the user was in when the program last terminated.
-		lastVnum = self.config.get("last_vnum", "0")
+		lastVnum = self.lookupVnum(str(self.config.get("last_vnum", "0")))
 		if lastVnum not in self.rooms:
 			lastVnum = sorted(self.rooms)[0]
-		self.move(lastVnum)
+		self.move(str(lastVnum))
 
 	def output(self, text):
 		"""Output text with utils.page."""
@@ -60,9 +62,9 @@ class EmulatedWorld(World):
 					# Enclose the direction of the door in brackets '[]' for use in the exits line. In Mume, enclosing an exits line direction in brackets denotes a closed door in that direction.
 					direction = "[{0}]".format(direction)
 			# The next 2 symbols which might be added are just convenience symbols for denoting if the exit is to an undefined room or a known deathtrap. They don't actually exist in Mume.
-			if exitObj.to == "death":
+			if exitObj.to == VNUM_DEATH:
 				direction = "!!{0}!!".format(direction)
-			elif exitObj.to not in self.rooms or exitObj.to == "undefined":
+			elif exitObj.to not in self.rooms:
 				direction = "??{0}??".format(direction)
 			elif self.rooms[exitObj.to].terrain == "road":
 				# The '=' sign is used in Mume to denote that the room in that direction is a road.
@@ -94,9 +96,9 @@ class EmulatedWorld(World):
 			exitLine.append("{0}:".format(direction.capitalize()))
 			if exitObj.door or "door" in exitObj.exitFlags:
 				exitLine.append("{0} ({1}),".format("visible" if "hidden" not in exitObj.doorFlags else "hidden", exitObj.door if exitObj.door else "exit"))
-			if exitObj.to.isdigit() and exitObj.to in self.rooms:
+			if exitObj.to in self.rooms:
 				exitLine.append("{0}, {1}".format(self.rooms[exitObj.to].name, self.rooms[exitObj.to].terrain))
-			elif exitObj.to == "death":
+			elif exitObj.to == VNUM_DEATH:
 				exitLine.append("death")
 			else:
 				exitLine.append("undefined")
@@ -116,6 +118,9 @@ class EmulatedWorld(World):
 	def user_command_exitflags(self, *args):
 		self.output(self.exitflags(*args))
 
+	def user_command_find(self, *args):
+		self.output(self.find(self.findFormat, *args))
+
 	def user_command_fdoor(self, *args):
 		self.output(self.fdoor(self.findFormat, *args))
 
@@ -131,6 +136,9 @@ class EmulatedWorld(World):
 	def user_command_fnote(self, *args):
 		self.output(self.fnote(self.findFormat, *args))
 
+	def user_command_distances(self, *args):
+		self.output(self.distances(*args))
+
 	def user_command_getlabel(self, *args):
 		self.output(self.getlabel(*args))
 
@@ -199,6 +207,9 @@ class EmulatedWorld(World):
 		status = self.toggleSetting("use_terrain_symbols")
 		self.output("Terrain symbols in prompt {}.".format("enabled" if status else "disabled"))
 
+	def user_command_tour(self, *args):
+		self.output(self.tour(*args))
+
 	def user_command_vnum(self, *args):
 		status = self.toggleSetting("show_vnum")
 		self.output("Show room vnum {}.".format("enabled" if status else "disabled"))
@@ -210,20 +221,18 @@ class EmulatedWorld(World):
 				return self.output("Alas, you cannot go that way!")
 			else:
 				vnum = self.currentRoom.exits[text].to
-		elif text in self.labels:
-			vnum = self.labels[text]
-		elif text.isdigit():
-			vnum = text
+		elif text in self.labels or text.isdigit():
+			vnum = self.lookupVnum(text)
 		else:
 			return self.output("Error: {0} isn't a direction, label, or vnum.".format(text))
-		if vnum == "undefined":
+		if vnum == VNUM_UNDEFINED:
 			return self.output("Undefined room in that direction!")
-		elif vnum == "death":
+		elif vnum == VNUM_DEATH:
 			return self.output("Deathtrap in that direction!")
 		elif vnum not in self.rooms:
 			return self.output("Error: no rooms in the database with vnum ({0}).".format(vnum))
 		self.currentRoom = self.rooms[vnum]
-		self.config["last_vnum"] = vnum
+		self.config["last_vnum"] = str(vnum)
 		self.user_command_partial_look()
 
 	def toggleSetting(self, setting):
@@ -280,10 +289,10 @@ class EmulatedWorld(World):
 
 
 class Emulator(threading.Thread):
-	def __init__(self, interface, findFormat):
+	def __init__(self, interface, findFormat, findLimit):
 		threading.Thread.__init__(self)
 		self.name = "Emulator"
-		self.world = EmulatedWorld(interface, findFormat)
+		self.world = EmulatedWorld(interface, findFormat, findLimit)
 		self._interface = interface
 
 	def run(self):
@@ -308,16 +317,19 @@ class Emulator(threading.Thread):
 			elif "quit".startswith(userInput):
 				break
 			else:
-				wld.parseInput(userInput)
-		# The user has typed 'q[uit]'. Save the config file and exit.
+				# The map is also read by the thread which saves it in the background.
+				with wld.mapLock:
+					wld.parseInput(userInput)
+		# The user has typed 'q[uit]'. Save the config file and any changes to the map, and exit.
 		wld.saveConfig()
+		wld.saveOnExit()
 		wld.output("Good bye.")
 		if self._interface != "text":
 			with wld._gui_queue_lock:
 				wld._gui_queue.put(None)
 
 
-def main(interface, findFormat):
+def main(interface, findFormat, findLimit):
 	interface = interface.strip().lower()
 	if interface != "text":
 		try:
@@ -325,7 +337,7 @@ def main(interface, findFormat):
 		except ImportError:
 			print("Unable to find pyglet. Disabling gui")
 			interface = "text"
-	emulator_thread = Emulator(interface, findFormat)
+	emulator_thread = Emulator(interface, findFormat, findLimit)
 	emulator_thread.start()
 	if interface != "text":
 		pyglet.app.run()
@@ -22,6 +22,7 @@ except ImportError:
 
 from .vec2d import Vec2d
 from ..config import Config, config_lock
+from ..roomdata.objects import VNUM_DEATH, VNUM_UNDEFINED
 from ..world import DIRECTIONS
 
 
@@ -413,7 +414,7 @@ class Window(pyglet.window.Window):
 						# print the vnum
 						self.world.output("{}, {}".format(vnum, room.name))
 					else:
-						result = self.world.path(vnum)
+						result = self.world.path(str(vnum))
 						if result is not None:
 							self.world.output(result)
 				elif buttons == pyglet.window.mouse.RIGHT:
@@ -633,7 +634,7 @@ class Window(pyglet.window.Window):
 			else:
 				exits = set(room.exits)  # Normal exits list
 			for direction in exits:
-				name = vnum + direction
+				name = str(vnum) + direction
 				exit = room.exits.get(direction, None)
 				dv = DIRECTIONS_VEC2D.get(direction, None)
 				if direction in ("up", "down"):
@@ -656,11 +657,11 @@ class Window(pyglet.window.Window):
 							vl1 = self.draw_polygon(vs1, exit_color2, group=self.groups[2])
 							vl2 = self.draw_polygon(vs2, exit_color1, group=self.groups[2])
 							self.visible_exits[name] = (vl1, vl2)
-					elif exit.to in ("undefined", "death"):
+					elif exit.to in (VNUM_UNDEFINED, VNUM_DEATH):
 						if name in self.visible_exits and not isinstance(self.visible_exits[name], tuple):
 							vl = self.visible_exits[name]
 							vl.x, vl.y = new_cp
-						elif exit.to == "undefined":
+						elif exit.to == VNUM_UNDEFINED:
 							self.visible_exits[name] = pyglet.text.Label("?", font_name="Times New Roman", font_size=(self.size / 100.0) * 72, x=new_cp.x, y=new_cp.y, anchor_x="center", anchor_y="center", color=exit_color2, batch=self.batch, group=self.groups[2])
 						else:  # Death
 							self.visible_exits[name] = pyglet.text.Label("X", font_name="Times New Roman", font_size=(self.size / 100.0) * 72, x=new_cp.x, y=new_cp.y, anchor_x="center", anchor_y="center", color=Color(255, 0, 0, 255), batch=self.batch, group=self.groups[2])
@@ -685,9 +686,9 @@ class Window(pyglet.window.Window):
 						name += "-"
 						if exit is None:
 							color = exit_color2
-						elif exit.to == "undefined":
+						elif exit.to == VNUM_UNDEFINED:
 							color = Color(0, 0, 255, 255)
-						elif exit.to == "death":
+						elif exit.to == VNUM_DEATH:
 							color = Color(255, 0, 0, 255)
 						else:
 							color = Color(0, 255, 0, 255)
@@ -717,13 +718,13 @@ class Window(pyglet.window.Window):
 								vl.vertices = vs
 							else:
 								self.visible_exits[name] = self.draw_fat_segment(a, b, self.size / radius, exit_color1, group=self.groups[2])
-						elif exit.to in ("undefined", "death"):
+						elif exit.to in (VNUM_UNDEFINED, VNUM_DEATH):
 							l = (self.size * 0.75)
 							new_cp = cp + dv * l
 							if name in self.visible_exits and not isinstance(self.visible_exits[name], tuple):
 								vl = self.visible_exits[name]
 								vl.x, vl.y = new_cp
-							elif exit.to == "undefined":
+							elif exit.to == VNUM_UNDEFINED:
 								self.visible_exits[name] = pyglet.text.Label("?", font_name="Times New Roman", font_size=(self.size / 100.0) * 72, x=new_cp.x, y=new_cp.y, anchor_x="center", anchor_y="center", color=exit_color1, batch=self.batch, group=self.groups[2])
 							else:  # Death
 								self.visible_exits[name] = pyglet.text.Label("X", font_name="Times New Roman", font_size=(self.size / 100.0) * 72, x=new_cp.x, y=new_cp.y, anchor_x="center", anchor_y="center", color=Color(255, 0, 0, 255), batch=self.batch, group=self.groups[2])
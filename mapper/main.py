@@ -10,17 +10,17 @@ try:
 	import ssl
 except ImportError:
 	ssl = None
-from telnetlib import IAC, GA, DONT, DO, WONT, WILL, theNULL, SB, SE, TTYPE, NAWS
+from telnetlib import IAC, GA
 import threading
 
 from .mapper import USER_DATA, MUD_DATA, Mapper
 from .mpi import MPI
-from .utils import getDirectoryPath, touch, unescapeXML
+from .parser import ServerParser
+from .world import World
+from .utils import getDirectoryPath, touch
 
 
 LISTENING_STATUS_FILE = os.path.join(getDirectoryPath("."), "mapper_ready.ignore")
-CHARSET = chr(42).encode("us-ascii")
-SB_REQUEST, SB_ACCEPTED, SB_REJECTED, SB_TTABLE_IS, SB_TTABLE_REJECTED, SB_TTABLE_ACK, SB_TTABLE_NAK = (chr(i).encode("us-ascii") for i in range(1, 8))
 
 
 class Proxy(threading.Thread):
@@ -56,6 +56,11 @@ class Proxy(threading.Thread):
 				except EnvironmentError:
 					self.close()
 					continue
+		# The session ends when either side closes the connection, so stop the server thread waiting for data from the game.
+		try:
+			self._server.shutdown(socket.SHUT_RDWR)
+		except EnvironmentError:
+			pass
 
 
 class Server(threading.Thread):
@@ -75,68 +80,9 @@ class Server(threading.Thread):
 
 	def run(self):
 		self.alive.set()
-		normalFormat = self._outputFormat == "normal"  # NOQA: F841
 		tinTinFormat = self._outputFormat == "tintin"
-		rawFormat = self._outputFormat == "raw"
-		ignoreBytes = frozenset([ord(theNULL), 0x11])
-		negotiationBytes = frozenset(ord(byte) for byte in [DONT, DO, WONT, WILL])
-		ordIAC = ord(IAC)
-		ordGA = ord(GA)
-		ordSB = ord(SB)
-		ordSE = ord(SE)
-		ordLF = ord("\n")
-		ordCHARSET = ord(CHARSET)
-		charsetSep = b";"
-		charsets = {
-			"ascii": b"US-ASCII",
-			"latin-1": b"ISO-8859-1",
-			"utf-8": b"UTF-8"
-		}
-		defaultCharset = charsets["ascii"]
-		inIAC = False
-		inSubOption = False
-		inCharset = False
-		inCharsetResponse = False
-		inMPI = False
 		mpiThreads = []
-		mpiCounter = 0
-		mpiCommand = None
-		mpiLen = None
-		mpiBuffer = bytearray()
-		clientBuffer = bytearray()
-		tagBuffer = bytearray()
-		textBuffer = bytearray()
-		lineBuffer = bytearray()
-		charsetResponseBuffer = bytearray()
-		charsetResponseCode = None
-		readingTag = False
-		inGratuitous = False
-		modeNone = 0
-		modeRoom = 1
-		modeName = 2
-		modeDescription = 3
-		modeExits = 4
-		modePrompt = 5
-		modeTerrain = 6
-		xmlMode = modeNone
-		tagReplacements = {
-			b"prompt": b"PROMPT:",
-			b"/prompt": b":PROMPT",
-			b"name": b"NAME:",
-			b"/name": b":NAME",
-			b"tell": b"TELL:",
-			b"/tell": b":TELL",
-			b"narrate": b"NARRATE:",
-			b"/narrate": b":NARRATE",
-			b"pray": b"PRAY:",
-			b"/pray": b":PRAY",
-			b"say": b"SAY:",
-			b"/say": b":SAY",
-			b"emote": b"EMOTE:",
-			b"/emote": b":EMOTE"
-		}
-		initialOutput = b"".join((IAC, DO, TTYPE, IAC, DO, NAWS))
-		encounteredInitialOutput = False
+		parser = ServerParser(outputFormat=self._outputFormat, promptTerminator=self._promptTerminator)
 		while self.alive.isSet():
 			try:
 				data = self._server.recv(4096)
@@ -146,189 +92,29 @@ class Server(threading.Thread):
 			if not data:
 				self.close()
 				continue
-			elif not encounteredInitialOutput and data.startswith(initialOutput):
-				# The connection to Mume has been established, and the game has just responded with the login screen.
-				# Identify for Mume Remote Editing.
-				self._server.sendall(b"~$#EI\n")
-				# Turn on XML mode.
-				self._server.sendall(b"~$#EX2\n3G\n")
-				# Tell the Mume server to put IAC-GA at end of prompts.
-				self._server.sendall(b"~$#EP2\nG\n")
-				# Tell the server that we will negotiate the character set.
-				self._server.sendall(IAC + WILL + CHARSET)
-				inCharset = True
-				encounteredInitialOutput = True
-			for byte in bytearray(data):
-				if inIAC:
-					clientBuffer.append(byte)
-					if byte in negotiationBytes:
-						# This is the second byte in a 3-byte telnet option sequence.
-						# Skip the byte, and move on to the next.
-						continue
-					# From this point on, byte is the final byte in a 2-3 byte telnet option sequence.
-					inIAC = False
-					if byte == ordSB:
-						# Sub-option negotiation begin
-						inSubOption = True
-					elif byte == ordSE:
-						# Sub-option negotiation end
-						if inCharset and inCharsetResponse:
-							# IAC SE was erroneously added to the client buffer. Remove it.
-							del clientBuffer[-2:]
-							charsetResponseCode = None
-							del charsetResponseBuffer[:]
-							inCharsetResponse = False
-							inCharset = False
-						inSubOption = False
-					elif inSubOption:
-						# Ignore subsequent bytes until the sub option negotiation has ended.
-						continue
-					elif byte == ordIAC:
-						# This is an escaped IAC byte to be added to the buffer.
-						mpiCounter = 0
-						if inMPI:
-							mpiBuffer.append(byte)
-							# IAC + IAC was appended to the client buffer earlier.
-							# It must be removed as MPI data should not be sent to the mud client.
-							del clientBuffer[-2:]
-						elif xmlMode == modeNone:
-							lineBuffer.append(byte)
-					elif byte == ordCHARSET and inCharset and clientBuffer[-3:] == IAC + DO + CHARSET:
-						# Negotiate the character set.
-						self._server.sendall(IAC + SB + CHARSET + SB_REQUEST + charsetSep + defaultCharset + IAC + SE)
-						# IAC + DO + CHARSET was appended to the client buffer earlier.
-						# It must be removed as character set negotiation data should not be sent to the mud client.
-						del clientBuffer[-3:]
-					elif byte == ordGA:
-						# Replace the IAC-GA sequence (used by the game to terminate a prompt) with the user specified prompt terminator.
-						del clientBuffer[-2:]
-						clientBuffer.extend(self._promptTerminator)
-						self._mapper.queue.put((MUD_DATA, ("iac_ga", b"")))
-						if xmlMode == modeNone:
-							lineBuffer.extend(b"\r\n")
-				elif byte == ordIAC:
-					clientBuffer.append(byte)
-					inIAC = True
-				elif inSubOption or byte in ignoreBytes:
-					if byte == ordCHARSET and inCharset and clientBuffer[-2:] == IAC + SB:
-						# Character set negotiation responses should *not* be sent to the client.
-						del clientBuffer[-2:]
-						inCharsetResponse = True
-					elif inCharsetResponse and byte not in ignoreBytes:
-						if charsetResponseCode is None:
-							charsetResponseCode = byte
-						else:
-							charsetResponseBuffer.append(byte)
-					else:
-						clientBuffer.append(byte)
-				elif inMPI:
-					if byte == ordLF and mpiCommand is None and mpiLen is None:
-						# The first line of MPI data was recieved.
-						# The first byte is the MPI command, E for edit, V for view.
-						# The remaining byte sequence is the length of the MPI data to be received.
-						if mpiBuffer[0:1] in (b"E", b"V") and mpiBuffer[1:].isdigit():
-							mpiCommand = mpiBuffer[0:1]
-							mpiLen = int(mpiBuffer[1:])
-						else:
-							# Invalid MPI command or length.
-							inMPI = False
-						del mpiBuffer[:]
-					else:
-						mpiBuffer.append(byte)
-						if mpiLen is not None and len(mpiBuffer) >= mpiLen:
-							# The last byte in the MPI data has been reached.
-							mpiThreads.append(MPI(client=self._client, server=self._server, isTinTin=tinTinFormat, command=mpiCommand, data=bytes(mpiBuffer)))
-							mpiThreads[-1].start()
-							del mpiBuffer[:]
-							mpiCommand = None
-							mpiLen = None
-							inMPI = False
-				elif byte == 126 and mpiCounter == 0 and clientBuffer.endswith(b"\n") or byte == 36 and mpiCounter == 1 or byte == 35 and mpiCounter == 2:
-					# Byte is one of the first 3 bytes in the 4-byte MPI sequence (~$#E).
-					mpiCounter += 1
-				elif byte == 69 and mpiCounter == 3:
-					# Byte is the final byte in the 4-byte MPI sequence (~$#E).
-					inMPI = True
-					mpiCounter = 0
-				elif readingTag:
-					mpiCounter = 0
-					if byte == 62:  # >
-						# End of XML tag reached.
-						if xmlMode == modeNone:
-							if tagBuffer.startswith(b"exits"):
-								xmlMode = modeExits
-							elif tagBuffer.startswith(b"prompt"):
-								xmlMode = modePrompt
-							elif tagBuffer.startswith(b"room"):
-								xmlMode = modeRoom
-							elif tagBuffer.startswith(b"movement"):
-								self._mapper.queue.put((MUD_DATA, ("movement", bytes(tagBuffer)[8:].replace(b" dir=", b"", 1).split(b"/", 1)[0])))
-						elif xmlMode == modeRoom:
-							if tagBuffer.startswith(b"name"):
-								xmlMode = modeName
-							elif tagBuffer.startswith(b"description"):
-								xmlMode = modeDescription
-							elif tagBuffer.startswith(b"terrain"):
-								# Terrain tag only comes up in blindness or fog
-								xmlMode = modeTerrain
-							elif tagBuffer.startswith(b"gratuitous"):
-								inGratuitous = True
-							elif tagBuffer.startswith(b"/gratuitous"):
-								inGratuitous = False
-							elif tagBuffer.startswith(b"/room"):
-								self._mapper.queue.put((MUD_DATA, ("dynamic", bytes(textBuffer))))
-								xmlMode = modeNone
-						elif xmlMode == modeName and tagBuffer.startswith(b"/name"):
-							self._mapper.queue.put((MUD_DATA, ("name", bytes(textBuffer))))
-							xmlMode = modeRoom
-						elif xmlMode == modeDescription and tagBuffer.startswith(b"/description"):
-							self._mapper.queue.put((MUD_DATA, ("description", bytes(textBuffer))))
-							xmlMode = modeRoom
-						elif xmlMode == modeTerrain and tagBuffer.startswith(b"/terrain"):
-							xmlMode = modeRoom
-						elif xmlMode == modeExits and tagBuffer.startswith(b"/exits"):
-							self._mapper.queue.put((MUD_DATA, ("exits", bytes(textBuffer))))
-							xmlMode = modeNone
-						elif xmlMode == modePrompt and tagBuffer.startswith(b"/prompt"):
-							self._mapper.queue.put((MUD_DATA, ("prompt", bytes(textBuffer))))
-							xmlMode = modeNone
-						if tinTinFormat:
-							clientBuffer.extend(tagReplacements.get(bytes(tagBuffer), b""))
-						del tagBuffer[:]
-						del textBuffer[:]
-						readingTag = False
-					else:
-						tagBuffer.append(byte)
-					if rawFormat:
-						clientBuffer.append(byte)
-				elif byte == 60:  # <
-					# Start of new XML tag.
-					mpiCounter = 0
-					readingTag = True
-					if rawFormat:
-						clientBuffer.append(byte)
+			clientData, serverReplies, events = parser.feed(data)
+			try:
+				for reply in serverReplies:
+					self._server.sendall(reply)
+			except EnvironmentError:
+				self.close()
+				continue
+			mapperEvents = []
+			for event, eventData in events:
+				if event == "mpi":
+					mpiCommand, mpiData = eventData
+					mpiThreads.append(MPI(client=self._client, server=self._server, isTinTin=tinTinFormat, command=mpiCommand, data=mpiData))
+					mpiThreads[-1].start()
 				else:
-					# Byte is not part of a Telnet negotiation, MPI negotiation, or XML tag name.
-					mpiCounter = 0
-					if xmlMode == modeNone:
-						if byte == ordLF and lineBuffer:
-							for line in bytes(lineBuffer).splitlines():
-								if line.strip():
-									self._mapper.queue.put((MUD_DATA, ("line", line)))
-							del lineBuffer[:]
-						else:
-							lineBuffer.append(byte)
-					else:
-						textBuffer.append(byte)
-					if rawFormat or not inGratuitous:
-						clientBuffer.append(byte)
-			data = bytes(clientBuffer)
+					mapperEvents.append((event, eventData))
+			if mapperEvents:
+				# Deliver all the events from this chunk to the mapper at once, rather than paying the cost of synchronization per event.
+				self._mapper.queue.put((MUD_DATA, mapperEvents))
 			try:
-				self._client.sendall(data if rawFormat else unescapeXML(data, isbytes=True))
+				self._client.sendall(clientData)
 			except EnvironmentError:
 				self.close()
 				continue
-			del clientBuffer[:]
 		if self._interface != "text":
 			# Shutdown the gui
 			with self._mapper._gui_queue_lock:
@@ -338,27 +124,7 @@ class Server(threading.Thread):
 			mpiThread.join()
 
 
-def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, localHost, localPort, remoteHost, remotePort, noSsl):
-	outputFormat = outputFormat.strip().lower()
-	interface = interface.strip().lower()
-	if not promptTerminator:
-		promptTerminator = IAC + GA
-	if not gagPrompts:
-		gagPrompts = False
-	if interface != "text":
-		try:
-			import pyglet
-		except ImportError:
-			print("Unable to find pyglet. Disabling the GUI")
-			interface = "text"
-	proxySocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	proxySocket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-	proxySocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-	proxySocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-	proxySocket.bind((localHost, localPort))
-	proxySocket.listen(1)
-	touch(LISTENING_STATUS_FILE)
-	clientConnection, proxyAddress = proxySocket.accept()
+def runSession(clientConnection, outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, remoteHost, remotePort, noSsl, sharedWorld=None):
 	clientConnection.settimeout(1.0)
 	serverConnection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 	serverConnection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
@@ -376,10 +142,6 @@ def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, loca
 		except EnvironmentError:
 			pass
 		clientConnection.close()
-		try:
-			os.remove(LISTENING_STATUS_FILE)
-		except:  # NOQA: E722
-			pass
 		return
 	if not noSsl and ssl is not None:
 		# Validating server identity with ssl module
@@ -389,13 +151,16 @@ def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, loca
 				certhost = field[0][1]
 				if certhost != "mume.org":
 					raise ssl.SSLError("Host name 'mume.org' doesn't match certificate host '{}'".format(certhost))
-	mapperThread = Mapper(client=clientConnection, server=serverConnection, outputFormat=outputFormat, interface=interface, promptTerminator=promptTerminator, gagPrompts=gagPrompts, findFormat=findFormat)
+	mapperThread = Mapper(client=clientConnection, server=serverConnection, outputFormat=outputFormat, interface=interface, promptTerminator=promptTerminator, gagPrompts=gagPrompts, findFormat=findFormat, findLimit=findLimit, sharedWorld=sharedWorld)
 	proxyThread = Proxy(client=clientConnection, server=serverConnection, mapper=mapperThread)
 	serverThread = Server(client=clientConnection, server=serverConnection, mapper=mapperThread, outputFormat=outputFormat, interface=interface, promptTerminator=promptTerminator)
 	serverThread.start()
 	proxyThread.start()
 	mapperThread.start()
+	if sharedWorld is None:
+		mapperThread.autosaver.start()
 	if interface != "text":
+		import pyglet
 		pyglet.app.run()
 	serverThread.join()
 	try:
@@ -404,6 +169,8 @@ def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, loca
 		pass
 	mapperThread.queue.put((None, None))
 	mapperThread.join()
+	if sharedWorld is None:
+		mapperThread.saveOnExit()
 	try:
 		clientConnection.sendall(b"\r\n")
 		proxyThread.close()
@@ -413,7 +180,68 @@ def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, loca
 	proxyThread.join()
 	serverConnection.close()
 	clientConnection.close()
+
+
+def main(outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, localHost, localPort, remoteHost, remotePort, noSsl, engine="thread", multiClient=False):
+	outputFormat = outputFormat.strip().lower()
+	interface = interface.strip().lower()
+	if not promptTerminator:
+		promptTerminator = IAC + GA
+	if not gagPrompts:
+		gagPrompts = False
+	if multiClient and interface != "text":
+		print("The GUI can't be used with multiple clients. Disabling the GUI")
+		interface = "text"
+	if engine.strip().lower() == "asyncio" and interface != "text":
+		# The event loop can't share the main thread with pyglet, and pyglet windows must be created on the main thread.
+		print("The GUI can't be used with the asyncio engine. Using the thread engine")
+		engine = "thread"
+	if interface != "text":
+		try:
+			import pyglet  # NOQA: F401
+		except ImportError:
+			print("Unable to find pyglet. Disabling the GUI")
+			interface = "text"
+	if engine.strip().lower() == "asyncio":
+		from . import aio
+		return aio.main(outputFormat=outputFormat, interface=interface, promptTerminator=promptTerminator, gagPrompts=gagPrompts, findFormat=findFormat, findLimit=findLimit, localHost=localHost, localPort=localPort, remoteHost=remoteHost, remotePort=remotePort, noSsl=noSsl, multiClient=multiClient)
+	proxySocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	proxySocket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+	proxySocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	proxySocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	proxySocket.bind((localHost, localPort))
+	proxySocket.listen(5 if multiClient else 1)
+	touch(LISTENING_STATUS_FILE)
 	try:
-		os.remove(LISTENING_STATUS_FILE)
-	except:  # NOQA: E722
-		pass
+		if not multiClient:
+			clientConnection, proxyAddress = proxySocket.accept()
+			runSession(clientConnection, outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, remoteHost, remotePort, noSsl)
+			return
+		# Load the map once. Every client gets its own game connection and mapper session, but they all share this copy of the map.
+		sharedWorld = World(interface="text")
+		sharedWorld.autosaver.start()
+		# Tuples of the thread running each session, and its client connection.
+		sessions = []
+		while True:
+			try:
+				clientConnection, proxyAddress = proxySocket.accept()
+			except KeyboardInterrupt:
+				break
+			sessions = [(thread, connection) for thread, connection in sessions if thread.is_alive()]
+			sessions.append((threading.Thread(target=runSession, args=(clientConnection, outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, remoteHost, remotePort, noSsl, sharedWorld), name="Session{}:{}".format(*proxyAddress[:2])), clientConnection))
+			sessions[-1][0].start()
+		# Disconnect the clients, and wait for their sessions to stop changing the map before it's saved.
+		for thread, connection in sessions:
+			try:
+				connection.shutdown(socket.SHUT_RDWR)
+			except EnvironmentError:
+				pass
+		for thread, connection in sessions:
+			thread.join()
+		sharedWorld.saveOnExit()
+	finally:
+		proxySocket.close()
+		try:
+			os.remove(LISTENING_STATUS_FILE)
+		except:  # NOQA: E722
+			pass
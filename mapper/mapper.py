@@ -15,7 +15,7 @@ from timeit import default_timer
 from . import roomdata
 from .clock import CLOCK_REGEX, TIME_REGEX, DAWN_REGEX, DAY_REGEX, DUSK_REGEX, NIGHT_REGEX, MONTHS, timeToEpoch, Clock
 from .timers import Timer
-from .world import DIRECTIONS, LIGHT_SYMBOLS, REVERSE_DIRECTIONS, RUN_DESTINATION_REGEX, TERRAIN_SYMBOLS, World
+from .world import DIRECTIONS, LIGHT_SYMBOLS, REVERSE_DIRECTIONS, TERRAIN_SYMBOLS, World
 from .utils import stripAnsi, decodeBytes, regexFuzzy, simplified, escapeXML, unescapeXML
 
 
@@ -48,7 +48,8 @@ MOVEMENT_FORCED_REGEX = re.compile(
 		]
 	)
 )
-MOVEMENT_PREVENTED_REGEX = re.compile(
+# Messages for when an exit can't be used, which auto-walking avoids by finding another route.
+MOVEMENT_BLOCKED_REGEX = re.compile(
 	"^{}$".format(
 		"|".join(
 			[
@@ -64,22 +65,31 @@ MOVEMENT_PREVENTED_REGEX = re.compile(
 				r"You failed swimming there\.",
 				r"You failed to climb there and fall down\, hurting yourself\.",
 				r"Your mount cannot climb the tree\!",
-				r"No way\! You are fighting for your life\!",
-				r"In your dreams\, or what\?",
-				r"You are too exhausted\.",
 				r"You unsuccessfully try to break through the ice\.",
-				r"Your mount refuses to follow your orders\!",
-				r"You are too exhausted to ride\.",
 				r"You can\'t go into deep water\!",
-				r"You don\'t control your mount\!",
 				r"Your mount is too sensible to attempt such a feat\.",
 				r"Oops\! You cannot go there riding\!",
-				r"A (?:pony|dales-pony|horse|warhorse|pack horse|trained horse|horse of the Rohirrim|brown donkey|mountain mule|hungry warg|brown wolf)(?: \(\w+\))? (?:is too exhausted|doesn't want you riding (?:him|her|it) anymore)\.",
 				r"You\'d better be swimming if you want to dive underwater\.",
 				r"You need to climb to go there\.",
 				r"You cannot climb there\.",
 				r"If you still want to try\, you must \'climb\' there\.",
-				r".+ (?:prevents|keeps) you from going (?:north|south|east|west|up|down|upstairs|downstairs|past (?:him|her|it))\.",
+				r".+ (?:prevents|keeps) you from going (?:north|south|east|west|up|down|upstairs|downstairs|past (?:him|her|it))\."
+			]
+		)
+	)
+)
+# Messages for when the player can't move in any direction.
+MOVEMENT_PREVENTED_REGEX = re.compile(
+	"^{}$".format(
+		"|".join(
+			[
+				r"No way\! You are fighting for your life\!",
+				r"In your dreams\, or what\?",
+				r"You are too exhausted\.",
+				r"Your mount refuses to follow your orders\!",
+				r"You are too exhausted to ride\.",
+				r"You don\'t control your mount\!",
+				r"A (?:pony|dales-pony|horse|warhorse|pack horse|trained horse|horse of the Rohirrim|brown donkey|mountain mule|hungry warg|brown wolf)(?: \(\w+\))? (?:is too exhausted|doesn't want you riding (?:him|her|it) anymore)\.",
 				r"Nah\.\.\. You feel too relaxed to do that\.",
 				r"Maybe you should get on your feet first\?",
 				r"Not from your present position\!"
@@ -88,12 +98,16 @@ MOVEMENT_PREVENTED_REGEX = re.compile(
 	)
 )
 PROMPT_REGEX = re.compile(r"^(?P<light>[@*!\)o]?)(?P<terrain>[\#\(\[\+\.%fO~UW:=<]?)(?P<weather>[*'\"~=-]{0,2})\s*(?P<movementFlags>[RrSsCcW]{0,4})[^\>]*\>$")
+# The number of times an auto-walk will find a new route before giving up.
+AUTO_WALK_REROUTE_LIMIT = 20
 USER_DATA = 0
 MUD_DATA = 1
+# Messages from other threads, such as the saving thread, which are shown by the thread handling the data.
+NOTIFICATION_DATA = 2
 
 
 class Mapper(threading.Thread, World):
-	def __init__(self, client, server, outputFormat, interface, promptTerminator, gagPrompts, findFormat):
+	def __init__(self, client, server, outputFormat, interface, promptTerminator, gagPrompts, findFormat, findLimit, sharedWorld=None):
 		threading.Thread.__init__(self)
 		self.name = "Mapper"
 		# Initialize the timer.
@@ -104,6 +118,7 @@ class Mapper(threading.Thread, World):
 		self._promptTerminator = promptTerminator
 		self.gagPrompts = gagPrompts
 		self.findFormat = findFormat
+		self.findLimit = findLimit
 		self.queue = Queue()
 		self.autoMapping = False
 		self.autoUpdating = False
@@ -111,15 +126,44 @@ class Mapper(threading.Thread, World):
 		self.autoLinking = True
 		self.autoWalk = False
 		self.autoWalkDirections = []
+		# The exit which the last auto-walk move was sent through, as a (vnum, direction) tuple.
+		self.autoWalkStep = None
+		# The private route tree which is repaired when the auto-walk is blocked or moved off its route.
+		self.autoWalkTree = None
+		self.autoWalkTarget = None
+		self.autoWalkReroutes = 0
 		self.lastPathFindQuery = ""
 		self.lastPrompt = ""
+		self.mudEventBatches = 0
+		self.mudEventCount = 0
+		self.largestMudEventBatch = 0
 		self.clock = Clock()
-		World.__init__(self, interface=interface)
+		# Messages from other threads are shown straight away once the mapper has stopped handling data.
+		self._notificationLock = threading.Lock()
+		self._stopped = False
+		World.__init__(self, interface=interface, sharedWorld=sharedWorld)
 
 	def output(self, *args, **kwargs):
 		# Override World.output.
 		return self.clientSend(*args, **kwargs)
 
+	def notify(self, text):
+		# Override World.notify.
+		with self._notificationLock:
+			if self._stopped:
+				self.output(text)
+			else:
+				self.queue.put_nowait((NOTIFICATION_DATA, text))
+
+	def stopNotifications(self):
+		"""Show the messages from other threads which are still queued, and show later ones straight away. Called once the mapper has stopped handling data."""
+		with self._notificationLock:
+			self._stopped = True
+			while not self.queue.empty():
+				dataType, data = self.queue.get_nowait()
+				if dataType == NOTIFICATION_DATA:
+					self.output(data)
+
 	def clientSend(self, msg, showPrompt=True):
 		if self._outputFormat == "raw":
 			if showPrompt and self.lastPrompt and not self.gagPrompts:
@@ -148,6 +192,11 @@ class Mapper(threading.Thread, World):
 	def user_command_gettimerms(self, *args):
 		self.clientSend("TIMERMS:{:d}:TIMERMS".format(int((default_timer() - self.initTimer) * 1000)))
 
+	def user_command_eventstats(self, *args):
+		if not self.mudEventBatches:
+			return self.clientSend("No game events received yet.")
+		self.clientSend("Received {:d} game events in {:d} batches (average {:.1f}, largest {:d}).".format(self.mudEventCount, self.mudEventBatches, float(self.mudEventCount) / self.mudEventBatches, self.largestMudEventBatch))
+
 	def user_command_clock(self, *args):
 		if not args or not args[0] or not args[0].strip():
 			self.clientSend(self.clock.time())
@@ -195,6 +244,9 @@ class Mapper(threading.Thread, World):
 	def user_command_rdelete(self, *args):
 		self.clientSend(self.rdelete(*args))
 
+	def user_command_find(self, *args):
+		self.clientSend(self.find(self.findFormat, *args))
+
 	def user_command_fdoor(self, *args):
 		self.clientSend(self.fdoor(self.findFormat, *args))
 
@@ -283,13 +335,12 @@ class Mapper(threading.Thread, World):
 
 	def user_command_run(self, *args):
 		if not args or not args[0] or not args[0].strip():
-			return self.clientSend("Usage: run [label|vnum]")
+			return self.clientSend("Usage: run [label|vnum|nearest [query]|nearest of [labels]]")
 		self.autoWalkDirections = []
 		argString = args[0].strip()
 		if argString.lower() == "c":
 			if self.lastPathFindQuery:
-				match = RUN_DESTINATION_REGEX.match(self.lastPathFindQuery)
-				destination = match.group("destination")
+				destination, flags = self.parsePathArguments(self.lastPathFindQuery)
 				self.clientSend(destination)
 			else:
 				return self.clientSend("Error: no previous path to continue.")
@@ -303,17 +354,15 @@ class Mapper(threading.Thread, World):
 			self.lastPathFindQuery = argString
 			return self.clientSend("Setting run target to '{}'".format(self.lastPathFindQuery))
 		else:
-			match = RUN_DESTINATION_REGEX.match(argString)
-			destination = match.group("destination")
-		flags = match.group("flags")
-		if flags:
-			flags = flags.split("|")
-		else:
-			flags = None
+			destination, flags = self.parsePathArguments(argString)
 		result = self.pathFind(destination=destination, flags=flags)
 		if result is not None:
 			self.autoWalkDirections = result
 			self.autoWalk = True
+			self.autoWalkStep = None
+			self.autoWalkTree = None
+			self.autoWalkTarget = self.lastRouteTarget
+			self.autoWalkReroutes = 0
 			if result:
 				if argString != "c":
 					self.lastPathFindQuery = argString
@@ -321,15 +370,8 @@ class Mapper(threading.Thread, World):
 
 	def user_command_step(self, *args):
 		if not args or not args[0] or not args[0].strip():
-			return self.clientSend("Usage: step [label|vnum]")
-		argString = args[0].strip()
-		match = RUN_DESTINATION_REGEX.match(argString)
-		destination = match.group("destination")
-		flags = match.group("flags")
-		if flags:
-			flags = flags.split("|")
-		else:
-			flags = None
+			return self.clientSend("Usage: step [label|vnum|nearest [query]|nearest of [labels]]")
+		destination, flags = self.parsePathArguments(args[0])
 		result = self.pathFind(destination=destination, flags=flags)
 		if result is not None:
 			self.autoWalkDirections = result
@@ -340,6 +382,12 @@ class Mapper(threading.Thread, World):
 	def user_command_stop(self, *args):
 		self.clientSend(self.stopRun())
 
+	def user_command_distances(self, *args):
+		self.clientSend(self.distances(*args))
+
+	def user_command_tour(self, *args):
+		self.clientSend(self.tour(*args))
+
 	def user_command_path(self, *args):
 		result = self.path(*args)
 		if result is not None:
@@ -354,6 +402,13 @@ class Mapper(threading.Thread, World):
 			self.sync(vnum=args[0].strip())
 
 	def walkNextDirection(self):
+		if self.autoWalk and self.autoWalkStep is not None:
+			vnum, direction = self.autoWalkStep
+			if vnum in self.rooms and direction in self.rooms[vnum].exits and self.currentRoom.vnum != self.rooms[vnum].exits[direction].to:
+				# The player ended up somewhere other than where the last move should have led.
+				self.clientSend("Off route. Finding a new route.")
+				if not self.rerouteAutoWalk():
+					return
 		if not self.autoWalkDirections:
 			return
 		while self.autoWalkDirections:
@@ -362,6 +417,7 @@ class Mapper(threading.Thread, World):
 				self.clientSend("Arriving at destination.")
 				self.autoWalk = False
 			if command in DIRECTIONS:
+				self.autoWalkStep = (self.currentRoom.vnum, command)
 				# Send the first character of the direction to Mume.
 				self.serverSend(command[0])
 				break
@@ -372,26 +428,53 @@ class Mapper(threading.Thread, World):
 	def stopRun(self):
 		self.autoWalk = False
 		self.autoWalkDirections = []
+		self.autoWalkStep = None
+		self.autoWalkTree = None
 		return "Run canceled!"
 
+	def rerouteAutoWalk(self, blockedExit=None):
+		"""
+		Replace the remaining directions of the auto-walk with a route from the current room, avoiding the blocked exit if one is given.
+		The route tree for the destination is copied the first time, and repaired in place after that, so only the rooms whose routes are affected are searched again.
+		Return True if a new route was found, otherwise stop the run and return False.
+		"""
+		if self.autoWalkTarget is None or self.autoWalkReroutes >= AUTO_WALK_REROUTE_LIMIT:
+			self.clientSend(self.stopRun())
+			return False
+		self.autoWalkReroutes += 1
+		destinations, avoidTerrains = self.autoWalkTarget
+		tree = self.autoWalkTree
+		if tree is None or tree.stale:
+			# The map was changed since the tree was copied, so start from a correct tree and block the same exits again.
+			blocked = tree.blocked if tree is not None else ()
+			tree = self.autoWalkTree = self.routeCache.walkTree(self.pathGraph, self.rooms, destinations, avoidTerrains)
+			for vnum, direction in blocked:
+				tree.blockExit(self.rooms, self.reverseExits, vnum, direction)
+		if blockedExit is not None:
+			tree.blockExit(self.rooms, self.reverseExits, *blockedExit)
+		result = tree.route(self.rooms, self.currentRoom.vnum)
+		if result is None:
+			self.clientSend("No routes found.")
+			self.clientSend(self.stopRun())
+			return False
+		self.autoWalkStep = None
+		self.autoWalkDirections = self.pathCommands(self.currentRoom, result[1])
+		if not self.autoWalkDirections:
+			self.autoWalk = False
+			self.clientSend("Arriving at destination.")
+		return True
+
 	def sync(self, name=None, desc=None, exits=None, vnum=None):
-		if vnum:
-			if vnum in self.labels:
-				vnum = self.labels[vnum]
-			if vnum in self.rooms:
-				self.currentRoom = self.rooms[vnum]
+		if vnum is not None:
+			if self.lookupVnum(vnum) in self.rooms:
+				self.currentRoom = self.rooms[self.lookupVnum(vnum)]
 				self.isSynced = True
 				self.clientSend("Synced to room {0} with vnum {1}".format(self.currentRoom.name, self.currentRoom.vnum))
 			else:
 				self.clientSend("No such vnum or label: {0}.".format(vnum))
 		else:
-			nameVnums = []
-			descVnums = []
-			for vnum, roomObj in self.rooms.items():
-				if roomObj.name == name:
-					nameVnums.append(vnum)
-				if desc and roomObj.desc == desc:
-					descVnums.append(vnum)
+			nameVnums = [vnum for vnum in self.roomText.withName(name) if self.rooms[vnum].name == name] if name is not None else []
+			descVnums = [vnum for vnum in self.roomText.withDesc(desc) if self.rooms[vnum].desc == desc] if desc else []
 			if not nameVnums:
 				self.clientSend("Current room not in the database. Unable to sync.")
 			elif len(descVnums) == 1:
@@ -414,11 +497,11 @@ class Mapper(threading.Thread, World):
 		for direction, exitObj in self.currentRoom.exits.items():
 			if exitObj.door and exitObj.door != "exit":
 				doors.append("{}: {}".format(direction, exitObj.door))
-			if not exitObj.to or exitObj.to == "undefined":
+			if exitObj.to == roomdata.objects.VNUM_UNDEFINED:
 				undefineds.append(direction)
-			elif exitObj.to == "death":
+			elif exitObj.to == roomdata.objects.VNUM_DEATH:
 				deathTraps.append(direction)
-			elif REVERSE_DIRECTIONS[direction] not in self.rooms[exitObj.to].exits or self.rooms[exitObj.to].exits[REVERSE_DIRECTIONS[direction]].to != self.currentRoom.vnum:
+			elif not self.isBidirectional(exitObj):
 				oneWays.append(direction)
 		if doors:
 			self.clientSend("Doors: {}".format(", ".join(doors)), showPrompt=False)
@@ -469,10 +552,10 @@ class Mapper(threading.Thread, World):
 				continue
 			if direction not in self.currentRoom.exits:
 				output.append("Adding exit '{}' to current room.".format(direction))
-				self.currentRoom.exits[direction] = self.getNewExit(direction)
+				self.setExit(self.currentRoom, self.getNewExit(direction))
 				if self.autoLinking:
-					vnums = [vnum for vnum, roomObj in self.rooms.items() if self.coordinatesAddDirection((self.currentRoom.x, self.currentRoom.y, self.currentRoom.z), direction) == (roomObj.x, roomObj.y, roomObj.z)]
-					if len(vnums) == 1 and REVERSE_DIRECTIONS[direction] in self.rooms[vnums[0]].exits and self.rooms[vnums[0]].exits[REVERSE_DIRECTIONS[direction]].to == "undefined":
+					vnums = [roomObj.vnum for roomObj in self.roomsAt(*self.coordinatesAddDirection((self.currentRoom.x, self.currentRoom.y, self.currentRoom.z), direction))]
+					if len(vnums) == 1 and REVERSE_DIRECTIONS[direction] in self.rooms[vnums[0]].exits and self.rooms[vnums[0]].exits[REVERSE_DIRECTIONS[direction]].to == roomdata.objects.VNUM_UNDEFINED:
 						output.append(self.rlink("add {} {}".format(vnums[0], direction)))
 			roomExit = self.currentRoom.exits[direction]
 			if door and "door" not in roomExit.exitFlags:
@@ -490,7 +573,7 @@ class Mapper(threading.Thread, World):
 
 	def autoMergeRoom(self, movement, roomObj):
 		output = []
-		if self.autoLinking and REVERSE_DIRECTIONS[movement] in roomObj.exits and roomObj.exits[REVERSE_DIRECTIONS[movement]].to == "undefined":
+		if self.autoLinking and REVERSE_DIRECTIONS[movement] in roomObj.exits and roomObj.exits[REVERSE_DIRECTIONS[movement]].to == roomdata.objects.VNUM_UNDEFINED:
 			output.append(self.rlink("add {} {}".format(roomObj.vnum, movement)))
 		else:
 			output.append(self.rlink("add oneway {} {}".format(roomObj.vnum, movement)))
@@ -505,14 +588,41 @@ class Mapper(threading.Thread, World):
 		newRoom.dynamicDesc = dynamic
 		newRoom.x, newRoom.y, newRoom.z = self.coordinatesAddDirection((self.currentRoom.x, self.currentRoom.y, self.currentRoom.z), movement)
 		self.rooms[vnum] = newRoom
+		self.spatialIndex.add(newRoom)
+		self.roomText.add(newRoom)
+		self.searchIndex.add(newRoom)
+		self.roomsChanged(vnum)
 		if movement not in self.currentRoom.exits:
-			self.currentRoom.exits[movement] = self.getNewExit(movement)
-		self.currentRoom.exits[movement].to = vnum
+			self.setExit(self.currentRoom, self.getNewExit(movement))
+		self.linkExit(self.currentRoom.exits[movement], vnum)
 		self.clientSend("Adding room '{}' with vnum '{}'".format(newRoom.name, vnum))
 
+	def callLater(self, delay, function, *args):
+		"""Call function with args after delay seconds."""
+		Timer(delay, function, *args).start()
+
 	def run(self):
+		handler = self.dataHandler()
+		next(handler)
+		queue = self.queue
+		while True:
+			dataType, data = queue.get()
+			if data is None:
+				break
+			with self.mapLock:
+				handler.send((dataType, data))
+		handler.close()
+		self.stopNotifications()
+		self.clientSend("Exiting mapper thread.")
+
+	def dataHandler(self):
+		"""
+		A generator which processes the (data type, data) tuples sent to it.
+		State about the room currently being received from the game is kept between items, so the same handler can be driven from a thread or an event loop.
+		"""
 		addedNewRoomFrom = None
 		scouting = False
+		forced = False
 		movement = None
 		moved = None
 		prompt = None
@@ -525,171 +635,188 @@ class Mapper(threading.Thread, World):
 		parsedHour = 0
 		parsedMinutes = 0
 		timeSynchronized = False
-		queue = self.queue
 		while True:
-			dataType, data = queue.get()
-			if data is None:
-				break
+			dataType, data = yield
+			if dataType == NOTIFICATION_DATA:
+				self.output(data)
+				continue
 			elif dataType == USER_DATA:
 				# The data was a valid mapper command, sent from the user's mud client.
 				userCommand = data.strip().split()[0]
 				args = data[len(userCommand):].strip()
 				getattr(self, "user_command_{}".format(decodeBytes(userCommand)))(decodeBytes(args))
 				continue
-			# The data was from the mud server.
-			event, data = data
-			data = stripAnsi(unescapeXML(decodeBytes(data)))
-			if event == "iac_ga":
-				if self.isSynced:
-					if self.autoMapping and moved:
-						self.updateRoomFlags(prompt)
-				elif name:
-					self.sync(name, description)
-				if self.isSynced and dynamic is not None:
-					self.roomDetails()
-					if self.autoWalkDirections and moved and self.autoWalk:
-						# The player is auto-walking. Send the next direction to Mume.
-						self.walkNextDirection()
-				addedNewRoomFrom = None
-				scouting = False
-				movement = None
-				moved = None
-				prompt = None
-				name = None
-				description = None
-				dynamic = None
-				exits = None
-			elif event == "prompt":
-				prompt = data
-				self.lastPrompt = prompt
-			elif event == "movement":
-				movement = data
-				scouting = False
-			elif scouting:
-				# Ignore room data received by scouting.
-				continue
-			elif event == "line":
-				if data.startswith("You quietly scout "):
-					scouting = True
+			# The data was a list of events from the mud server, parsed from a single chunk of received data.
+			events = data
+			self.mudEventBatches += 1
+			self.mudEventCount += len(events)
+			self.largestMudEventBatch = max(self.largestMudEventBatch, len(events))
+			for event, data in events:
+				data = stripAnsi(unescapeXML(decodeBytes(data)))
+				if event == "iac_ga":
+					if self.isSynced:
+						if self.autoMapping and moved:
+							self.updateRoomFlags(prompt)
+					elif name:
+						self.sync(name, description)
+					if self.isSynced and dynamic is not None:
+						self.roomDetails()
+						if self.autoWalk and moved:
+							# The player is auto-walking. Send the next direction to Mume, finding a new route if the player was moved off the old one.
+							self.walkNextDirection()
+					if self.autoWalk and (forced and not moved or not self.isSynced):
+						# The player was moved somewhere that the mapper couldn't follow.
+						self.clientSend(self.stopRun())
+					addedNewRoomFrom = None
+					scouting = False
+					forced = False
+					movement = None
+					moved = None
+					prompt = None
+					name = None
+					description = None
+					dynamic = None
+					exits = None
+				elif event == "prompt":
+					prompt = data
+					self.lastPrompt = prompt
+				elif event == "movement":
+					movement = data
+					scouting = False
+				elif scouting:
+					# Ignore room data received by scouting.
 					continue
-				elif data == "Wet, cold and filled with mud you drop down into a dark and moist cave, while you notice the mud above you moving to close the hole you left in the cave ceiling.":
-					self.sync(vnum="17189")
-				elif data == "The gravel below your feet loosens, shifting slightly.. Suddenly, you lose your balance and crash to the cave floor below.":
-					self.sync(vnum="15324")
-				elif not timeSynchronized:
-					if timeEvent is None:
-						if CLOCK_REGEX.match(data):
-							hour, minutes, amPm = CLOCK_REGEX.match(data).groups()
-							# parsedHour should be 0 - 23.
-							parsedHour = int(hour) % 12 + (12 if amPm == "pm" else 0)
-							parsedMinutes = int(minutes)
-							if parsedHour == 23 and parsedMinutes == 59:
-								Timer(1.0, self.serverSend, "look at clock").start()
-							else:
-								timeEvent = "clock"
+				elif event == "line":
+					if data.startswith("You quietly scout "):
+						scouting = True
+						continue
+					elif data == "Wet, cold and filled with mud you drop down into a dark and moist cave, while you notice the mud above you moving to close the hole you left in the cave ceiling.":
+						self.sync(vnum=17189)
+					elif data == "The gravel below your feet loosens, shifting slightly.. Suddenly, you lose your balance and crash to the cave floor below.":
+						self.sync(vnum=15324)
+					elif not timeSynchronized:
+						if timeEvent is None:
+							if CLOCK_REGEX.match(data):
+								hour, minutes, amPm = CLOCK_REGEX.match(data).groups()
+								# parsedHour should be 0 - 23.
+								parsedHour = int(hour) % 12 + (12 if amPm == "pm" else 0)
+								parsedMinutes = int(minutes)
+								if parsedHour == 23 and parsedMinutes == 59:
+									self.callLater(1.0, self.serverSend, "look at clock")
+								else:
+									timeEvent = "clock"
+									self.serverSend("time")
+							elif DAWN_REGEX.match(data):
+								timeEvent = "dawn"
+								timeEventOffset = 0
 								self.serverSend("time")
-						elif DAWN_REGEX.match(data):
-							timeEvent = "dawn"
-							timeEventOffset = 0
-							self.serverSend("time")
-						elif DAY_REGEX.match(data):
-							timeEvent = "dawn"
-							timeEventOffset = 1
-							self.serverSend("time")
-						elif DUSK_REGEX.match(data):
-							timeEvent = "dusk"
+							elif DAY_REGEX.match(data):
+								timeEvent = "dawn"
+								timeEventOffset = 1
+								self.serverSend("time")
+							elif DUSK_REGEX.match(data):
+								timeEvent = "dusk"
+								timeEventOffset = 0
+								self.serverSend("time")
+							elif NIGHT_REGEX.match(data):
+								timeEvent = "dusk"
+								timeEventOffset = 1
+								self.serverSend("time")
+						elif TIME_REGEX.match(data):
+							match = TIME_REGEX.match(data)
+							day = int(match.group("day"))
+							year = int(match.group("year"))
+							month = 0
+							for i, m in enumerate(MONTHS):
+								if m["westron"] == match.group("month") or m["sindarin"] == match.group("month"):
+									month = i
+									break
+							if timeEvent == "dawn" or timeEvent == "dusk":
+								parsedHour = MONTHS[month][timeEvent] + timeEventOffset
+								parsedMinutes = 0
+							self.clock.epoch = timeToEpoch(year, month, day, parsedHour, parsedMinutes)
+							timeEvent = None
 							timeEventOffset = 0
-							self.serverSend("time")
-						elif NIGHT_REGEX.match(data):
-							timeEvent = "dusk"
-							timeEventOffset = 1
-							self.serverSend("time")
-					elif TIME_REGEX.match(data):
-						match = TIME_REGEX.match(data)
-						day = int(match.group("day"))
-						year = int(match.group("year"))
-						month = 0
-						for i, m in enumerate(MONTHS):
-							if m["westron"] == match.group("month") or m["sindarin"] == match.group("month"):
-								month = i
-								break
-						if timeEvent == "dawn" or timeEvent == "dusk":
-							parsedHour = MONTHS[month][timeEvent] + timeEventOffset
-							parsedMinutes = 0
-						self.clock.epoch = timeToEpoch(year, month, day, parsedHour, parsedMinutes)
-						timeEvent = None
-						timeEventOffset = 0
-						timeSynchronized = True
-						self.clientSend("Synchronized with epoch {}.".format(self.clock.epoch), showPrompt=False)
-				if MOVEMENT_FORCED_REGEX.search(data) or MOVEMENT_PREVENTED_REGEX.search(data):
-					self.stopRun()
-				if self.isSynced and self.autoMapping:
-					if data == "It's too difficult to ride here." and self.currentRoom.ridable != "notridable":
-						self.clientSend(self.rridable("notridable"))
-					elif data == "You are already riding." and self.currentRoom.ridable != "ridable":
-						self.clientSend(self.rridable("ridable"))
-			elif event == "name":
-				name = simplified(data) if data not in ("You just see a dense fog around you...", "It is pitch black...") else ""
-			elif event == "description":
-				description = simplified(data)
-			elif event == "dynamic":
-				dynamic = data
-				moved = None
-				addedNewRoomFrom = None
-				exits = None
-				if not timeSynchronized and timeEvent is None and "A huge clock is standing here." in data:
-					self.serverSend("look at clock")
-				if not self.isSynced or movement is None:
-					continue
-				elif not movement:
-					# The player was forcibly moved in an unknown direction.
-					self.isSynced = False
-					self.clientSend("Forced movement, no longer synced.")
-				elif movement not in DIRECTIONS:
-					self.isSynced = False
-					self.clientSend("Error: Invalid direction '{0}'. Map no longer synced!".format(movement))
-				elif not self.autoMapping and movement not in self.currentRoom.exits:
-					self.isSynced = False
-					self.clientSend("Error: direction '{0}' not in database. Map no longer synced!".format(movement))
-				elif not self.autoMapping and self.currentRoom.exits[movement].to not in self.rooms:
-					self.isSynced = False
-					self.clientSend("Error: vnum ({0}) in direction ({1}) is not in the database. Map no longer synced!".format(self.currentRoom.exits[movement].to, movement))
-				else:
-					if self.autoMapping and movement in DIRECTIONS and (movement not in self.currentRoom.exits or self.currentRoom.exits[movement].to not in self.rooms):
-						# Player has moved in a direction that either doesn't exist in the database or links to an invalid vnum (E.G. undefined).
-						if self.autoMerging and name and description:
-							duplicateRooms = self.searchRooms(exactMatch=True, name=name, desc=description)
-						else:
-							duplicateRooms = None
-						if not name:
-							self.clientSend("Unable to add new room: empty room name.")
-						elif not description:
-							self.clientSend("Unable to add new room: empty room description.")
-						elif duplicateRooms and len(duplicateRooms) == 1:
-							self.autoMergeRoom(movement, duplicateRooms[0])
-						else:
-							# Create new room.
-							addedNewRoomFrom = self.currentRoom.vnum
-							self.addNewRoom(movement, name, description, dynamic)
-					self.currentRoom = self.rooms[self.currentRoom.exits[movement].to]
-					moved = movement
-					movement = None
-					if self.autoMapping and self.autoUpdating:
-						if name and self.currentRoom.name != name:
-							self.currentRoom.name = name
-							self.clientSend("Updating room name.")
-						if description and self.currentRoom.desc != description:
-							self.currentRoom.desc = description
-							self.clientSend("Updating room description.")
-						if dynamic and self.currentRoom.dynamicDesc != dynamic:
-							self.currentRoom.dynamicDesc = dynamic
-							self.clientSend("Updating room dynamic description.")
-			elif event == "exits":
-				exits = data
-				if self.autoMapping and self.isSynced and moved:
-					if addedNewRoomFrom and REVERSE_DIRECTIONS[moved] in exits:
-						self.currentRoom.exits[REVERSE_DIRECTIONS[moved]] = self.getNewExit(direction=REVERSE_DIRECTIONS[moved], to=addedNewRoomFrom)
-					self.updateExitFlags(exits)
-				addedNewRoomFrom = None
-		# end while, mapper thread ending.
-		self.clientSend("Exiting mapper thread.")
+							timeSynchronized = True
+							self.clientSend("Synchronized with epoch {}.".format(self.clock.epoch), showPrompt=False)
+					if self.autoWalk and self.autoWalkStep is not None and MOVEMENT_BLOCKED_REGEX.search(data):
+						# Route around the exit instead of stopping.
+						blockedExit = self.autoWalkStep
+						self.clientSend("The way {} is blocked. Finding a new route.".format(blockedExit[1]))
+						if self.isSynced and self.rerouteAutoWalk(blockedExit):
+							self.walkNextDirection()
+					elif MOVEMENT_FORCED_REGEX.search(data):
+						# An auto-walk can carry on from wherever the player was moved to, which is known once the room arrives.
+						forced = True
+						if not self.autoWalk:
+							self.stopRun()
+					elif MOVEMENT_BLOCKED_REGEX.search(data) or MOVEMENT_PREVENTED_REGEX.search(data):
+						self.stopRun()
+					if self.isSynced and self.autoMapping:
+						if data == "It's too difficult to ride here." and self.currentRoom.ridable != "notridable":
+							self.clientSend(self.rridable("notridable"))
+						elif data == "You are already riding." and self.currentRoom.ridable != "ridable":
+							self.clientSend(self.rridable("ridable"))
+				elif event == "name":
+					name = simplified(data) if data not in ("You just see a dense fog around you...", "It is pitch black...") else ""
+				elif event == "description":
+					description = simplified(data)
+				elif event == "dynamic":
+					dynamic = data
+					moved = None
+					addedNewRoomFrom = None
+					exits = None
+					if not timeSynchronized and timeEvent is None and "A huge clock is standing here." in data:
+						self.serverSend("look at clock")
+					if not self.isSynced or movement is None:
+						continue
+					elif not movement:
+						# The player was forcibly moved in an unknown direction.
+						self.isSynced = False
+						self.clientSend("Forced movement, no longer synced.")
+					elif movement not in DIRECTIONS:
+						self.isSynced = False
+						self.clientSend("Error: Invalid direction '{0}'. Map no longer synced!".format(movement))
+					elif not self.autoMapping and movement not in self.currentRoom.exits:
+						self.isSynced = False
+						self.clientSend("Error: direction '{0}' not in database. Map no longer synced!".format(movement))
+					elif not self.autoMapping and self.currentRoom.exits[movement].to not in self.rooms:
+						self.isSynced = False
+						self.clientSend("Error: vnum ({0}) in direction ({1}) is not in the database. Map no longer synced!".format(self.currentRoom.exits[movement].to, movement))
+					else:
+						if self.autoMapping and movement in DIRECTIONS and (movement not in self.currentRoom.exits or self.currentRoom.exits[movement].to not in self.rooms):
+							# Player has moved in a direction that either doesn't exist in the database or links to an invalid vnum (E.G. undefined).
+							if self.autoMerging and name and description:
+								duplicateRooms = self.getRoomsByNameAndDesc(name, description)
+							else:
+								duplicateRooms = None
+							if not name:
+								self.clientSend("Unable to add new room: empty room name.")
+							elif not description:
+								self.clientSend("Unable to add new room: empty room description.")
+							elif duplicateRooms and len(duplicateRooms) == 1:
+								self.autoMergeRoom(movement, duplicateRooms[0])
+							else:
+								# Create new room.
+								addedNewRoomFrom = self.currentRoom.vnum
+								self.addNewRoom(movement, name, description, dynamic)
+						self.currentRoom = self.rooms[self.currentRoom.exits[movement].to]
+						moved = movement
+						movement = None
+						if self.autoMapping and self.autoUpdating:
+							if name and self.currentRoom.name != name:
+								self.setRoomText(self.currentRoom, name=name)
+								self.clientSend("Updating room name.")
+							if description and self.currentRoom.desc != description:
+								self.setRoomText(self.currentRoom, desc=description)
+								self.clientSend("Updating room description.")
+							if dynamic and self.currentRoom.dynamicDesc != dynamic:
+								self.setRoomText(self.currentRoom, dynamicDesc=dynamic)
+								self.clientSend("Updating room dynamic description.")
+				elif event == "exits":
+					exits = data
+					if self.autoMapping and self.isSynced and moved:
+						if addedNewRoomFrom is not None and REVERSE_DIRECTIONS[moved] in exits:
+							self.setExit(self.currentRoom, self.getNewExit(direction=REVERSE_DIRECTIONS[moved], to=addedNewRoomFrom))
+						self.updateExitFlags(exits)
+					addedNewRoomFrom = None
@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
+import asyncio
 import os
 import subprocess
 import sys
@@ -38,12 +39,26 @@ class MPI(threading.Thread):
 			self.editor = os.getenv("TINTINEDITOR", "nano -w")
 			self.pager = os.getenv("TINTINPAGER", "less")
 
+	def _writeFile(self, prefix, text):
+		with tempfile.NamedTemporaryFile(suffix=".txt", prefix=prefix, delete=False) as fileObj:
+			fileObj.write(text.replace("\n", "\r\n").encode("utf-8"))
+		return fileObj
+
+	def _editResponse(self, session, fileObj, lastModified):
+		if os.path.getmtime(fileObj.name) == lastModified:
+			# The user closed the text editor without saving. Cancel the editing session.
+			response = b"C" + session.encode("utf-8")
+		else:
+			with open(fileObj.name, "rb") as fileObj:
+				response = b"E" + session.encode("utf-8") + b"\n" + fileObj.read()
+		response = response.replace(b"\r", b"").replace(IAC, IAC + IAC).strip() + b"\n"
+		return b"".join((b"~$#EE", str(len(response)).encode("utf-8"), b"\n", response))
+
 	def run(self):
 		if self.command not in ("V", "E") or self.data is None:
 			return
 		elif self.command == "V":
-			with tempfile.NamedTemporaryFile(suffix=".txt", prefix="mume_viewing_", delete=False) as fileObj:
-				fileObj.write(self.data.replace("\n", "\r\n").encode("utf-8"))
+			fileObj = self._writeFile("mume_viewing_", self.data)
 			if self.isTinTin:
 				print("MPICOMMAND:{0} {1}:MPICOMMAND".format(self.pager, fileObj.name))
 			else:
@@ -52,8 +67,7 @@ class MPI(threading.Thread):
 				removeFile(fileObj)
 		elif self.command == "E":
 			session, description, body = self.data[1:].split("\n", 2)
-			with tempfile.NamedTemporaryFile(suffix=".txt", prefix="mume_editing_", delete=False) as fileObj:
-				fileObj.write(body.replace("\n", "\r\n").encode("utf-8"))
+			fileObj = self._writeFile("mume_editing_", body)
 			lastModified = os.path.getmtime(fileObj.name)
 			if self.isTinTin:
 				print("MPICOMMAND:{0} {1}:MPICOMMAND".format(self.editor, fileObj.name))
@@ -64,12 +78,31 @@ class MPI(threading.Thread):
 			else:
 				editorProcess = subprocess.Popen(self.editor.split() + [fileObj.name])
 				editorProcess.wait()
-			if os.path.getmtime(fileObj.name) == lastModified:
-				# The user closed the text editor without saving. Cancel the editing session.
-				response = b"C" + session.encode("utf-8")
+			self._server.sendall(self._editResponse(session, fileObj, lastModified))
+			removeFile(fileObj)
+
+	async def runAsync(self):
+		"""The same as run, but waits for the pager or editor without blocking the event loop."""
+		loop = asyncio.get_event_loop()
+		if self.command not in ("V", "E") or self.data is None:
+			return
+		elif self.command == "V":
+			fileObj = self._writeFile("mume_viewing_", self.data)
+			if self.isTinTin:
+				print("MPICOMMAND:{0} {1}:MPICOMMAND".format(self.pager, fileObj.name))
+			else:
+				pagerProcess = await asyncio.create_subprocess_exec(*(self.pager.split() + [fileObj.name]))
+				await pagerProcess.wait()
+				removeFile(fileObj)
+		elif self.command == "E":
+			session, description, body = self.data[1:].split("\n", 2)
+			fileObj = self._writeFile("mume_editing_", body)
+			lastModified = os.path.getmtime(fileObj.name)
+			if self.isTinTin:
+				print("MPICOMMAND:{0} {1}:MPICOMMAND".format(self.editor, fileObj.name))
+				await loop.run_in_executor(None, input, "Continue:")
 			else:
-				with open(fileObj.name, "rb") as fileObj:
-					response = b"E" + session.encode("utf-8") + b"\n" + fileObj.read()
-			response = response.replace(b"\r", b"").replace(IAC, IAC + IAC).strip() + b"\n"
-			self._server.sendall(b"".join((b"~$#EE", str(len(response)).encode("utf-8"), b"\n", response)))
+				editorProcess = await asyncio.create_subprocess_exec(*(self.editor.split() + [fileObj.name]))
+				await editorProcess.wait()
+			self._server.sendall(self._editResponse(session, fileObj, lastModified))
 			removeFile(fileObj)
@@ -0,0 +1,212 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+from telnetlib import IAC, GA, DO, WILL, theNULL, SB, SE, TTYPE, NAWS
+
+from .tokenizer import TOKEN_TEXT, TOKEN_NEWLINE, TOKEN_TAG, TOKEN_TELNET, TOKEN_SUBOPTION, TOKEN_PASSTHROUGH, TOKEN_MPI, Tokenizer
+from .utils import unescapeXML
+
+
+CHARSET = chr(42).encode("us-ascii")
+SB_REQUEST, SB_ACCEPTED, SB_REJECTED, SB_TTABLE_IS, SB_TTABLE_REJECTED, SB_TTABLE_ACK, SB_TTABLE_NAK = (chr(i).encode("us-ascii") for i in range(1, 8))
+CHARSETS = {
+	"ascii": b"US-ASCII",
+	"latin-1": b"ISO-8859-1",
+	"utf-8": b"UTF-8"
+}
+DEFAULT_CHARSET = CHARSETS["ascii"]
+INITIAL_OUTPUT = b"".join((IAC, DO, TTYPE, IAC, DO, NAWS))
+IGNORE_BYTES = frozenset([ord(theNULL), 0x11])
+ORD_IAC = ord(IAC)
+ORD_GA = ord(GA)
+ORD_SE = ord(SE)
+ORD_CHARSET = ord(CHARSET)
+MODE_NONE = 0
+MODE_ROOM = 1
+MODE_NAME = 2
+MODE_DESCRIPTION = 3
+MODE_EXITS = 4
+MODE_PROMPT = 5
+MODE_TERRAIN = 6
+TAG_REPLACEMENTS = {
+	b"prompt": b"PROMPT:",
+	b"/prompt": b":PROMPT",
+	b"name": b"NAME:",
+	b"/name": b":NAME",
+	b"tell": b"TELL:",
+	b"/tell": b":TELL",
+	b"narrate": b"NARRATE:",
+	b"/narrate": b":NARRATE",
+	b"pray": b"PRAY:",
+	b"/pray": b":PRAY",
+	b"say": b"SAY:",
+	b"/say": b":SAY",
+	b"emote": b"EMOTE:",
+	b"/emote": b":EMOTE"
+}
+
+
+class ServerParser(object):
+	"""
+	Parses the telnet, character set, MPI, and XML data received from Mume.
+	The parser knows nothing about sockets or threads, so it can be driven from a thread, an asyncio protocol, or a file containing previously captured data.
+	"""
+	def __init__(self, outputFormat="normal", promptTerminator=IAC + GA):
+		self.outputFormat = outputFormat
+		self.promptTerminator = promptTerminator
+		self.encounteredInitialOutput = False
+		self.inCharset = False
+		self.inCharsetResponse = False
+		self.charsetResponseCode = None
+		self.charsetResponseBuffer = bytearray()
+		self.inGratuitous = False
+		self.xmlMode = MODE_NONE
+		self._clientBuffer = bytearray()
+		self._textBuffer = bytearray()
+		self._lineBuffer = bytearray()
+		self._tokenizer = Tokenizer(isLineStartFunc=lambda: self._clientBuffer.endswith(b"\n"))
+
+	def feed(self, data):
+		"""
+		Parse a chunk of data received from the server.
+		Returns a tuple containing the bytes to be sent to the client, a list of replies to be sent to the server, and a list of (event, data) tuples for the mapper.
+		Complete MPI messages are included in the mapper events as ('mpi', (command, data)) tuples, and should be handled by the caller.
+		"""
+		tinTinFormat = self.outputFormat == "tintin"
+		rawFormat = self.outputFormat == "raw"
+		clientBuffer = self._clientBuffer
+		textBuffer = self._textBuffer
+		lineBuffer = self._lineBuffer
+		serverReplies = []
+		events = []
+		inCharset = self.inCharset
+		inCharsetResponse = self.inCharsetResponse
+		inGratuitous = self.inGratuitous
+		xmlMode = self.xmlMode
+		if not self.encounteredInitialOutput and data.startswith(INITIAL_OUTPUT):
+			# The connection to Mume has been established, and the game has just responded with the login screen.
+			# Identify for Mume Remote Editing.
+			serverReplies.append(b"~$#EI\n")
+			# Turn on XML mode.
+			serverReplies.append(b"~$#EX2\n3G\n")
+			# Tell the Mume server to put IAC-GA at end of prompts.
+			serverReplies.append(b"~$#EP2\nG\n")
+			# Tell the server that we will negotiate the character set.
+			serverReplies.append(IAC + WILL + CHARSET)
+			inCharset = True
+			self.encounteredInitialOutput = True
+		for tokenType, token in self._tokenizer.feed(data):
+			if tokenType == TOKEN_TEXT or tokenType == TOKEN_NEWLINE:
+				# Plain text, not part of a Telnet negotiation, MPI negotiation, or XML tag name.
+				if xmlMode != MODE_NONE:
+					textBuffer.extend(token)
+				elif tokenType == TOKEN_TEXT:
+					lineBuffer.extend(token)
+				elif lineBuffer:
+					for line in bytes(lineBuffer).splitlines():
+						if line.strip():
+							events.append(("line", line))
+					del lineBuffer[:]
+				else:
+					lineBuffer.extend(token)
+				if rawFormat or not inGratuitous:
+					clientBuffer.extend(token)
+			elif tokenType == TOKEN_TAG:
+				if xmlMode == MODE_NONE:
+					if token.startswith(b"exits"):
+						xmlMode = MODE_EXITS
+					elif token.startswith(b"prompt"):
+						xmlMode = MODE_PROMPT
+					elif token.startswith(b"room"):
+						xmlMode = MODE_ROOM
+					elif token.startswith(b"movement"):
+						events.append(("movement", token[8:].replace(b" dir=", b"", 1).split(b"/", 1)[0]))
+				elif xmlMode == MODE_ROOM:
+					if token.startswith(b"name"):
+						xmlMode = MODE_NAME
+					elif token.startswith(b"description"):
+						xmlMode = MODE_DESCRIPTION
+					elif token.startswith(b"terrain"):
+						# Terrain tag only comes up in blindness or fog
+						xmlMode = MODE_TERRAIN
+					elif token.startswith(b"gratuitous"):
+						inGratuitous = True
+					elif token.startswith(b"/gratuitous"):
+						inGratuitous = False
+					elif token.startswith(b"/room"):
+						events.append(("dynamic", bytes(textBuffer)))
+						xmlMode = MODE_NONE
+				elif xmlMode == MODE_NAME and token.startswith(b"/name"):
+					events.append(("name", bytes(textBuffer)))
+					xmlMode = MODE_ROOM
+				elif xmlMode == MODE_DESCRIPTION and token.startswith(b"/description"):
+					events.append(("description", bytes(textBuffer)))
+					xmlMode = MODE_ROOM
+				elif xmlMode == MODE_TERRAIN and token.startswith(b"/terrain"):
+					xmlMode = MODE_ROOM
+				elif xmlMode == MODE_EXITS and token.startswith(b"/exits"):
+					events.append(("exits", bytes(textBuffer)))
+					xmlMode = MODE_NONE
+				elif xmlMode == MODE_PROMPT and token.startswith(b"/prompt"):
+					events.append(("prompt", bytes(textBuffer)))
+					xmlMode = MODE_NONE
+				if tinTinFormat:
+					clientBuffer.extend(TAG_REPLACEMENTS.get(token, b""))
+				elif rawFormat:
+					clientBuffer.extend(b"<" + token + b">")
+				del textBuffer[:]
+			elif tokenType == TOKEN_TELNET:
+				clientBuffer.extend(token)
+				byte = token[-1]
+				if byte == ORD_SE:
+					# Sub-option negotiation end
+					if inCharset and inCharsetResponse:
+						# IAC SE was erroneously added to the client buffer. Remove it.
+						del clientBuffer[-2:]
+						self.charsetResponseCode = None
+						del self.charsetResponseBuffer[:]
+						inCharsetResponse = False
+						inCharset = False
+				elif byte == ORD_IAC:
+					# This is an escaped IAC byte to be added to the buffer.
+					if xmlMode == MODE_NONE:
+						lineBuffer.append(byte)
+				elif byte == ORD_CHARSET and inCharset and clientBuffer[-3:] == IAC + DO + CHARSET:
+					# Negotiate the character set.
+					serverReplies.append(IAC + SB + CHARSET + SB_REQUEST + b";" + DEFAULT_CHARSET + IAC + SE)
+					# IAC + DO + CHARSET was appended to the client buffer earlier.
+					# It must be removed as character set negotiation data should not be sent to the mud client.
+					del clientBuffer[-3:]
+				elif byte == ORD_GA:
+					# Replace the IAC-GA sequence (used by the game to terminate a prompt) with the user specified prompt terminator.
+					del clientBuffer[-2:]
+					clientBuffer.extend(self.promptTerminator)
+					events.append(("iac_ga", b""))
+					if xmlMode == MODE_NONE:
+						lineBuffer.extend(b"\r\n")
+			elif tokenType == TOKEN_SUBOPTION:
+				for byte in bytearray(token):
+					if byte == ORD_CHARSET and inCharset and clientBuffer[-2:] == IAC + SB:
+						# Character set negotiation responses should *not* be sent to the client.
+						del clientBuffer[-2:]
+						inCharsetResponse = True
+					elif inCharsetResponse and byte not in IGNORE_BYTES:
+						if self.charsetResponseCode is None:
+							self.charsetResponseCode = byte
+						else:
+							self.charsetResponseBuffer.append(byte)
+					else:
+						clientBuffer.append(byte)
+			elif tokenType == TOKEN_PASSTHROUGH:
+				clientBuffer.extend(token)
+			elif tokenType == TOKEN_MPI:
+				events.append(("mpi", token))
+		self.inCharset = inCharset
+		self.inCharsetResponse = inCharsetResponse
+		self.inGratuitous = inGratuitous
+		self.xmlMode = xmlMode
+		clientData = bytes(clientBuffer)
+		del clientBuffer[:]
+		return clientData if rawFormat else unescapeXML(clientData, isbytes=True), serverReplies, events
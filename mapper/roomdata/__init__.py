@@ -3,7 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
-from . import database, objects
+from . import database, graph, indexes, journal, objects, query, snapshot
 
 
-__all__ = ["database", "objects"]
+__all__ = ["database", "graph", "indexes", "journal", "objects", "query", "snapshot"]
@@ -3,9 +3,15 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
+from array import array
+import binascii
 import codecs
 import json
+import mmap
 import os.path
+import struct
+import sys
+import zlib
 
 try:
 	import rapidjson
@@ -25,6 +31,37 @@ SAMPLE_MAP_FILE = "arda.json.sample"
 MAP_DIRECTORY = getDirectoryPath("maps")
 MAP_FILE_PATH = os.path.join(MAP_DIRECTORY, MAP_FILE)
 SAMPLE_MAP_FILE_PATH = os.path.join(MAP_DIRECTORY, SAMPLE_MAP_FILE)
+LANDMARKS_FILE = "arda.landmarks"
+LANDMARKS_FILE_PATH = os.path.join(MAP_DIRECTORY, LANDMARKS_FILE)
+# The landmarks file starts with a header holding the file format version, the checksum of the map the landmarks were built for, the number of rooms and landmarks, and the CRC of the tables which follow.
+# The tables are stored in little endian byte order, starting with the room numbers of the landmarks.
+LANDMARKS_HEADER = struct.Struct("<4sH20sIII")
+LANDMARKS_MAGIC = b"MMLM"
+LANDMARKS_VERSION = 1
+SNAPSHOT_FILE = "arda.snapshot"
+SNAPSHOT_FILE_PATH = os.path.join(MAP_DIRECTORY, SNAPSHOT_FILE)
+# The snapshot file starts with a header holding the file format version, the checksum of the map database file it was built from, and the length and CRC of the body which follows.
+SNAPSHOT_HEADER = struct.Struct("<4sH20sQI")
+SNAPSHOT_MAGIC = b"MMSS"
+SNAPSHOT_VERSION = 2
+JOURNAL_FILE = "arda.journal"
+JOURNAL_FILE_PATH = os.path.join(MAP_DIRECTORY, JOURNAL_FILE)
+
+
+def _dumpAtomically(filePath, data, beforeReplace=None):
+	"""
+	Write data to a temporary file, and only move it over filePath once it's safely on disk, so that a crash can't leave a partly written file behind.
+	Data is either bytes, or an iterable of bytes objects which are written one after the other. If beforeReplace is given, it's called once the data is on disk, just before filePath is replaced.
+	"""
+	tempFilePath = filePath + ".tmp"
+	with open(tempFilePath, "wb") as fileObj:
+		for chunk in (data,) if isinstance(data, bytes) else data:
+			fileObj.write(chunk)
+		fileObj.flush()
+		os.fsync(fileObj.fileno())
+	if beforeReplace is not None:
+		beforeReplace()
+	os.replace(tempFilePath, filePath)
 
 
 def _load(filePath):
@@ -66,8 +103,7 @@ def loadLabels():
 
 
 def dumpLabels(labels):
-	with codecs.open(LABELS_FILE_PATH, "wb", encoding="utf-8") as fileObj:
-		json.dump(labels, fileObj, sort_keys=True, indent=2, separators=(",", ": "))
+	_dumpAtomically(LABELS_FILE_PATH, json.dumps(labels, sort_keys=True, indent=2, separators=(",", ": ")).encode("utf-8"))
 
 
 def loadRooms():
@@ -86,9 +122,167 @@ def loadRooms():
 		return None, result
 
 
+def loadRoomsData():
+	"""Return the contents of the map database file which loadRooms would read, as bytes, or None if neither file can be read."""
+	for filePath in (MAP_FILE_PATH, SAMPLE_MAP_FILE_PATH):
+		try:
+			with open(filePath, "rb") as fileObj:
+				return fileObj.read()
+		except EnvironmentError:
+			continue
+	return None
+
+
+def encodeRoomItems(items):
+	"""Yield the contents of a map database file holding the rooms in the given (vnum, room dict) tuples, which are sorted by vnum, one room at a time as bytes. Joined together, they are the same as encodeRooms returns for a dict of the rooms."""
+	dumps = rapidjson.dumps if rapidjson is not None else json.dumps
+	separator = "{\n  "
+	for vnum, roomDict in items:
+		# Strings are escaped in JSON, so every newline in the room's text is part of the indentation.
+		yield "{}{}: {}".format(separator, json.dumps(vnum), dumps(roomDict, sort_keys=True, indent=2).replace("\n", "\n  ")).encode("utf-8")
+		separator = ",\n  "
+	yield b"{}" if separator == "{\n  " else b"\n}"
+
+
+def encodeRooms(rooms):
+	"""Return the contents of a map database file holding the given rooms dict, as bytes."""
+	return b"".join(encodeRoomItems(sorted(rooms.items())))
+
+
+def dumpRoomsData(data, beforeReplace=None):
+	"""Replace the map database file with data returned by encodeRooms, or the bytes objects yielded by encodeRoomItems. If beforeReplace is given, it's called once the data is on disk, just before the file is replaced."""
+	_dumpAtomically(MAP_FILE_PATH, data, beforeReplace)
+
+
 def dumpRooms(rooms):
-	with codecs.open(MAP_FILE_PATH, "wb", encoding="utf-8") as fileObj:
-		if rapidjson is not None:
-			rapidjson.dump(rooms, fileObj, sort_keys=True, indent=2, chunk_size=2**16)
-		else:
-			fileObj.write(json.dumps(rooms, sort_keys=True, indent=2))
+	dumpRoomsData(encodeRooms(rooms))
+
+
+def loadLandmarks(checksum):
+	"""Return a tuple of the landmark room numbers and a list of cost arrays saved for the map with the given checksum, or None if the file is missing, damaged, or was saved for a different map."""
+	try:
+		with open(LANDMARKS_FILE_PATH, "rb") as fileObj:
+			header = fileObj.read(LANDMARKS_HEADER.size)
+			tables = fileObj.read()
+	except EnvironmentError:
+		return None
+	if len(header) != LANDMARKS_HEADER.size:
+		return None
+	magic, version, fileChecksum, roomCount, landmarkCount, crc = LANDMARKS_HEADER.unpack(header)
+	if magic != LANDMARKS_MAGIC or version != LANDMARKS_VERSION or fileChecksum != checksum or len(tables) != 4 * landmarkCount + 16 * landmarkCount * roomCount or zlib.crc32(tables) & 0xffffffff != crc:
+		return None
+	nodes = array("i", tables[:4 * landmarkCount])
+	costs = [array("d", tables[offset:offset + 8 * roomCount]) for offset in range(4 * landmarkCount, len(tables), 8 * roomCount)]
+	if sys.byteorder != "little":
+		for values in [nodes] + costs:
+			values.byteswap()
+	return nodes, costs
+
+
+def dumpLandmarks(checksum, nodes, costs):
+	arrays = [array("i", nodes)] + [array("d", values) for values in costs]
+	if sys.byteorder != "little":
+		for values in arrays:
+			values.byteswap()
+	tables = b"".join(values.tobytes() for values in arrays)
+	roomCount = len(costs[0]) if costs else 0
+	_dumpAtomically(LANDMARKS_FILE_PATH, LANDMARKS_HEADER.pack(LANDMARKS_MAGIC, LANDMARKS_VERSION, checksum, roomCount, len(nodes), zlib.crc32(tables) & 0xffffffff) + tables)
+
+
+def loadSnapshot(checksum):
+	"""Return a memory map of the map snapshot file, if it was saved for the map database file with the given checksum, otherwise None. The body starts after SNAPSHOT_HEADER. The caller closes the memory map."""
+	try:
+		with open(SNAPSHOT_FILE_PATH, "rb") as fileObj:
+			data = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+	except (EnvironmentError, ValueError):
+		# Empty files can't be memory mapped.
+		return None
+	if len(data) >= SNAPSHOT_HEADER.size:
+		magic, version, fileChecksum, length, crc = SNAPSHOT_HEADER.unpack_from(data)
+		if magic == SNAPSHOT_MAGIC and version == SNAPSHOT_VERSION and fileChecksum == checksum and length == len(data) - SNAPSHOT_HEADER.size:
+			with memoryview(data) as view:
+				isValid = zlib.crc32(view[SNAPSHOT_HEADER.size:]) & 0xffffffff == crc
+			if isValid:
+				return data
+	data.close()
+	return None
+
+
+def dumpSnapshot(checksum, body):
+	_dumpAtomically(SNAPSHOT_FILE_PATH, SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, checksum, len(body), zlib.crc32(body) & 0xffffffff) + body)
+
+
+def _journalLine(record):
+	return json.dumps(record, sort_keys=True).encode("utf-8") + b"\n"
+
+
+def _hexChecksum(checksum):
+	return binascii.hexlify(checksum).decode("ascii")
+
+
+def loadJournal(checksum):
+	"""
+	Return a list of (vnum, room dict) tuples for the rooms recorded in the journal since the map database file with the given checksum was written, oldest first, or None if the journal is missing or was kept for a different file. The room dict is None for a deleted room.
+	The journal may also belong to an older map database file, if it was still being replaced by the file with the given checksum when the mapper stopped. Every record is a complete room, so replaying the ones which were already written to the newer file does no harm.
+	"""
+	try:
+		with open(JOURNAL_FILE_PATH, "rb") as fileObj:
+			lines = fileObj.read().splitlines()
+	except EnvironmentError:
+		return None
+	hexChecksum = _hexChecksum(checksum)
+	isCurrent = False
+	records = []
+	for lineNumber, line in enumerate(lines):
+		try:
+			record = json.loads(line.decode("utf-8"))
+			if lineNumber == 0:
+				isCurrent = record["checksum"] == hexChecksum
+			elif "next" in record:
+				# The map database file was about to be replaced by the one with this checksum.
+				isCurrent = isCurrent or record["next"] == hexChecksum
+			else:
+				records.append((record["vnum"], record["room"]))
+		except (ValueError, KeyError, TypeError):
+			# A record which was only partly written when the mapper stopped.
+			if lineNumber == 0:
+				return None
+	return records if isCurrent else None
+
+
+def resetJournal(checksum, records=()):
+	"""Replace the journal with one for the map database file with the given checksum, holding the given (vnum, room dict) tuples."""
+	_dumpAtomically(JOURNAL_FILE_PATH, _journalLine({"checksum": _hexChecksum(checksum)}) + b"".join(_journalLine({"vnum": vnum, "room": roomDict}) for vnum, roomDict in records))
+
+
+def setAsideJournal():
+	"""Move a journal which can't be replayed out of the way, so that its records can still be recovered by hand. Returns the path it was moved to."""
+	corruptedFilePath = JOURNAL_FILE_PATH + ".corrupted"
+	os.replace(JOURNAL_FILE_PATH, corruptedFilePath)
+	return corruptedFilePath
+
+
+def openJournal():
+	"""Return the journal file opened for appending records."""
+	fileObj = open(JOURNAL_FILE_PATH, "a+b")
+	fileObj.seek(0, os.SEEK_END)
+	if fileObj.tell():
+		fileObj.seek(-1, os.SEEK_END)
+		if fileObj.read(1) != b"\n":
+			# Keep the next record off the line of one which was only partly written.
+			fileObj.write(b"\n")
+			fileObj.flush()
+	return fileObj
+
+
+def appendJournal(fileObj, records):
+	"""Append (vnum, room dict) tuples to a journal file opened by openJournal. The records are handed to the operating system straight away, so that they survive the mapper crashing."""
+	fileObj.write(b"".join(_journalLine({"vnum": vnum, "room": roomDict}) for vnum, roomDict in records))
+	fileObj.flush()
+
+
+def markJournal(fileObj, checksum):
+	"""Note in a journal file opened by openJournal that the map database file is about to be replaced by the one with the given checksum."""
+	fileObj.write(_journalLine({"next": _hexChecksum(checksum)}))
+	fileObj.flush()
+	os.fsync(fileObj.fileno())
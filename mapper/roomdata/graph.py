@@ -0,0 +1,822 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+from array import array
+from collections import OrderedDict
+import hashlib
+import heapq
+import threading
+import weakref
+
+from . import database
+from .objects import EXIT_FLAG_TABLE, TERRAIN_COSTS
+from ..timers import Timer
+
+
+# Extra costs for moving through exits with these flags, on top of the cost of the room being entered.
+DOOR_COST = 5.0
+AVOID_EXIT_COST = 1000.0
+# The extra cost of entering rooms with terrain that the user asked to avoid.
+AVOID_TERRAIN_COST = 10.0
+# No move can cost less than entering the cheapest terrain, so the A* heuristic scales coordinate distances by this.
+MINIMUM_MOVE_COST = min(TERRAIN_COSTS.values())
+PATH_ALGORITHMS = ("dijkstra", "astar", "bidirectional", "landmarks")
+INFINITY = float("inf")
+# Costs which are this close are treated as equal, since adding the same costs in a different order can give slightly different results.
+COST_TOLERANCE = 1e-6
+# The number of shortest path trees which are kept by the route cache.
+ROUTE_CACHE_SIZE = 8
+# The number of landmark rooms whose distances are stored, and how many of them are used to guide each search.
+LANDMARK_COUNT = 8
+ACTIVE_LANDMARK_COUNT = 2
+# The landmark tables are rebuilt once the map has been left unchanged for this many seconds.
+LANDMARK_REBUILD_DELAY = 30.0
+# The number of times the 2-opt pass of tourOrder tries to improve a tour.
+TOUR_IMPROVEMENT_PASSES = 20
+DOOR_EXIT_MASK = EXIT_FLAG_TABLE.bits["door"] | EXIT_FLAG_TABLE.bits["climb"]
+AVOID_EXIT_MASK = EXIT_FLAG_TABLE.bits["avoid"]
+
+
+def exitCost(exitObj):
+	"""Return the extra cost of moving through an exit, on top of the cost of the room being entered."""
+	flags = exitObj._exitFlags
+	return (DOOR_COST if flags & DOOR_EXIT_MASK else 0.0) + (AVOID_EXIT_COST if flags & AVOID_EXIT_MASK else 0.0)
+
+
+def roomCost(roomObj, avoidTerrains):
+	"""Return the cost of entering a room."""
+	return roomObj.cost + AVOID_TERRAIN_COST if roomObj.terrain in avoidTerrains else roomObj.cost
+
+
+class Graph(object):
+	"""
+	A snapshot of the map in a compact form for path finding.
+	Rooms are numbered from 0, and the exits of room i are stored in positions offsets[i] to offsets[i + 1] of the edge arrays (compressed sparse row format).
+	Exits to undefined rooms, death traps, and vnums which aren't in the map are left out.
+	The snapshot must not be used after the map changes. GraphCache takes care of rebuilding it.
+	"""
+	def __init__(self, rooms):
+		self.vnums = array("l", rooms)
+		self.indexes = {vnum: i for i, vnum in enumerate(self.vnums)}
+		indexes = self.indexes
+		self.roomCosts = array("d")
+		self.xs = array("l")
+		self.ys = array("l")
+		self.zs = array("l")
+		self.offsets = array("l", [0])
+		self.sources = array("l")
+		self.targets = array("l")
+		self.edgeCosts = array("d")
+		self.directions = []
+		terrainIds = {}
+		self.terrains = array("B")
+		# Building the graph from a lazily loaded map shouldn't keep every room in memory.
+		peek = getattr(rooms, "peek", rooms.__getitem__)
+		for source, vnum in enumerate(self.vnums):
+			roomObj = peek(vnum)
+			self.roomCosts.append(roomObj.cost)
+			self.xs.append(roomObj.x)
+			self.ys.append(roomObj.y)
+			self.zs.append(roomObj.z)
+			self.terrains.append(terrainIds.setdefault(roomObj.terrain, len(terrainIds)))
+			for direction, exitObj in roomObj.exits.items():
+				target = indexes.get(exitObj.to)
+				if target is None:
+					continue
+				self.sources.append(source)
+				self.targets.append(target)
+				self.edgeCosts.append(exitCost(exitObj))
+				self.directions.append(direction)
+			self.offsets.append(len(self.targets))
+		self.terrainIds = terrainIds
+		self._costsCache = {}
+		self._reverse = None
+		self._checksum = None
+
+	def __len__(self):
+		return len(self.vnums)
+
+	def nodeCosts(self, avoidTerrains=frozenset()):
+		"""Return the cost of entering each room, including the penalty for terrains which should be avoided."""
+		avoidIds = frozenset(self.terrainIds[terrain] for terrain in avoidTerrains if terrain in self.terrainIds)
+		if avoidIds not in self._costsCache:
+			if avoidIds:
+				self._costsCache[avoidIds] = array("d", (cost + AVOID_TERRAIN_COST if terrain in avoidIds else cost for cost, terrain in zip(self.roomCosts, self.terrains)))
+			else:
+				self._costsCache[avoidIds] = self.roomCosts
+		return self._costsCache[avoidIds]
+
+	def reverseEdges(self):
+		"""Return the offsets and edge numbers of the exits leading into each room, in the same format as the forward edges. They're only built when first needed."""
+		if self._reverse is None:
+			counts = [0] * (len(self.vnums) + 1)
+			for target in self.targets:
+				counts[target + 1] += 1
+			for i in range(len(self.vnums)):
+				counts[i + 1] += counts[i]
+			reverseOffsets = array("l", counts)
+			reverseEdges = array("l", bytes(reverseOffsets.itemsize * len(self.targets)))
+			for edge, target in enumerate(self.targets):
+				reverseEdges[counts[target]] = edge
+				counts[target] += 1
+			self._reverse = (reverseOffsets, reverseEdges)
+		return self._reverse
+
+	def pathCost(self, edges, nodeCosts):
+		return sum(nodeCosts[self.targets[edge]] + self.edgeCosts[edge] for edge in edges)
+
+	def checksum(self):
+		"""Return a digest of the rooms, exits, and costs in the graph, which identifies the version of the map that data derived from the graph was built from."""
+		if self._checksum is None:
+			digest = hashlib.sha1()
+			for values in (self.vnums, self.roomCosts, self.offsets, self.targets, self.edgeCosts):
+				digest.update(values.tobytes())
+			self._checksum = digest.digest()
+		return self._checksum
+
+	def distances(self, start, reverse=False):
+		"""Return an array of the cost of the cheapest path from the room numbered start to every room, or from every room to start if reverse is True. Rooms which can't be reached have a cost of INFINITY."""
+		nodeCosts = self.roomCosts
+		edgeCosts = self.edgeCosts
+		if reverse:
+			offsets, edgeNumbers = self.reverseEdges()
+			neighbors = self.sources
+		else:
+			offsets = self.offsets
+			edgeNumbers = range(len(self.targets))
+			neighbors = self.targets
+		distances = array("d", [INFINITY]) * len(self.vnums)
+		distances[start] = 0.0
+		heap = [(0.0, start)]
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap:
+			cost, node = heappop(heap)
+			if cost > distances[node]:
+				continue
+			for i in range(offsets[node], offsets[node + 1]):
+				edge = edgeNumbers[i]
+				neighbor = neighbors[edge]
+				# The cost of moving through an exit includes the cost of the room it leads to.
+				neighborCost = cost + nodeCosts[node if reverse else neighbor] + edgeCosts[edge]
+				if neighborCost < distances[neighbor]:
+					distances[neighbor] = neighborCost
+					heappush(heap, (neighborCost, neighbor))
+		return distances
+
+	def shortestPath(self, origin, destinations, avoidTerrains=frozenset(), algorithm="dijkstra", landmarks=None):
+		"""
+		Find the cheapest path from the origin vnum to the closest of the destination vnums.
+		The algorithm is one of PATH_ALGORITHMS:
+		'dijkstra' expands rooms in order of cost from the origin.
+		'astar' expands rooms in order of cost plus the coordinate distance to the nearest destination, so that rooms in the direction of the destination are tried first.
+		The distance never overestimates the remaining cost as long as exits lead to neighboring coordinates, but exits which jump across the map can make A* return a more expensive path.
+		'bidirectional' searches from both ends at once, and doesn't depend on coordinates.
+		'landmarks' works like 'astar', but estimates the remaining cost from the distances stored in the given Landmarks object, so it always returns the cheapest path. Dijkstra's algorithm is used if the landmarks were built for a different version of the map.
+		Return a tuple of the cost and a list of (vnum, direction) tuples for the moves which make up the path, or None if none of the destinations can be reached.
+		"""
+		indexes = self.indexes
+		start = indexes.get(origin)
+		goals = frozenset(indexes[vnum] for vnum in destinations if vnum in indexes)
+		if start is None or not goals:
+			return None
+		nodeCosts = self.nodeCosts(avoidTerrains)
+		if start in goals:
+			edges = []
+		elif algorithm == "astar":
+			edges = self._aStar(start, goals, nodeCosts)
+		elif algorithm == "bidirectional":
+			edges = self._bidirectional(start, goals, nodeCosts)
+		elif algorithm == "landmarks" and landmarks is not None and landmarks.checksum == self.checksum():
+			edges = self._landmarkSearch(start, goals, nodeCosts, landmarks)
+		else:
+			edges = self._dijkstra(start, goals, nodeCosts)
+		if edges is None:
+			return None
+		return self.pathCost(edges, nodeCosts), [(self.vnums[self.sources[edge]], self.directions[edge]) for edge in edges]
+
+	def nearestPath(self, origin, isDestination, rooms, avoidTerrains=frozenset()):
+		"""
+		Find the cheapest path from the origin vnum to the closest room for which isDestination returns True when called with the room object.
+		A single Dijkstra search is used, which stops at the first matching room, so only the rooms which are closer than it are checked.
+		Return the same as shortestPath.
+		"""
+		start = self.indexes.get(origin)
+		if start is None:
+			return None
+		goals = MatchingNodes(self, rooms, isDestination)
+		nodeCosts = self.nodeCosts(avoidTerrains)
+		edges = [] if start in goals else self._dijkstra(start, goals, nodeCosts)
+		if edges is None:
+			return None
+		return self.pathCost(edges, nodeCosts), [(self.vnums[self.sources[edge]], self.directions[edge]) for edge in edges]
+
+	def shortestPathTree(self, destinations, avoidTerrains=frozenset()):
+		"""
+		Find the cheapest paths from every room to the closest of the destination vnums, by running Dijkstra's algorithm backwards from the destinations.
+		Return a dict mapping the vnum of each room which can reach a destination to the cost of getting there, and a dict mapping the same vnums to the direction of the first move, or None for the destinations.
+		"""
+		reverseOffsets, reverseEdges = self.reverseEdges()
+		nodeCosts = self.nodeCosts(avoidTerrains)
+		sources = self.sources
+		edgeCosts = self.edgeCosts
+		distances = [INFINITY] * len(self.vnums)
+		nextEdges = [-1] * len(self.vnums)
+		heap = []
+		for vnum in destinations:
+			if vnum in self.indexes:
+				distances[self.indexes[vnum]] = 0.0
+				heap.append((0.0, self.indexes[vnum]))
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap:
+			cost, node = heappop(heap)
+			if cost > distances[node]:
+				continue
+			nodeCost = nodeCosts[node]
+			for i in range(reverseOffsets[node], reverseOffsets[node + 1]):
+				edge = reverseEdges[i]
+				neighbor = sources[edge]
+				neighborCost = cost + nodeCost + edgeCosts[edge]
+				if neighborCost < distances[neighbor]:
+					distances[neighbor] = neighborCost
+					nextEdges[neighbor] = edge
+					heappush(heap, (neighborCost, neighbor))
+		vnums = self.vnums
+		directions = self.directions
+		reachable = [node for node, cost in enumerate(distances) if cost < INFINITY]
+		return {vnums[node]: distances[node] for node in reachable}, {vnums[node]: directions[nextEdges[node]] if nextEdges[node] >= 0 else None for node in reachable}
+
+	def distancesFrom(self, start, goals, nodeCosts):
+		"""Return a list of the costs of the cheapest paths from the room numbered start to each of the rooms numbered in goals, stopping once they have all been reached. Rooms which can't be reached have a cost of INFINITY."""
+		offsets = self.offsets
+		targets = self.targets
+		edgeCosts = self.edgeCosts
+		distances = [INFINITY] * len(self.vnums)
+		distances[start] = 0.0
+		remaining = set(goals)
+		heap = [(0.0, start)]
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap and remaining:
+			cost, node = heappop(heap)
+			if cost > distances[node]:
+				continue
+			remaining.discard(node)
+			for edge in range(offsets[node], offsets[node + 1]):
+				neighbor = targets[edge]
+				neighborCost = cost + nodeCosts[neighbor] + edgeCosts[edge]
+				if neighborCost < distances[neighbor]:
+					distances[neighbor] = neighborCost
+					heappush(heap, (neighborCost, neighbor))
+		return [distances[goal] for goal in goals]
+
+	def distanceMatrix(self, vnums, avoidTerrains=frozenset()):
+		"""Return a list of rows with the cost of the cheapest path from each of the given vnums to each of the others, using one Dijkstra search per room, which stops once every room has been reached. Raises KeyError if a vnum isn't in the graph."""
+		nodes = [self.indexes[vnum] for vnum in vnums]
+		nodeCosts = self.nodeCosts(avoidTerrains)
+		return [self.distancesFrom(node, nodes, nodeCosts) for node in nodes]
+
+	def _edgesTo(self, node, start, parentEdges):
+		"""Follow the parent edges back from node to start, returning the edges in order from start."""
+		edges = []
+		sources = self.sources
+		while node != start:
+			edge = parentEdges[node]
+			edges.append(edge)
+			node = sources[edge]
+		edges.reverse()
+		return edges
+
+	def _dijkstra(self, start, goals, nodeCosts):
+		offsets = self.offsets
+		targets = self.targets
+		edgeCosts = self.edgeCosts
+		distances = [INFINITY] * len(self.vnums)
+		parentEdges = [-1] * len(self.vnums)
+		distances[start] = 0.0
+		heap = [(0.0, start)]
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap:
+			cost, node = heappop(heap)
+			if node in goals:
+				return self._edgesTo(node, start, parentEdges)
+			elif cost > distances[node]:
+				# A cheaper path to this room was found after this entry was pushed.
+				continue
+			for edge in range(offsets[node], offsets[node + 1]):
+				neighbor = targets[edge]
+				neighborCost = cost + nodeCosts[neighbor] + edgeCosts[edge]
+				if neighborCost < distances[neighbor]:
+					distances[neighbor] = neighborCost
+					parentEdges[neighbor] = edge
+					heappush(heap, (neighborCost, neighbor))
+		return None
+
+	def _aStar(self, start, goals, nodeCosts):
+		offsets = self.offsets
+		targets = self.targets
+		edgeCosts = self.edgeCosts
+		xs = self.xs
+		ys = self.ys
+		zs = self.zs
+		goalCoordinates = [(xs[goal], ys[goal], zs[goal]) for goal in goals]
+		# With a single destination, the heuristic is calculated inline, avoiding a function call for every edge.
+		singleGoal = len(goalCoordinates) == 1
+		goalX, goalY, goalZ = goalCoordinates[0]
+
+		def heuristic(node):
+			x, y, z = xs[node], ys[node], zs[node]
+			return MINIMUM_MOVE_COST * min(abs(x - goalX) + abs(y - goalY) + abs(z - goalZ) for goalX, goalY, goalZ in goalCoordinates)
+
+		distances = [INFINITY] * len(self.vnums)
+		parentEdges = [-1] * len(self.vnums)
+		distances[start] = 0.0
+		heap = [(heuristic(start), 0.0, start)]
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap:
+			estimate, cost, node = heappop(heap)
+			if node in goals:
+				return self._edgesTo(node, start, parentEdges)
+			elif cost > distances[node]:
+				continue
+			for edge in range(offsets[node], offsets[node + 1]):
+				neighbor = targets[edge]
+				neighborCost = cost + nodeCosts[neighbor] + edgeCosts[edge]
+				if neighborCost < distances[neighbor]:
+					distances[neighbor] = neighborCost
+					parentEdges[neighbor] = edge
+					heappush(heap, (neighborCost + (MINIMUM_MOVE_COST * (abs(xs[neighbor] - goalX) + abs(ys[neighbor] - goalY) + abs(zs[neighbor] - goalZ)) if singleGoal else heuristic(neighbor)), neighborCost, neighbor))
+		return None
+
+	def _landmarkSearch(self, start, goals, nodeCosts, landmarks):
+		offsets = self.offsets
+		targets = self.targets
+		edgeCosts = self.edgeCosts
+		goalBounds = [landmarks.bounds(start, goal) for goal in goals]
+		# With a single destination, the estimates are calculated inline from the best two landmarks, avoiding a function call for every room.
+		singleGoal = len(goalBounds) == 1 and len(goalBounds[0]) >= 2
+		if singleGoal:
+			(table1, goalCost1), (table2, goalCost2) = goalBounds[0][:2]
+
+		def heuristic(node):
+			return min(max([0.0] + [table[node] - goalCost for table, goalCost in bounds]) for bounds in goalBounds)
+
+		# Estimates are only worked out for the rooms which the search reaches. A negative value means that it hasn't been worked out yet.
+		estimates = [-1.0] * len(self.vnums)
+		estimates[start] = heuristic(start)
+		distances = [INFINITY] * len(self.vnums)
+		parentEdges = [-1] * len(self.vnums)
+		distances[start] = 0.0
+		heap = [(estimates[start], 0.0, start)]
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap:
+			estimate, cost, node = heappop(heap)
+			if node in goals:
+				return self._edgesTo(node, start, parentEdges)
+			elif cost > distances[node]:
+				continue
+			for edge in range(offsets[node], offsets[node + 1]):
+				neighbor = targets[edge]
+				neighborCost = cost + nodeCosts[neighbor] + edgeCosts[edge]
+				if neighborCost < distances[neighbor]:
+					remaining = estimates[neighbor]
+					if remaining < 0.0:
+						remaining = estimates[neighbor] = max(table1[neighbor] - goalCost1, table2[neighbor] - goalCost2, 0.0) if singleGoal else heuristic(neighbor)
+					if remaining == INFINITY:
+						# None of the destinations can be reached from this room.
+						continue
+					distances[neighbor] = neighborCost
+					parentEdges[neighbor] = edge
+					heappush(heap, (neighborCost + remaining, neighborCost, neighbor))
+		return None
+
+	def _bidirectional(self, start, goals, nodeCosts):
+		offsets = self.offsets
+		sources = self.sources
+		targets = self.targets
+		edgeCosts = self.edgeCosts
+		reverseOffsets, reverseEdges = self.reverseEdges()
+		forwardDistances = [INFINITY] * len(self.vnums)
+		backwardDistances = [INFINITY] * len(self.vnums)
+		forwardEdges = [-1] * len(self.vnums)
+		# The edge leading out of each room on the cheapest known path towards a destination.
+		backwardEdges = [-1] * len(self.vnums)
+		forwardDistances[start] = 0.0
+		forwardHeap = [(0.0, start)]
+		backwardHeap = []
+		for goal in goals:
+			backwardDistances[goal] = 0.0
+			backwardHeap.append((0.0, goal))
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		best = INFINITY
+		meeting = -1
+		while forwardHeap and backwardHeap and forwardHeap[0][0] + backwardHeap[0][0] < best:
+			# Expand the search whose next room is closer to its starting point.
+			if forwardHeap[0][0] <= backwardHeap[0][0]:
+				cost, node = heappop(forwardHeap)
+				if cost > forwardDistances[node]:
+					continue
+				for edge in range(offsets[node], offsets[node + 1]):
+					neighbor = targets[edge]
+					neighborCost = cost + nodeCosts[neighbor] + edgeCosts[edge]
+					if neighborCost < forwardDistances[neighbor]:
+						forwardDistances[neighbor] = neighborCost
+						forwardEdges[neighbor] = edge
+						heappush(forwardHeap, (neighborCost, neighbor))
+						if neighborCost + backwardDistances[neighbor] < best:
+							best = neighborCost + backwardDistances[neighbor]
+							meeting = neighbor
+			else:
+				cost, node = heappop(backwardHeap)
+				if cost > backwardDistances[node]:
+					continue
+				nodeCost = nodeCosts[node]
+				for i in range(reverseOffsets[node], reverseOffsets[node + 1]):
+					edge = reverseEdges[i]
+					neighbor = sources[edge]
+					neighborCost = cost + nodeCost + edgeCosts[edge]
+					if neighborCost < backwardDistances[neighbor]:
+						backwardDistances[neighbor] = neighborCost
+						backwardEdges[neighbor] = edge
+						heappush(backwardHeap, (neighborCost, neighbor))
+						if neighborCost + forwardDistances[neighbor] < best:
+							best = neighborCost + forwardDistances[neighbor]
+							meeting = neighbor
+		if meeting < 0:
+			return None
+		edges = self._edgesTo(meeting, start, forwardEdges)
+		node = meeting
+		while node not in goals:
+			edge = backwardEdges[node]
+			edges.append(edge)
+			node = targets[edge]
+		return edges
+
+
+def tourCost(matrix, order):
+	"""Return the cost of visiting the rooms of a distance matrix in the given order of row numbers."""
+	return sum(matrix[source][target] for source, target in zip(order, order[1:]))
+
+
+def tourOrder(matrix, start=0):
+	"""
+	Return a list of the row numbers of a distance matrix in an order which visits every room once, beginning with start, at a low total cost.
+	The tour is built by always going to the nearest room which hasn't been visited, then improved by reversing parts of it while that makes it cheaper (2-opt). It isn't guaranteed to be the cheapest tour.
+	"""
+	remaining = set(range(len(matrix))) - {start}
+	order = [start]
+	while remaining:
+		source = order[-1]
+		nearest = min(remaining, key=lambda target: (matrix[source][target], target))
+		order.append(nearest)
+		remaining.remove(nearest)
+	bestCost = tourCost(matrix, order)
+	for attempt in range(TOUR_IMPROVEMENT_PASSES):
+		improved = False
+		for i in range(1, len(order) - 1):
+			for j in range(i + 1, len(order)):
+				# The paths between rooms can cost different amounts in each direction, so the whole tour is costed again.
+				candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+				cost = tourCost(matrix, candidate)
+				if cost < bestCost - COST_TOLERANCE:
+					order = candidate
+					bestCost = cost
+					improved = True
+		if not improved:
+			break
+	return order
+
+
+class MatchingNodes(object):
+	"""Acts like a set of the room numbers in a graph whose rooms match a predicate. The predicate is only called for the rooms which are looked up, and the results are remembered."""
+	def __init__(self, graph, rooms, predicate):
+		self._vnums = graph.vnums
+		self._peek = getattr(rooms, "peek", rooms.__getitem__)
+		self._predicate = predicate
+		self._matches = {}
+
+	def __contains__(self, node):
+		result = self._matches.get(node)
+		if result is None:
+			result = self._matches[node] = bool(self._predicate(self._peek(self._vnums[node])))
+		return result
+
+
+class Landmarks(object):
+	"""
+	The costs of the cheapest paths from and to a few landmark rooms spread around the map, which the 'landmarks' path finding algorithm uses to estimate the remaining cost of a route (the ALT method: A*, landmarks, and the triangle inequality).
+	The path from room v to room t can't cost less than d(L, t) - d(L, v) or d(v, L) - d(t, L) for any landmark L, where d(a, b) is the cost of the cheapest path from a to b.
+	Avoiding terrains only makes paths more expensive, so the estimates stay valid whichever terrains are avoided.
+	"""
+	def __init__(self, checksum, nodes, tables):
+		self.checksum = checksum
+		self.nodes = nodes
+		# Arrays indexed by room number. The first half hold -d(L, v) for each landmark, and the second half hold d(v, L), so that every estimate is tables[i][v] - tables[i][t].
+		self.tables = tables
+
+	@classmethod
+	def build(cls, graph, count=LANDMARK_COUNT):
+		"""Choose landmarks which are far apart from each other, and find the costs to and from them."""
+		nodes = []
+		fromLandmarks = []
+		toLandmarks = []
+		# Start with the room which is farthest from an arbitrary room, then keep adding the room which is farthest from its closest landmark.
+		closest = graph.distances(0) if len(graph) else []
+		while len(nodes) < count:
+			node = max((node for node, cost in enumerate(closest) if cost < INFINITY), key=closest.__getitem__, default=None)
+			if node is None or closest[node] == 0.0:
+				break
+			nodes.append(node)
+			costs = graph.distances(node)
+			closest = array("d", map(min, closest, costs)) if len(nodes) > 1 else costs
+			fromLandmarks.append(array("d", map(float.__neg__, costs)))
+			toLandmarks.append(graph.distances(node, reverse=True))
+		return cls(graph.checksum(), nodes, fromLandmarks + toLandmarks)
+
+	@classmethod
+	def load(cls, checksum):
+		"""Load the landmarks saved for the version of the map with the given checksum, returning None if there aren't any."""
+		result = database.loadLandmarks(checksum)
+		if result is None:
+			return None
+		nodes, tables = result
+		return cls(checksum, list(nodes), tables)
+
+	def save(self):
+		database.dumpLandmarks(self.checksum, self.nodes, self.tables)
+
+	def bounds(self, start, goal):
+		"""Return (table, goal cost) tuples for the landmarks which give the highest estimates of the cost from start to goal, where the estimate for room v is table[v] - goal cost."""
+		bounds = [(table, table[goal]) for table in self.tables if abs(table[goal]) < INFINITY]
+		bounds.sort(key=lambda bound: bound[0][start] - bound[1], reverse=True)
+		return bounds[:ACTIVE_LANDMARK_COUNT]
+
+
+class LandmarkCache(object):
+	"""
+	Holds the landmarks for a map.
+	The landmarks are only loaded from disk or built in a background thread once they are first requested. When the map changes, they are dropped, and new ones are built once the map has been left alone for a while.
+	"""
+	def __init__(self):
+		self._landmarks = None
+		self._generation = 0
+		self._timer = None
+		self._requested = False
+		self._lock = threading.Lock()
+
+	def get(self):
+		"""Return the landmarks for the current version of the map, or None if they aren't ready."""
+		return self._landmarks
+
+	def request(self, getGraph, count=LANDMARK_COUNT):
+		"""Start loading or building the landmarks from the graph returned by getGraph if they aren't ready, and keep them up to date after the map changes from then on."""
+		with self._lock:
+			self._requested = True
+			if self._landmarks is None and self._timer is None:
+				self._schedule(0, getGraph, count)
+
+	def invalidate(self, getGraph, delay=LANDMARK_REBUILD_DELAY, count=LANDMARK_COUNT):
+		"""Drop the landmarks. If they were requested, schedule new ones to be built from the graph returned by getGraph after delay seconds without further changes."""
+		with self._lock:
+			self._generation += 1
+			self._landmarks = None
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+			if self._requested:
+				self._schedule(delay, getGraph, count)
+
+	def _schedule(self, delay, getGraph, count):
+		# Called while holding the lock.
+		if count > 0:
+			self._timer = Timer(delay, self._rebuild, self._generation, getGraph, count)
+			self._timer.start()
+
+	def _rebuild(self, generation, getGraph, count):
+		graph = getGraph()
+		checksum = graph.checksum()
+		landmarks = Landmarks.load(checksum)
+		isNew = landmarks is None or len(landmarks.nodes) != count
+		if isNew:
+			landmarks = Landmarks.build(graph, count)
+		with self._lock:
+			if generation != self._generation:
+				# The map changed while the landmarks were being built.
+				return
+			self._landmarks = landmarks
+			self._timer = None
+		if isNew:
+			try:
+				landmarks.save()
+			except EnvironmentError:
+				pass
+
+
+class GraphCache(object):
+	"""Holds the path finding graph for a map, building it when it's first needed after the map changes."""
+	def __init__(self):
+		self._graph = None
+		self._generation = 0
+		self._lock = threading.Lock()
+
+	def invalidate(self):
+		self._generation += 1
+		self._graph = None
+
+	def get(self, rooms):
+		graph = self._graph
+		if graph is None:
+			with self._lock:
+				generation = self._generation
+				graph = self._graph if self._graph is not None else Graph(rooms)
+				# Don't keep a graph which was built while the map was being changed.
+				if generation == self._generation:
+					self._graph = graph
+		return graph
+
+
+class RouteTree(object):
+	"""The cheapest routes from every room to a set of destinations, which can be read in time proportional to the length of the route."""
+	def __init__(self, destinations, avoidTerrains, costs, directions):
+		self.destinations = destinations
+		self.avoidTerrains = avoidTerrains
+		self.costs = costs
+		self.directions = directions
+		# (vnum, direction) tuples for the exits which routes mustn't use.
+		self.blocked = set()
+		# Set when a change to the map made the tree incorrect.
+		self.stale = False
+
+	def copy(self):
+		tree = RouteTree(self.destinations, self.avoidTerrains, dict(self.costs), dict(self.directions))
+		tree.blocked.update(self.blocked)
+		return tree
+
+	def route(self, rooms, origin):
+		"""Return a tuple of the cost and a list of (vnum, direction) tuples for the moves from the origin vnum to the closest destination, or None if there is no route."""
+		if origin not in self.costs:
+			return None
+		path = []
+		vnum = origin
+		while vnum not in self.destinations:
+			direction = self.directions[vnum]
+			path.append((vnum, direction))
+			vnum = rooms[vnum].exits[direction].to
+		return self.costs[origin], path
+
+	def blockExit(self, rooms, reverseExits, vnum, direction):
+		"""
+		Stop routes from using the exit in the given direction from the room with the given vnum, repairing the routes which led through it.
+		Only the rooms whose routes used the exit are searched again, starting from the cheapest exits out of them into the rest of the tree. Return the number of rooms which were searched.
+		"""
+		self.blocked.add((vnum, direction))
+		costs = self.costs
+		directions = self.directions
+		if vnum not in costs or directions[vnum] != direction:
+			return 0
+		avoidTerrains = self.avoidTerrains
+		blocked = self.blocked
+		# Removing an exit can't make any route cheaper, so only the rooms whose routes pass through the room lose their routes.
+		affected = {vnum}
+		stack = [vnum]
+		while stack:
+			to = stack.pop()
+			for source, sourceDirection in reverseExits.incoming(to):
+				if source not in affected and source in costs and directions[source] == sourceDirection:
+					affected.add(source)
+					stack.append(source)
+		for source in affected:
+			del costs[source]
+			del directions[source]
+		heap = []
+		for source in affected:
+			roomObj = rooms[source]
+			for exitDirection, exitObj in roomObj.exits.items():
+				if exitObj.to in costs and exitObj.to in rooms and (source, exitDirection) not in blocked:
+					heap.append((costs[exitObj.to] + roomCost(rooms[exitObj.to], avoidTerrains) + exitCost(exitObj), source, exitDirection))
+		heapq.heapify(heap)
+		heappush = heapq.heappush
+		heappop = heapq.heappop
+		while heap:
+			cost, source, exitDirection = heappop(heap)
+			if source in costs:
+				continue
+			costs[source] = cost
+			directions[source] = exitDirection
+			cost += roomCost(rooms[source], avoidTerrains)
+			for neighbor, neighborDirection in reverseExits.incoming(source):
+				if neighbor in affected and neighbor not in costs and neighbor in rooms and (neighbor, neighborDirection) not in blocked:
+					heappush(heap, (cost + exitCost(rooms[neighbor].exits[neighborDirection]), neighbor, neighborDirection))
+		return len(affected)
+
+	def isValidAfterChange(self, rooms, reverseExits, vnum):
+		"""
+		Check whether the tree is still correct after a change to the room with the given vnum or its exits, updating it if the room just became able to reach a destination.
+		A tree is correct as long as the first move from every room costs exactly the difference between the costs of the rooms at either end, and no exit offers a cheaper route. Only the exits into and out of the changed room need to be checked.
+		"""
+		costs = self.costs
+		directions = self.directions
+		roomObj = rooms.get(vnum)
+		if roomObj is None:
+			# The room was deleted, or its vnum was changed.
+			return vnum not in costs
+		avoidTerrains = self.avoidTerrains
+		blocked = self.blocked
+		bestCost = None
+		bestDirection = None
+		for direction, exitObj in roomObj.exits.items():
+			if exitObj.to in costs and exitObj.to in rooms and (vnum, direction) not in blocked:
+				cost = costs[exitObj.to] + roomCost(rooms[exitObj.to], avoidTerrains) + exitCost(exitObj)
+				if bestCost is None or cost < bestCost:
+					bestCost = cost
+					bestDirection = direction
+		if vnum in costs:
+			direction = directions[vnum]
+			if direction is not None:
+				exitObj = roomObj.exits.get(direction)
+				if exitObj is None or exitObj.to not in costs or exitObj.to not in rooms or abs(costs[exitObj.to] + roomCost(rooms[exitObj.to], avoidTerrains) + exitCost(exitObj) - costs[vnum]) > COST_TOLERANCE:
+					return False
+			if bestCost is not None and bestCost < costs[vnum] - COST_TOLERANCE:
+				return False
+		elif bestCost is not None:
+			# The room can now reach a destination. Rooms which lead into it might have been able to reach it before, in which case they need routes too.
+			if any(source not in costs for source, direction in reverseExits.incoming(vnum) if source in rooms):
+				return False
+			costs[vnum] = bestCost
+			directions[vnum] = bestDirection
+		else:
+			return True
+		# The cost of entering the room may have changed, which affects the exits leading into it.
+		cost = costs[vnum] + roomCost(roomObj, avoidTerrains)
+		for source, direction in reverseExits.incoming(vnum):
+			if source not in rooms or (source, direction) in blocked:
+				continue
+			elif source not in costs:
+				return False
+			sourceCost = cost + exitCost(rooms[source].exits[direction])
+			if sourceCost < costs[source] - COST_TOLERANCE or directions[source] == direction and abs(sourceCost - costs[source]) > COST_TOLERANCE:
+				return False
+		return True
+
+
+class RouteCache(object):
+	"""
+	Keeps the shortest path trees for recently used destinations, so that repeated routes to the same places don't need a new search.
+	Trees are checked when rooms change, and only those which are affected by the change are dropped.
+	"""
+	def __init__(self, size=ROUTE_CACHE_SIZE):
+		self.size = size
+		self._trees = OrderedDict()
+		# Private copies of trees, which are being followed by auto-walks.
+		self._walkTrees = weakref.WeakSet()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._trees)
+
+	def clear(self):
+		with self._lock:
+			self._trees.clear()
+
+	def get(self, graphCache, rooms, destinations, avoidTerrains=frozenset()):
+		"""Return the route tree for the given destination vnums and avoided terrains, building it from the path finding graph if it isn't cached."""
+		key = (frozenset(destinations), frozenset(avoidTerrains))
+		with self._lock:
+			tree = self._trees.get(key)
+			if tree is not None:
+				self._trees.move_to_end(key)
+				return tree
+		tree = RouteTree(key[0], key[1], *graphCache.get(rooms).shortestPathTree(key[0], key[1]))
+		with self._lock:
+			self._trees[key] = tree
+			while len(self._trees) > self.size:
+				self._trees.popitem(last=False)
+		return tree
+
+	def walkTree(self, graphCache, rooms, destinations, avoidTerrains=frozenset()):
+		"""Return a copy of the route tree for the given destinations, which can have exits blocked without affecting other routes. The copy is marked as stale if the map changes in a way that makes it incorrect."""
+		tree = self.get(graphCache, rooms, destinations, avoidTerrains).copy()
+		with self._lock:
+			self._walkTrees.add(tree)
+		return tree
+
+	def roomsModified(self, rooms, reverseExits, vnums):
+		"""Drop the trees which are no longer correct after changes to the rooms with the given vnums. All trees are dropped if no vnums are given."""
+		with self._lock:
+			for tree in list(self._walkTrees):
+				if not vnums or not all(tree.isValidAfterChange(rooms, reverseExits, vnum) for vnum in vnums):
+					tree.stale = True
+					self._walkTrees.discard(tree)
+			if not vnums:
+				self._trees.clear()
+				return
+			for key, tree in list(self._trees.items()):
+				if not all(tree.isValidAfterChange(rooms, reverseExits, vnum) for vnum in vnums):
+					del self._trees[key]
@@ -0,0 +1,269 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import re
+
+
+# The X and Y coordinates of a room are shifted right by this many bits to find its spatial index bucket.
+# Each bucket covers a 16 by 16 area of a single Z layer.
+BUCKET_BITS = 4
+# Most keys in the reverse exit and room text indexes only map to a few values.
+# These are stored in tuples, which are much smaller than sets, until there are more than this many values for a key.
+MAX_TUPLE_VALUES = 8
+
+
+def addValue(table, key, value):
+	"""Add a value to the collection of values stored under key in table."""
+	values = table.get(key)
+	if values is None:
+		table[key] = (value,)
+	elif isinstance(values, set):
+		values.add(value)
+	elif value not in values:
+		table[key] = values + (value,) if len(values) < MAX_TUPLE_VALUES else set(values + (value,))
+
+
+def removeValue(table, key, value):
+	"""Remove a value from the collection of values stored under key in table, deleting the key if no values remain."""
+	values = table.get(key)
+	if values is None or value not in values:
+		return
+	elif isinstance(values, set):
+		values.discard(value)
+	else:
+		values = tuple(item for item in values if item != value)
+		table[key] = values
+	if not values:
+		del table[key]
+
+
+class SpatialIndex(object):
+	"""
+	Maps X-Y-Z coordinates to the rooms located there.
+	Rooms are grouped into buckets of neighboring coordinates, so that finding the rooms in an area only has to look at the buckets which overlap it, rather than at every room in the map.
+	The index must be told about every room which is added, removed, moved, or has its vnum changed.
+	Only the coordinates are stored, and the room objects are looked up in the rooms mapping, so that indexing a lazily loaded map doesn't create every room.
+	"""
+	def __init__(self, rooms):
+		self.rooms = rooms
+		# Each bucket is a dict mapping the vnums of the rooms in the bucket to their X-Y coordinates.
+		self._buckets = {}
+
+	def __len__(self):
+		return sum(len(bucket) for bucket in self._buckets.values())
+
+	def clear(self):
+		self._buckets.clear()
+
+	def add(self, roomObj):
+		self.addCoordinates(roomObj.vnum, roomObj.x, roomObj.y, roomObj.z)
+
+	def addCoordinates(self, vnum, x, y, z):
+		key = (x >> BUCKET_BITS, y >> BUCKET_BITS, z)
+		if key in self._buckets:
+			self._buckets[key][vnum] = (x, y)
+		else:
+			self._buckets[key] = {vnum: (x, y)}
+
+	def remove(self, roomObj):
+		key = (roomObj.x >> BUCKET_BITS, roomObj.y >> BUCKET_BITS, roomObj.z)
+		bucket = self._buckets.get(key)
+		if bucket is not None and bucket.get(roomObj.vnum) == (roomObj.x, roomObj.y):
+			del bucket[roomObj.vnum]
+			if not bucket:
+				del self._buckets[key]
+
+	def move(self, roomObj, x=None, y=None, z=None):
+		"""Change the coordinates of a room, updating the index."""
+		self.remove(roomObj)
+		if x is not None:
+			roomObj.x = x
+		if y is not None:
+			roomObj.y = y
+		if z is not None:
+			roomObj.z = z
+		self.add(roomObj)
+
+	def roomsAt(self, x, y, z):
+		"""Return a list of the rooms located at the given coordinates."""
+		bucket = self._buckets.get((x >> BUCKET_BITS, y >> BUCKET_BITS, z))
+		if not bucket:
+			return []
+		return [self.rooms[vnum] for vnum, coordinates in bucket.items() if coordinates == (x, y)]
+
+	def roomsInBox(self, x1, y1, z1, x2, y2, z2):
+		"""A generator which yields the rooms with coordinates between (x1, y1, z1) and (x2, y2, z2) inclusive."""
+		if x1 > x2:
+			x1, x2 = x2, x1
+		if y1 > y2:
+			y1, y2 = y2, y1
+		if z1 > z2:
+			z1, z2 = z2, z1
+		bucketsX = range(x1 >> BUCKET_BITS, (x2 >> BUCKET_BITS) + 1)
+		bucketsY = range(y1 >> BUCKET_BITS, (y2 >> BUCKET_BITS) + 1)
+		bucketsZ = range(z1, z2 + 1)
+		if len(bucketsX) * len(bucketsY) * len(bucketsZ) > len(self._buckets):
+			# The box is larger than the occupied part of the map, so it's cheaper to check every bucket.
+			buckets = [bucket for key, bucket in self._buckets.items() if key[0] in bucketsX and key[1] in bucketsY and key[2] in bucketsZ]
+		else:
+			buckets = [self._buckets[key] for key in ((bx, by, bz) for bz in bucketsZ for by in bucketsY for bx in bucketsX) if key in self._buckets]
+		rooms = self.rooms
+		for bucket in buckets:
+			for vnum, (x, y) in bucket.items():
+				if x1 <= x <= x2 and y1 <= y <= y2:
+					yield rooms[vnum]
+
+
+class ReverseExitIndex(object):
+	"""
+	Maps the vnum of each room to the exits leading into it, as (source vnum, direction) tuples.
+	Exits to undefined rooms and death traps aren't indexed.
+	The index must be told about every exit which is added to or removed from a room, and before and after the vnum or destination of an exit changes.
+	"""
+	def __init__(self):
+		self._incoming = {}
+
+	def __len__(self):
+		return sum(len(sources) for sources in self._incoming.values())
+
+	def clear(self):
+		self._incoming.clear()
+
+	def add(self, exitObj):
+		self.addExit(exitObj.vnum, exitObj.direction, exitObj.to)
+
+	def addExit(self, source, direction, to):
+		if to >= 0:
+			addValue(self._incoming, to, (source, direction))
+
+	def remove(self, exitObj):
+		removeValue(self._incoming, exitObj.to, (exitObj.vnum, exitObj.direction))
+
+	def incoming(self, vnum):
+		"""Return a set of (source vnum, direction) tuples for the exits leading to the given vnum."""
+		return frozenset(self._incoming.get(vnum, ()))
+
+	def hasExit(self, source, direction, vnum):
+		"""Return True if the room with the source vnum has an exit in the given direction leading to vnum."""
+		sources = self._incoming.get(vnum)
+		return sources is not None and (source, direction) in sources
+
+
+def normalizeText(text):
+	return text.strip().lower()
+
+
+class RoomTextIndex(object):
+	"""
+	Maps the hashes of normalized room names and descriptions to the vnums of the rooms which have them.
+	Only the hashes are stored, so that the index doesn't keep a second copy of every description in memory.
+	Callers must check the candidate rooms returned by a lookup, since different text can have the same hash.
+	The index must be told before and after the name, description, or vnum of a room changes.
+	"""
+	def __init__(self):
+		self._names = {}
+		self._descriptions = {}
+
+	def __len__(self):
+		return sum(len(vnums) for vnums in self._names.values())
+
+	def clear(self):
+		self._names.clear()
+		self._descriptions.clear()
+
+	def _keys(self, name, desc):
+		return ((self._names, hash(normalizeText(name))), (self._descriptions, hash(normalizeText(desc))))
+
+	def add(self, roomObj):
+		self.addText(roomObj.vnum, roomObj.name, roomObj.desc)
+
+	def addText(self, vnum, name, desc):
+		for table, key in self._keys(name, desc):
+			addValue(table, key, vnum)
+
+	def remove(self, roomObj):
+		for table, key in self._keys(roomObj.name, roomObj.desc):
+			removeValue(table, key, roomObj.vnum)
+
+	def withName(self, name):
+		"""Return the vnums of the rooms which may have the given name, ignoring case and surrounding white space."""
+		return frozenset(self._names.get(hash(normalizeText(name)), ()))
+
+	def withDesc(self, desc):
+		"""Return the vnums of the rooms which may have the given description, ignoring case and surrounding white space."""
+		return frozenset(self._descriptions.get(hash(normalizeText(desc)), ()))
+
+	def withNameAndDesc(self, name, desc):
+		"""Return the vnums of the rooms which may have both the given name and description, ignoring case and surrounding white space."""
+		# Descriptions are rarely shared between rooms, so start from the rooms with the description.
+		nameVnums = self._names.get(hash(normalizeText(name)), ())
+		return frozenset(vnum for vnum in self._descriptions.get(hash(normalizeText(desc)), ()) if vnum in nameVnums)
+
+
+WORD_REGEX = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+	"""Return a list of the lower case words in text."""
+	return WORD_REGEX.findall(text.lower())
+
+
+class TextSearchIndex(object):
+	"""
+	An inverted index which maps the words in the searchable text fields of rooms to the vnums of the rooms which contain them.
+	A search term can only occur in a room if every word of the term occurs within a word of the room's text, so the vnums for a term are found by looking through the vocabulary of the field, rather than the text of every room.
+	Callers must check the candidate rooms returned by a lookup, since the words of a term may appear in the room separately.
+	The index must be told before and after a room's vnum or any of the indexed fields change, including the door names of its exits.
+	"""
+	FIELDS = ("name", "dynamicDesc", "note", "door")
+
+	def __init__(self):
+		self._words = {field: {} for field in self.FIELDS}
+
+	def __len__(self):
+		return sum(len(vnums) for words in self._words.values() for vnums in words.values())
+
+	def clear(self):
+		for words in self._words.values():
+			words.clear()
+
+	def _fieldWords(self, roomObj, field):
+		if field == "door":
+			return set(word for exitObj in roomObj.exits.values() for word in tokenize(exitObj.door))
+		return set(tokenize(getattr(roomObj, field)))
+
+	def add(self, roomObj, fields=FIELDS):
+		for field in fields:
+			self.addWords(roomObj.vnum, field, self._fieldWords(roomObj, field))
+
+	def addWords(self, vnum, field, fieldWords):
+		"""Index a set of words from the given field of a room."""
+		words = self._words[field]
+		for word in fieldWords:
+			addValue(words, word, vnum)
+
+	def remove(self, roomObj, fields=FIELDS):
+		for field in fields:
+			words = self._words[field]
+			for word in self._fieldWords(roomObj, field):
+				removeValue(words, word, roomObj.vnum)
+
+	def candidates(self, field, term):
+		"""Return a set of the vnums of the rooms whose field may contain the given term, or None if the term has no words and every room must be checked."""
+		termWords = tokenize(term)
+		if not termWords:
+			return None
+		words = self._words[field]
+		result = None
+		# Check the longest words first, since they are likely to match the fewest rooms.
+		for termWord in sorted(set(termWords), key=len, reverse=True):
+			vnums = set()
+			for word, values in words.items():
+				if termWord in word:
+					vnums.update(values)
+			result = vnums if result is None else result & vnums
+			if not result:
+				break
+		return result
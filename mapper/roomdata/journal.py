@@ -0,0 +1,87 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+from timeit import default_timer
+
+from . import database
+from .objects import vnumFromString, vnumToString
+
+
+class Journal(object):
+	"""
+	Tracks the rooms which were changed since the map database file was last written, and records each change in an append only journal file, so that changes survive a crash without rewriting the whole map.
+	The journal belongs to the map database file with a given checksum. It's replayed on top of that file when the map is loaded, and emptied when the file is written again.
+	"""
+	def __init__(self):
+		self.checksum = None
+		# The vnums of the rooms which were changed since the map database file was written.
+		self.dirty = set()
+		# The number of records in the journal file, which grows with every change until the map is written.
+		self.records = 0
+		# The value of timeit.default_timer when a room was last changed.
+		self.lastChanged = None
+		self._fileObj = None
+
+	def load(self, checksum):
+		"""Return the (vnum, room dict) tuples recorded since the map database file with the given checksum was written, and carry on appending to the journal. A journal kept for a different file is replaced with an empty one. Raises ValueError if a record holds an invalid vnum, in which case the journal is left untouched."""
+		self.close()
+		records = database.loadJournal(checksum)
+		if records is not None:
+			records = [(vnumFromString(vnum), roomDict) for vnum, roomDict in records]
+		self.checksum = checksum
+		self.dirty = set()
+		self.records = 0
+		if records is None:
+			database.resetJournal(checksum)
+			records = []
+		self._fileObj = database.openJournal()
+		self.dirty.update(vnum for vnum, roomDict in records)
+		self.records = len(records)
+		if records:
+			# The replayed changes haven't been saved, so they count as changes made when the map was loaded.
+			self.lastChanged = default_timer()
+		return records
+
+	def append(self, rooms):
+		"""Record the rooms in the given (vnum, room dict) tuples as changed. The room dict is None for a deleted room."""
+		rooms = list(rooms)
+		self.dirty.update(vnum for vnum, roomDict in rooms)
+		self.lastChanged = default_timer()
+		if self._fileObj is not None and rooms:
+			database.appendJournal(self._fileObj, [(vnumToString(vnum), roomDict) for vnum, roomDict in rooms])
+			self.records += len(rooms)
+
+	def takeDirty(self):
+		"""Return the vnums of the rooms which were changed, and start tracking changes afresh while they're being saved."""
+		dirty = self.dirty
+		self.dirty = set()
+		return dirty
+
+	def mark(self, checksum):
+		"""Note that the map database file is about to be replaced by the one with the given checksum, so that the journal is still used if the mapper stops before it's reset."""
+		if self._fileObj is not None:
+			database.markJournal(self._fileObj, checksum)
+
+	def reset(self, checksum, rooms=()):
+		"""Start a journal for the map database file with the given checksum, holding the given (vnum, room dict) tuples for the rooms which were changed after the file was gathered."""
+		rooms = list(rooms)
+		self.close()
+		self.checksum = checksum
+		self.dirty = set(vnum for vnum, roomDict in rooms)
+		self.records = len(rooms)
+		database.resetJournal(checksum, [(vnumToString(vnum), roomDict) for vnum, roomDict in rooms])
+		self._fileObj = database.openJournal()
+
+	def discard(self, checksum):
+		"""Set aside a journal which can't be replayed, and start an empty one for the map database file with the given checksum. Returns the path the old journal was moved to."""
+		self.close()
+		path = database.setAsideJournal()
+		self.reset(checksum)
+		return path
+
+	def close(self):
+		if self._fileObj is not None:
+			self._fileObj.close()
+			self._fileObj = None
@@ -3,7 +3,15 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 
+try:
+	from collections.abc import MutableSet
+except ImportError:
+	from collections import MutableSet
 import re
+try:
+	from sys import intern
+except ImportError:
+	pass
 
 from ..gui.vec2d import Vec2d
 
@@ -28,6 +36,14 @@ TERRAIN_COSTS = {
 	"underwater": 100.0,
 	"deathtrap": 1000.0
 }
+# Vnums are stored as integers internally. Exits which don't lead to a known room use these negative sentinel values, which are written to the database as 'undefined' and 'death'.
+VNUM_UNDEFINED = -1
+VNUM_DEATH = -2
+SPECIAL_VNUMS = {
+	"undefined": VNUM_UNDEFINED,
+	"death": VNUM_DEATH
+}
+SPECIAL_VNUM_NAMES = {vnum: name for name, vnum in SPECIAL_VNUMS.items()}
 VALID_MOB_FLAGS = [
 	"rent",
 	"shop",
@@ -103,7 +119,107 @@ VALID_DOOR_FLAGS = [
 ]
 
 
+def vnumFromString(text):
+	"""Convert a vnum from the string form used by the database and user commands to the internal integer form. Raises ValueError if text is neither a number nor the name of a special vnum."""
+	try:
+		return int(text)
+	except ValueError:
+		if text in SPECIAL_VNUMS:
+			return SPECIAL_VNUMS[text]
+		raise ValueError("invalid vnum '{}'".format(text))
+
+
+def vnumToString(vnum):
+	"""Convert an internal integer vnum to the string form used by the database and user commands."""
+	return SPECIAL_VNUM_NAMES[vnum] if vnum in SPECIAL_VNUM_NAMES else str(vnum)
+
+
+class FlagTable(object):
+	"""Maps flag names to the bits used for storing them in an integer bitmask."""
+	__slots__ = ("names", "bits")
+
+	def __init__(self, names):
+		self.names = list(names)
+		self.bits = {name: 1 << i for i, name in enumerate(self.names)}
+
+	def bit(self, name):
+		try:
+			return self.bits[name]
+		except KeyError:
+			# Flags which aren't in the list of valid flags still get a bit, so that they aren't lost when the map is saved.
+			name = intern(name)
+			self.bits[name] = 1 << len(self.names)
+			self.names.append(name)
+			return self.bits[name]
+
+	def toMask(self, flags):
+		mask = 0
+		for flag in flags:
+			mask |= self.bit(flag)
+		return mask
+
+	def fromMask(self, mask):
+		return [name for i, name in enumerate(self.names) if mask >> i & 1]
+
+
+MOB_FLAG_TABLE = FlagTable(VALID_MOB_FLAGS)
+LOAD_FLAG_TABLE = FlagTable(VALID_LOAD_FLAGS)
+EXIT_FLAG_TABLE = FlagTable(VALID_EXIT_FLAGS)
+DOOR_FLAG_TABLE = FlagTable(VALID_DOOR_FLAGS)
+
+
+class FlagSet(MutableSet):
+	"""A set-like view of flags which are stored as an integer bitmask in a slot of another object."""
+	__slots__ = ("_obj", "_slot", "_table")
+
+	def __init__(self, obj, slot, table):
+		self._obj = obj
+		self._slot = slot
+		self._table = table
+
+	@classmethod
+	def _from_iterable(cls, iterable):
+		# The results of operators such as | and & aren't stored in an object, so they are plain sets.
+		return set(iterable)
+
+	def __contains__(self, flag):
+		bit = self._table.bits.get(flag)
+		return bit is not None and getattr(self._obj, self._slot) & bit != 0
+
+	def __iter__(self):
+		return iter(self._table.fromMask(getattr(self._obj, self._slot)))
+
+	def __len__(self):
+		return bin(getattr(self._obj, self._slot)).count("1")
+
+	def __repr__(self):
+		# Formatted the same way as the sets which were used before, since find-format strings may include flags.
+		return repr(set(self))
+
+	def add(self, flag):
+		setattr(self._obj, self._slot, getattr(self._obj, self._slot) | self._table.bit(flag))
+
+	def discard(self, flag):
+		bit = self._table.bits.get(flag)
+		if bit is not None:
+			setattr(self._obj, self._slot, getattr(self._obj, self._slot) & ~bit)
+
+
+def _flagProperty(slot, table):
+	def getter(self):
+		return FlagSet(self, slot, table)
+
+	def setter(self, flags):
+		setattr(self, slot, flags if isinstance(flags, int) else table.toMask(flags))
+
+	return property(getter, setter)
+
+
 class Room(object):
+	__slots__ = ("vnum", "name", "desc", "dynamicDesc", "note", "terrain", "cost", "light", "align", "portable", "ridable", "avoid", "_mobFlags", "_loadFlags", "x", "y", "z", "exits")
+	mobFlags = _flagProperty("_mobFlags", MOB_FLAG_TABLE)
+	loadFlags = _flagProperty("_loadFlags", LOAD_FLAG_TABLE)
+
 	def __init__(self, vnum):
 		self.vnum = vnum
 		self.name = ""
@@ -117,8 +233,8 @@ class Room(object):
 		self.portable = "undefined"
 		self.ridable = "undefined"
 		self.avoid = False
-		self.mobFlags = set()
-		self.loadFlags = set()
+		self._mobFlags = 0
+		self._loadFlags = 0
 		self.x = 0
 		self.y = 0
 		self.z = 0
@@ -130,6 +246,13 @@ class Room(object):
 		# We'll return False because we want heapq.heappush to sort the tuples of movement cost and room object by the first item in the tuple (room cost), and the order of rooms with the same movement cost is irrelevant.
 		return False
 
+	def toDict(self):
+		"""Return the room's attributes as a dictionary, in place of vars(), which doesn't work with slots."""
+		result = {key: getattr(self, key) for key in self.__slots__ if not key.startswith("_")}
+		result["mobFlags"] = self.mobFlags
+		result["loadFlags"] = self.loadFlags
+		return result
+
 	def calculateCost(self):
 		try:
 			self.cost = TERRAIN_COSTS[self.terrain]
@@ -154,10 +277,14 @@ class Room(object):
 
 
 class Exit(object):
+	__slots__ = ("direction", "vnum", "to", "_exitFlags", "door", "_doorFlags")
+	exitFlags = _flagProperty("_exitFlags", EXIT_FLAG_TABLE)
+	doorFlags = _flagProperty("_doorFlags", DOOR_FLAG_TABLE)
+
 	def __init__(self):
 		self.direction = None
 		self.vnum = None
-		self.to = "undefined"
-		self.exitFlags = set(["exit"])
+		self.to = VNUM_UNDEFINED
+		self._exitFlags = EXIT_FLAG_TABLE.bits["exit"]
 		self.door = ""
-		self.doorFlags = set()
+		self._doorFlags = 0
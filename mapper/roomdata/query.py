@@ -0,0 +1,409 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+try:
+	from abc import ABC, abstractmethod
+except ImportError:
+	from abc import ABCMeta, abstractmethod
+	ABC = ABCMeta("ABC", (object,), {})
+from operator import attrgetter
+import re
+
+from .indexes import normalizeText
+from .objects import DOOR_FLAG_TABLE, EXIT_FLAG_TABLE, LOAD_FLAG_TABLE, MOB_FLAG_TABLE, SPECIAL_VNUMS, vnumFromString
+
+
+TOKEN_REGEX = re.compile(r"\s*(?:(?P<paren>[()])|(?P<field>[A-Za-z]+)\s*(?P<operator>[=:~])\s*(?:\"(?P<quotedValue>[^\"]*)\"|(?P<value>[^\s()\"]+))|\"(?P<phrase>[^\"]*)\"|(?P<word>[^\s()\"]+))")
+# Maps the field names used in queries to room attributes.
+TEXT_FIELDS = {
+	"name": "name",
+	"desc": "desc",
+	"dynamic": "dynamicDesc",
+	"dynamicdesc": "dynamicDesc",
+	"note": "note"
+}
+VALUE_FIELDS = {
+	"terrain": "terrain",
+	"light": "light",
+	"align": "align",
+	"portable": "portable",
+	"ridable": "ridable"
+}
+NUMBER_FIELDS = {
+	"x": "x",
+	"y": "y",
+	"z": "z",
+	"vnum": "vnum"
+}
+ROOM_FLAG_FIELDS = {
+	"mobflags": ("_mobFlags", MOB_FLAG_TABLE),
+	"mobflag": ("_mobFlags", MOB_FLAG_TABLE),
+	"loadflags": ("_loadFlags", LOAD_FLAG_TABLE),
+	"loadflag": ("_loadFlags", LOAD_FLAG_TABLE)
+}
+EXIT_FLAG_FIELDS = {
+	"exitflags": ("_exitFlags", EXIT_FLAG_TABLE),
+	"exitflag": ("_exitFlags", EXIT_FLAG_TABLE),
+	"doorflags": ("_doorFlags", DOOR_FLAG_TABLE),
+	"doorflag": ("_doorFlags", DOOR_FLAG_TABLE)
+}
+# Room attributes which have a word index that can be used for finding candidate rooms for substring matches.
+WORD_INDEXED_FIELDS = ("name", "dynamicDesc", "note")
+
+
+def allOf(predicates):
+	"""Combine predicates into a single function which returns True if they all do. Chaining them with 'and' is faster than calling all() for every room."""
+	first = predicates[0]
+	if len(predicates) == 1:
+		return first
+	rest = allOf(predicates[1:])
+	return lambda roomObj: first(roomObj) and rest(roomObj)
+
+
+def anyOf(predicates):
+	"""Combine predicates into a single function which returns True if any of them do."""
+	first = predicates[0]
+	if len(predicates) == 1:
+		return first
+	rest = anyOf(predicates[1:])
+	return lambda roomObj: first(roomObj) or rest(roomObj)
+
+
+class QueryError(ValueError):
+	"""Raised when the text of a query can't be compiled."""
+
+
+class Predicate(ABC):
+	"""
+	A node in the plan of a compiled query.
+	Nodes which can use one of the map indexes return the set of vnums which may match from candidates, so that only those rooms need to be checked.
+	Cost is a rough estimate of the time taken to check a single room, which is used to order the checks of a conjunction.
+	"""
+	cost = 1
+
+	def candidates(self, world, origin):
+		"""Return a set of the vnums which may match, or None if every room must be checked."""
+		return None
+
+	@abstractmethod
+	def compile(self, origin):
+		"""Return a function which takes a room object and returns True if it matches."""
+
+
+class And(Predicate):
+	def __init__(self, children):
+		self.children = sorted(children, key=lambda child: child.cost)
+		self.cost = sum(child.cost for child in children)
+
+	def candidates(self, world, origin):
+		result = None
+		for child in self.children:
+			vnums = child.candidates(world, origin)
+			if vnums is not None:
+				result = set(vnums) if result is None else result.intersection(vnums)
+				if not result:
+					break
+		return result
+
+	def compile(self, origin):
+		return allOf([child.compile(origin) for child in self.children])
+
+
+class Or(Predicate):
+	def __init__(self, children):
+		self.children = children
+		self.cost = sum(child.cost for child in children)
+
+	def candidates(self, world, origin):
+		result = set()
+		for child in self.children:
+			vnums = child.candidates(world, origin)
+			if vnums is None:
+				return None
+			result.update(vnums)
+		return result
+
+	def compile(self, origin):
+		return anyOf([child.compile(origin) for child in self.children])
+
+
+class Not(Predicate):
+	def __init__(self, child):
+		self.child = child
+		self.cost = child.cost
+
+	def compile(self, origin):
+		predicate = self.child.compile(origin)
+		return lambda roomObj: not predicate(roomObj)
+
+
+class Near(Predicate):
+	"""Matches rooms within a Manhattan distance of the origin."""
+	def __init__(self, distance):
+		self.distance = distance
+
+	def candidates(self, world, origin):
+		distance = self.distance
+		return set(roomObj.vnum for roomObj in world.roomsInBox(origin.x - distance, origin.y - distance, origin.z - distance, origin.x + distance, origin.y + distance, origin.z + distance) if origin.manhattanDistance(roomObj) <= distance)
+
+	def compile(self, origin):
+		distance = self.distance
+		return lambda roomObj: origin.manhattanDistance(roomObj) <= distance
+
+
+class TextMatch(Predicate):
+	"""Matches rooms where a text attribute equals or contains the given text, ignoring case."""
+	cost = 3
+
+	def __init__(self, attribute, text, exact):
+		self.attribute = attribute
+		self.text = normalizeText(text) if exact else text.lower()
+		self.exact = exact
+
+	def candidates(self, world, origin):
+		if self.exact and self.attribute == "name":
+			return world.roomText.withName(self.text)
+		elif self.exact and self.attribute == "desc":
+			return world.roomText.withDesc(self.text)
+		elif not self.exact and self.attribute in WORD_INDEXED_FIELDS:
+			return world.searchIndex.candidates(self.attribute, self.text)
+		return None
+
+	def compile(self, origin):
+		getter = attrgetter(self.attribute)
+		text = self.text
+		if self.exact:
+			return lambda roomObj: getter(roomObj).strip().lower() == text
+		return lambda roomObj: text in getter(roomObj).lower()
+
+
+class ValueMatch(Predicate):
+	"""Matches rooms where an attribute has one of the given values."""
+	def __init__(self, attribute, values):
+		self.attribute = attribute
+		self.values = frozenset(values)
+
+	def candidates(self, world, origin):
+		if self.attribute == "vnum":
+			return self.values
+		return None
+
+	def compile(self, origin):
+		getter = attrgetter(self.attribute)
+		if len(self.values) == 1:
+			value, = self.values
+			return lambda roomObj: getter(roomObj) == value
+		values = self.values
+		return lambda roomObj: getter(roomObj) in values
+
+
+class FlagMatch(Predicate):
+	"""Matches rooms which have any of the flags in a bitmask."""
+	def __init__(self, slot, mask):
+		self.slot = slot
+		self.mask = mask
+
+	def compile(self, origin):
+		getter = attrgetter(self.slot)
+		mask = self.mask
+		return lambda roomObj: getter(roomObj) & mask != 0
+
+
+class ExitMatch(Predicate):
+	"""Matches rooms which have at least one exit matching a predicate on exit objects."""
+	cost = 4
+
+	def __init__(self, exitPredicate, indexField=None, indexText=None, destination=None):
+		self.exitPredicate = exitPredicate
+		self.indexField = indexField
+		self.indexText = indexText
+		self.destination = destination
+
+	def candidates(self, world, origin):
+		if self.indexField is not None:
+			return world.searchIndex.candidates(self.indexField, self.indexText)
+		elif self.destination is not None and self.destination >= 0:
+			return set(source for source, direction in world.reverseExits.incoming(self.destination))
+		return None
+
+	def compile(self, origin):
+		exitPredicate = self.exitPredicate
+		return lambda roomObj: any(map(exitPredicate, roomObj.exits.values()))
+
+
+def flagMask(field, table, value):
+	mask = 0
+	for flag in value.lower().split("|"):
+		flag = flag.strip()
+		if flag not in table.bits:
+			raise QueryError("unknown {} '{}'".format(field, flag))
+		mask |= table.bits[flag]
+	return mask
+
+
+def makeComparison(field, operator, value):
+	"""Return a predicate for a single field comparison. The '=' operator tests equality, '~' tests if text contains the value, and ':' tests flags, or is the same as '~' for text."""
+	key = field.lower()
+	if key in TEXT_FIELDS:
+		return TextMatch(TEXT_FIELDS[key], value, exact=operator == "=")
+	elif key == "door":
+		if operator == "=":
+			door = normalizeText(value)
+			return ExitMatch(lambda exitObj: exitObj.door.strip().lower() == door, indexField="door", indexText=door)
+		door = value.lower()
+		return ExitMatch(lambda exitObj: door in exitObj.door.lower(), indexField="door", indexText=door)
+	elif operator == "~":
+		raise QueryError("the '~' operator can only be used with text fields, not '{}'".format(field))
+	elif key in VALUE_FIELDS:
+		return ValueMatch(VALUE_FIELDS[key], (item.strip() for item in value.lower().split("|")))
+	elif key in NUMBER_FIELDS:
+		try:
+			return ValueMatch(NUMBER_FIELDS[key], (int(item) for item in value.split("|")))
+		except ValueError:
+			raise QueryError("'{}' expects a number, not '{}'".format(field, value))
+	elif key in ROOM_FLAG_FIELDS:
+		slot, table = ROOM_FLAG_FIELDS[key]
+		return FlagMatch(slot, flagMask(field, table, value))
+	elif key in EXIT_FLAG_FIELDS:
+		slot, table = EXIT_FLAG_FIELDS[key]
+		getter = attrgetter(slot)
+		mask = flagMask(field, table, value)
+		return ExitMatch(lambda exitObj: getter(exitObj) & mask != 0)
+	elif key == "to":
+		value = value.strip().lower()
+		if value not in SPECIAL_VNUMS and not value.isdigit():
+			raise QueryError("'{}' expects a vnum, not '{}'".format(field, value))
+		destination = vnumFromString(value)
+		return ExitMatch(lambda exitObj: exitObj.to == destination, destination=destination)
+	raise QueryError("unknown field '{}'".format(field))
+
+
+class Parser(object):
+	"""
+	Parses the text of a query into a plan of predicates.
+	Terms are combined with 'and' (the default when no operator is given), 'or', and 'not', and can be grouped with parentheses.
+	A term is either a field comparison such as 'terrain=forest', 'near [distance]', or text to search for in room names.
+	"""
+	def __init__(self, text):
+		self.tokens = self.tokenize(text)
+		self.position = 0
+
+	def tokenize(self, text):
+		tokens = []
+		position = 0
+		text = text.rstrip()
+		while position < len(text):
+			match = TOKEN_REGEX.match(text, position)
+			if match is None:
+				raise QueryError("unable to parse '{}'".format(text[position:].strip()))
+			position = match.end()
+			if match.group("paren") is not None:
+				tokens.append(("paren", match.group("paren")))
+			elif match.group("field") is not None:
+				value = match.group("quotedValue") if match.group("value") is None else match.group("value")
+				tokens.append(("field", (match.group("field"), match.group("operator"), value)))
+			elif match.group("phrase") is not None:
+				tokens.append(("text", match.group("phrase")))
+			else:
+				word = match.group("word")
+				tokens.append(("keyword" if word.lower() in ("and", "or", "not", "near") else "text", word))
+		return tokens
+
+	def peek(self):
+		return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+	def next(self):
+		token = self.peek()
+		self.position += 1
+		return token
+
+	def parse(self):
+		if not self.tokens:
+			raise QueryError("the query is empty")
+		result = self.parseOr()
+		if self.position < len(self.tokens):
+			raise QueryError("unexpected '{}'".format(self.peek()[1]))
+		return result
+
+	def parseOr(self):
+		children = [self.parseAnd()]
+		while self.peek()[0] == "keyword" and self.peek()[1].lower() == "or":
+			self.next()
+			children.append(self.parseAnd())
+		return children[0] if len(children) == 1 else Or(children)
+
+	def parseAnd(self):
+		children = []
+		while True:
+			kind, value = self.peek()
+			if kind is None or kind == "paren" and value == ")" or kind == "keyword" and value.lower() == "or":
+				break
+			elif kind == "keyword" and value.lower() == "and":
+				self.next()
+				continue
+			children.append(self.parseTerm())
+		if not children:
+			raise QueryError("expected a search term")
+		return children[0] if len(children) == 1 else And(children)
+
+	def parseTerm(self):
+		kind, value = self.next()
+		if kind == "keyword" and value.lower() == "not":
+			if self.peek()[0] is None:
+				raise QueryError("'not' must be followed by a search term")
+			return Not(self.parseTerm())
+		elif kind == "keyword" and value.lower() == "near":
+			kind, distance = self.next()
+			if kind != "text" or not distance.isdigit():
+				raise QueryError("'near' must be followed by a distance")
+			return Near(int(distance))
+		elif kind == "paren" and value == "(":
+			result = self.parseOr()
+			if self.next() != ("paren", ")"):
+				raise QueryError("missing ')'")
+			return result
+		elif kind == "field":
+			return makeComparison(*value)
+		elif kind == "text":
+			return TextMatch("name", value, exact=False)
+		raise QueryError("unexpected '{}'".format(value))
+
+
+class Query(object):
+	"""A compiled query, which can be run against any world."""
+	def __init__(self, plan, text=""):
+		self.plan = plan
+		self.text = text
+
+	def __repr__(self):
+		return "Query({!r})".format(self.text)
+
+	def compile(self, origin):
+		"""Return a function which takes a room object and returns True if it matches the query. Origin is the room used by 'near'."""
+		return self.plan.compile(origin)
+
+	def rooms(self, world, origin=None):
+		"""Return an iterator over the rooms in world which match the query. Origin is the room used by 'near', and defaults to the current room."""
+		if origin is None:
+			origin = world.currentRoom
+		candidates = self.plan.candidates(world, origin)
+		predicate = self.plan.compile(origin)
+		rooms = world.rooms
+		if candidates is None:
+			return rooms.matching(predicate)
+		return (roomObj for roomObj in (rooms[vnum] for vnum in candidates if vnum in rooms) if predicate(roomObj))
+
+
+def compileQuery(text):
+	"""Compile the text of a query, such as 'terrain=forest loadFlags:herb door~"gate" near 50'. Raises QueryError if the text is invalid."""
+	return Query(Parser(text).parse(), text)
+
+
+def compileFields(fields, exactMatch=False):
+	"""Compile a query which matches rooms where every field in the fields dict matches its value, or return None if there are no fields."""
+	comparisons = [makeComparison(field, "=" if exactMatch or field.lower() not in TEXT_FIELDS and field.lower() != "door" else "~", value) for field, value in fields.items()]
+	if not comparisons:
+		return None
+	return Query(comparisons[0] if len(comparisons) == 1 else And(comparisons), " ".join("{}={}".format(field, value) for field, value in fields.items()))
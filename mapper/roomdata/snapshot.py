@@ -0,0 +1,362 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+from array import array
+try:
+	from collections.abc import MutableMapping
+except ImportError:
+	from collections import MutableMapping
+import hashlib
+import struct
+import sys
+try:
+	from sys import intern
+except ImportError:
+	pass
+
+from .indexes import tokenize
+from .objects import Exit, Room, VALID_DOOR_FLAGS, VALID_EXIT_FLAGS, VALID_LOAD_FLAGS, VALID_MOB_FLAGS
+
+
+# The map snapshot stores the rooms in columns, one array per attribute, with row i of every room column belonging to the same room.
+# Text attributes are stored as numbers in a table of unique strings, and the exits of room i are rows exitOffsets[i] to exitOffsets[i + 1] of the exit columns.
+# String i is bytes stringOffsets[i] to stringOffsets[i + 1] of the UTF-8 encoded strings column, so that each one can be decoded separately.
+ROOM_TEXT_COLUMNS = ("name", "desc", "dynamicDesc", "note")
+# The values of these attributes come from small sets of strings, which are interned so that every room shares the same string objects.
+ROOM_SYMBOL_COLUMNS = ("terrain", "light", "align", "portable", "ridable")
+COLUMNS = (
+	("vnum", "q"),
+	("name", "I"),
+	("desc", "I"),
+	("dynamicDesc", "I"),
+	("note", "I"),
+	("terrain", "I"),
+	("light", "I"),
+	("align", "I"),
+	("portable", "I"),
+	("ridable", "I"),
+	("avoid", "B"),
+	("cost", "d"),
+	("mobFlags", "Q"),
+	("loadFlags", "Q"),
+	("x", "i"),
+	("y", "i"),
+	("z", "i"),
+	("exitOffsets", "I"),
+	("direction", "I"),
+	("to", "q"),
+	("exitFlags", "Q"),
+	("doorFlags", "Q"),
+	("door", "I"),
+	("stringOffsets", "I"),
+	("strings", "B")
+)
+# The body of the snapshot starts with the length in bytes of each column. Columns are padded to a multiple of 8 bytes.
+DIRECTORY = struct.Struct("<{}Q".format(len(COLUMNS)))
+# Changes to these make the flag masks in older snapshots mean something else, so they are part of the checksum.
+SCHEMA = "\0".join(["1"] + [name + typecode for name, typecode in COLUMNS] + VALID_MOB_FLAGS + VALID_LOAD_FLAGS + VALID_EXIT_FLAGS + VALID_DOOR_FLAGS).encode("utf-8")
+
+
+def checksum(data):
+	"""Return a digest of the data of the map database file that a snapshot is built from, which also changes when the snapshot format does."""
+	return hashlib.sha1(SCHEMA + data).digest()
+
+
+def checksumHasher():
+	"""Return a hash object whose digest is the same as checksum returns, once it's been updated with each piece of the data of a map database file."""
+	return hashlib.sha1(SCHEMA)
+
+
+def pack(rooms):
+	"""Return the body of a snapshot of the given room objects, as bytes."""
+	columns = {name: array(typecode) for name, typecode in COLUMNS}
+	stringIds = {}
+	strings = []
+
+	def stringId(text):
+		result = stringIds.get(text)
+		if result is None:
+			result = stringIds[text] = len(strings)
+			strings.append(text.encode("utf-8"))
+		return result
+
+	textColumns = [(name, columns[name]) for name in ROOM_TEXT_COLUMNS + ROOM_SYMBOL_COLUMNS]
+	exitOffsets = columns["exitOffsets"]
+	exitOffsets.append(0)
+	for roomObj in rooms:
+		columns["vnum"].append(roomObj.vnum)
+		for name, column in textColumns:
+			column.append(stringId(getattr(roomObj, name)))
+		columns["avoid"].append(bool(roomObj.avoid))
+		columns["cost"].append(roomObj.cost)
+		columns["mobFlags"].append(roomObj._mobFlags)
+		columns["loadFlags"].append(roomObj._loadFlags)
+		columns["x"].append(roomObj.x)
+		columns["y"].append(roomObj.y)
+		columns["z"].append(roomObj.z)
+		for direction, exitObj in roomObj.exits.items():
+			columns["direction"].append(stringId(direction))
+			columns["to"].append(exitObj.to)
+			columns["exitFlags"].append(exitObj._exitFlags)
+			columns["doorFlags"].append(exitObj._doorFlags)
+			columns["door"].append(stringId(exitObj.door))
+		exitOffsets.append(len(columns["direction"]))
+	stringOffsets = columns["stringOffsets"]
+	stringOffsets.append(0)
+	for text in strings:
+		stringOffsets.append(stringOffsets[-1] + len(text))
+	columns["strings"].frombytes(b"".join(strings))
+	data = []
+	for name, typecode in COLUMNS:
+		column = columns[name]
+		if sys.byteorder != "little":
+			column.byteswap()
+		data.append(column.tobytes())
+	return DIRECTORY.pack(*(len(values) for values in data)) + b"".join(values + bytes(-len(values) % 8) for values in data)
+
+
+class Snapshot(object):
+	"""
+	Reads the rooms from the body of a snapshot, starting at the given offset in a bytes object or a memory map.
+	On little endian machines the columns are read straight from the memory map, so only the parts which are used are loaded from the file. The memory map mustn't be closed until close has been called.
+	"""
+	def __init__(self, data, offset=0):
+		self._data = data
+		self._view = memoryview(data)
+		self.columns = {}
+		lengths = DIRECTORY.unpack_from(self._view, offset)
+		offset += DIRECTORY.size
+		for (name, typecode), length in zip(COLUMNS, lengths):
+			if sys.byteorder == "little":
+				column = self._view[offset:offset + length].cast(typecode)
+			else:
+				column = array(typecode)
+				column.frombytes(self._view[offset:offset + length])
+				column.byteswap()
+			self.columns[name] = column
+			offset += length + -length % 8
+		self._strings = self.columns.pop("strings")
+		self._stringOffsets = self.columns.pop("stringOffsets")
+		self._symbols = {}
+
+	def __len__(self):
+		return len(self.columns["vnum"])
+
+	def close(self):
+		"""Copy the columns which are still read from the memory map into memory, so that the memory map can be closed."""
+		if self._view is None:
+			return
+		for name, column in list(self.columns.items()):
+			if isinstance(column, memoryview):
+				self.columns[name] = array(column.format, column.tobytes())
+				column.release()
+		if isinstance(self._strings, memoryview):
+			strings = self._strings
+			self._strings = strings.tobytes()
+			strings.release()
+			offsets = self._stringOffsets
+			self._stringOffsets = array(offsets.format, offsets.tobytes())
+			offsets.release()
+		self.release()
+
+	def release(self):
+		"""Close the memory map without copying the columns into memory. The snapshot can't be read from afterwards."""
+		if self._view is None:
+			return
+		for column in self.columns.values():
+			if isinstance(column, memoryview):
+				column.release()
+		for column in (self._strings, self._stringOffsets):
+			if isinstance(column, memoryview):
+				column.release()
+		self._view.release()
+		self._view = None
+		if hasattr(self._data, "close"):
+			self._data.close()
+		self._data = None
+
+	def string(self, i):
+		return str(self._strings[self._stringOffsets[i]:self._stringOffsets[i + 1]], "utf-8")
+
+	def symbol(self, i):
+		"""Return string i, interned."""
+		result = self._symbols.get(i)
+		if result is None:
+			result = self._symbols[i] = intern(self.string(i))
+		return result
+
+	def room(self, i):
+		"""Return a new room object for row i."""
+		columns = self.columns
+		vnum = columns["vnum"][i]
+		roomObj = Room(vnum)
+		for name in ROOM_TEXT_COLUMNS:
+			setattr(roomObj, name, self.string(columns[name][i]))
+		for name in ROOM_SYMBOL_COLUMNS:
+			setattr(roomObj, name, self.symbol(columns[name][i]))
+		roomObj.avoid = bool(columns["avoid"][i])
+		roomObj.cost = columns["cost"][i]
+		roomObj._mobFlags = columns["mobFlags"][i]
+		roomObj._loadFlags = columns["loadFlags"][i]
+		roomObj.x = columns["x"][i]
+		roomObj.y = columns["y"][i]
+		roomObj.z = columns["z"][i]
+		exits = roomObj.exits
+		directions, tos, exitFlags, doorFlags, doors = columns["direction"], columns["to"], columns["exitFlags"], columns["doorFlags"], columns["door"]
+		for j in range(columns["exitOffsets"][i], columns["exitOffsets"][i + 1]):
+			exitObj = Exit()
+			exitObj.direction = self.symbol(directions[j])
+			exitObj.vnum = vnum
+			exitObj.to = tos[j]
+			exitObj._exitFlags = exitFlags[j]
+			exitObj._doorFlags = doorFlags[j]
+			exitObj.door = self.string(doors[j])
+			exits[exitObj.direction] = exitObj
+		return roomObj
+
+	def index(self, rows, spatialIndex, reverseExits, roomText, searchIndex):
+		"""Add the rooms in the given (vnum, row number) tuples to the indexes, without creating room objects for them."""
+		columns = self.columns
+		string = self.string
+		names, descs, dynamicDescs, notes = columns["name"], columns["desc"], columns["dynamicDesc"], columns["note"]
+		xs, ys, zs = columns["x"], columns["y"], columns["z"]
+		exitOffsets, directions, tos, doors = columns["exitOffsets"], columns["direction"], columns["to"], columns["door"]
+		for vnum, i in rows:
+			name = string(names[i])
+			spatialIndex.addCoordinates(vnum, xs[i], ys[i], zs[i])
+			roomText.addText(vnum, name, string(descs[i]))
+			searchIndex.addWords(vnum, "name", set(tokenize(name)))
+			searchIndex.addWords(vnum, "dynamicDesc", set(tokenize(string(dynamicDescs[i]))))
+			searchIndex.addWords(vnum, "note", set(tokenize(string(notes[i]))))
+			doorWords = set()
+			for j in range(exitOffsets[i], exitOffsets[i + 1]):
+				reverseExits.addExit(vnum, self.symbol(directions[j]), tos[j])
+				doorWords.update(tokenize(string(doors[j])))
+			searchIndex.addWords(vnum, "door", doorWords)
+
+
+class LazyRooms(MutableMapping):
+	"""
+	A dict of vnums to room objects, which creates the objects for the rooms in a snapshot the first time they're looked up, and keeps them from then on.
+	Rooms which are added or replaced are kept in the same way as in a dict. Looking up all the rooms, for example by iterating over values(), creates all of their objects.
+	"""
+	def __init__(self):
+		self._snapshot = None
+		# The row numbers in the snapshot of the rooms which haven't been deleted.
+		self._rows = {}
+		self._rooms = {}
+		# The vnums of the rooms which were added since the snapshot was loaded, in the order they were added.
+		self._added = {}
+
+	def load(self, snapshot):
+		"""Use the rooms in a snapshot. The rooms which were already created are kept, and take the place of the same vnums in the snapshot. Once rooms have been loaded, rooms in the snapshot which have since been deleted are left out."""
+		oldSnapshot = self._snapshot
+		if oldSnapshot is None and not self._rooms:
+			rows = {vnum: i for i, vnum in enumerate(snapshot.columns["vnum"])}
+		else:
+			rows = {vnum: i for i, vnum in enumerate(snapshot.columns["vnum"]) if vnum in self}
+		self._snapshot = snapshot
+		self._rows = rows
+		self._added = {vnum: None for vnum in self._rooms if vnum not in self._rows}
+		if oldSnapshot is not None and oldSnapshot is not snapshot:
+			# Room objects don't refer to the snapshot they were created from, so nothing reads from the old one any more.
+			oldSnapshot.release()
+
+	def close(self):
+		"""Stop reading from the memory map of the snapshot. The rooms which weren't created yet are copied into memory."""
+		if self._snapshot is not None:
+			self._snapshot.close()
+
+	@property
+	def snapshot(self):
+		return self._snapshot
+
+	@property
+	def materialized(self):
+		"""The number of room objects which have been created or added."""
+		return len(self._rooms)
+
+	def __len__(self):
+		return len(self._rows) + len(self._added)
+
+	def __contains__(self, vnum):
+		return vnum in self._rows or vnum in self._added
+
+	def __iter__(self):
+		for vnum in self._rows:
+			yield vnum
+		for vnum in self._added:
+			yield vnum
+
+	def __getitem__(self, vnum):
+		roomObj = self._rooms.get(vnum)
+		if roomObj is None:
+			# setdefault keeps the first object if another thread created the same room at the same time.
+			roomObj = self._rooms.setdefault(vnum, self._snapshotRoom(vnum))
+		return roomObj
+
+	def get(self, vnum, default=None):
+		roomObj = self._rooms.get(vnum)
+		if roomObj is not None:
+			return roomObj
+		elif vnum in self._rows:
+			return self[vnum]
+		return default
+
+	def __setitem__(self, vnum, roomObj):
+		self._rooms[vnum] = roomObj
+		if vnum not in self._rows:
+			self._added[vnum] = None
+
+	def __delitem__(self, vnum):
+		if vnum in self._rows:
+			del self._rows[vnum]
+		elif vnum in self._added:
+			del self._added[vnum]
+		else:
+			raise KeyError(vnum)
+		self._rooms.pop(vnum, None)
+
+	def clear(self):
+		self.close()
+		self._snapshot = None
+		self._rows.clear()
+		self._rooms.clear()
+		self._added.clear()
+
+	def peek(self, vnum):
+		"""Return the room object for vnum if it was already created, otherwise a temporary copy of the room which isn't kept. The copy must not be changed."""
+		roomObj = self._rooms.get(vnum)
+		if roomObj is None:
+			return self._snapshotRoom(vnum)
+		return roomObj
+
+	def matching(self, predicate):
+		"""Return an iterator over the rooms for which predicate returns True. Only the objects for the matching rooms are kept."""
+		for vnum in self:
+			roomObj = self._rooms.get(vnum)
+			if roomObj is not None:
+				if predicate(roomObj):
+					yield roomObj
+				continue
+			try:
+				roomObj = self._snapshotRoom(vnum)
+			except KeyError:
+				# The room was deleted, or the rooms were cleared, while iterating.
+				continue
+			if predicate(roomObj):
+				yield self._rooms.setdefault(vnum, roomObj)
+
+	def _snapshotRoom(self, vnum):
+		"""Return a new room object for vnum from the snapshot. Raises KeyError if vnum isn't in the snapshot, or if there's no snapshot."""
+		snapshot = self._snapshot
+		if snapshot is None:
+			raise KeyError(vnum)
+		return snapshot.room(self._rows[vnum])
+
+	def rows(self):
+		"""Return an iterator over the vnums and row numbers of the rooms in the snapshot which haven't been created, deleted, or replaced."""
+		rooms = self._rooms
+		return ((vnum, i) for vnum, i in self._rows.items() if vnum not in rooms)
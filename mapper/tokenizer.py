@@ -0,0 +1,201 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import re
+from telnetlib import IAC, DONT, DO, WONT, WILL, theNULL, SB, SE
+
+
+# Token types yielded by Tokenizer.feed.
+# A run of plain text bytes. Never contains IAC, NULL, DC1, '<', or line feed bytes.
+TOKEN_TEXT = 0
+# A single line feed byte from the plain text.
+TOKEN_NEWLINE = 1
+# A complete XML tag, without the surrounding '<' and '>' characters.
+TOKEN_TAG = 2
+# A complete 2-3 byte telnet sequence, starting with IAC, received outside of sub-option negotiation.
+TOKEN_TELNET = 3
+# A run of bytes received during telnet sub-option negotiation.
+TOKEN_SUBOPTION = 4
+# Bytes which should be passed to the client without further processing.
+TOKEN_PASSTHROUGH = 5
+# A complete MPI message, as a tuple containing the MPI command and data.
+TOKEN_MPI = 6
+
+ORD_IAC = ord(IAC)
+ORD_SB = ord(SB)
+ORD_SE = ord(SE)
+ORD_LF = ord("\n")
+IGNORE_BYTES = frozenset([ord(theNULL), 0x11])
+NEGOTIATION_BYTES = frozenset(ord(byte) for byte in [DONT, DO, WONT, WILL])
+# The bytes which end a run of plain text, or a run of bytes within an XML tag.
+# Everything between these bytes can be processed in bulk.
+TEXT_SPECIAL_REGEX = re.compile(br"[\xff\x00\x11~<\n]")
+TAG_SPECIAL_REGEX = re.compile(br"[\xff\x00\x11~>]")
+MPI_SPECIAL_REGEX = re.compile(br"[\xff\x00\x11]")
+SUBOPTION_SPECIAL_REGEX = re.compile(br"\xff")
+
+
+class Tokenizer(object):
+	"""
+	An incremental tokenizer for the data received from Mume.
+	Data is fed to the tokenizer in chunks of arbitrary size, and any incomplete telnet sequences, XML tags, or MPI messages are carried over to the next chunk.
+	Plain text is scanned in bulk using precompiled regular expressions, only dropping down to a byte by byte state machine at telnet, MPI, XML, and line boundaries.
+	"""
+	def __init__(self, isLineStartFunc=None):
+		# isLineStartFunc should be a callable returning True if the data sent to the client so far ends with a line feed.
+		# It is used to determine if an MPI sequence (~$#E) can begin at the current position.
+		# If it isn't given, the previous byte received from the server is used instead.
+		self._isLineStartFunc = isLineStartFunc
+		self._lastByte = ORD_LF
+		self.inSubOption = False
+		self.inMPI = False
+		self.readingTag = False
+		self._iacBuffer = bytearray()
+		self._tagBuffer = bytearray()
+		self._mpiBuffer = bytearray()
+		self._mpiCounter = 0
+		self._mpiCommand = None
+		self._mpiLen = None
+
+	def _isLineStart(self, data, position):
+		if self._isLineStartFunc is not None:
+			return self._isLineStartFunc()
+		return (data[position - 1] if position else self._lastByte) == ORD_LF
+
+	def feed(self, data):
+		"""A generator which yields (token type, token data) tuples for the given chunk of data."""
+		length = len(data)
+		position = 0
+		iacBuffer = self._iacBuffer
+		tagBuffer = self._tagBuffer
+		mpiBuffer = self._mpiBuffer
+		while position < length:
+			if not iacBuffer and not self.inSubOption and not self._mpiCounter:
+				# Fast paths for the bulk of the data.
+				if self.inMPI:
+					if self._mpiLen is not None and self._mpiLen > len(mpiBuffer):
+						end = min(length, position + self._mpiLen - len(mpiBuffer))
+						match = MPI_SPECIAL_REGEX.search(data, position, end)
+						if match is not None:
+							end = match.start()
+						if end > position:
+							mpiBuffer.extend(data[position:end])
+							position = end
+							if len(mpiBuffer) >= self._mpiLen:
+								yield (TOKEN_MPI, (self._mpiCommand, bytes(mpiBuffer)))
+								del mpiBuffer[:]
+								self._mpiCommand = None
+								self._mpiLen = None
+								self.inMPI = False
+							continue
+				elif self.readingTag:
+					match = TAG_SPECIAL_REGEX.search(data, position)
+					end = length if match is None else match.start()
+					if end > position:
+						tagBuffer.extend(data[position:end])
+						position = end
+						continue
+				else:
+					match = TEXT_SPECIAL_REGEX.search(data, position)
+					end = length if match is None else match.start()
+					if end > position:
+						yield (TOKEN_TEXT, data[position:end])
+						position = end
+						continue
+			elif self.inSubOption and not iacBuffer:
+				match = SUBOPTION_SPECIAL_REGEX.search(data, position)
+				end = length if match is None else match.start()
+				if end > position:
+					yield (TOKEN_SUBOPTION, data[position:end])
+					position = end
+					continue
+			# From this point on, process a single byte.
+			byte = data[position]
+			position += 1
+			if iacBuffer:
+				iacBuffer.append(byte)
+				if byte in NEGOTIATION_BYTES:
+					# This is the second byte in a 3-byte telnet option sequence.
+					continue
+				# From this point on, byte is the final byte in a 2-3 byte telnet option sequence.
+				sequence = bytes(iacBuffer)
+				del iacBuffer[:]
+				if byte == ORD_SB:
+					# Sub-option negotiation begin.
+					self.inSubOption = True
+					yield (TOKEN_TELNET, sequence)
+				elif byte == ORD_SE:
+					# Sub-option negotiation end.
+					self.inSubOption = False
+					yield (TOKEN_TELNET, sequence)
+				elif self.inSubOption:
+					# Telnet sequences received during sub-option negotiation are passed through to the client.
+					yield (TOKEN_PASSTHROUGH, sequence)
+				elif byte == ORD_IAC:
+					# This is an escaped IAC byte.
+					self._mpiCounter = 0
+					if self.inMPI:
+						mpiBuffer.append(byte)
+					else:
+						yield (TOKEN_TELNET, sequence)
+				else:
+					yield (TOKEN_TELNET, sequence)
+			elif byte == ORD_IAC:
+				iacBuffer.append(byte)
+			elif self.inSubOption:
+				yield (TOKEN_SUBOPTION, data[position - 1:position])
+			elif byte in IGNORE_BYTES:
+				yield (TOKEN_PASSTHROUGH, data[position - 1:position])
+			elif self.inMPI:
+				if byte == ORD_LF and self._mpiCommand is None and self._mpiLen is None:
+					# The first line of MPI data was received.
+					# The first byte is the MPI command, E for edit, V for view.
+					# The remaining byte sequence is the length of the MPI data to be received.
+					if mpiBuffer[0:1] in (b"E", b"V") and mpiBuffer[1:].isdigit():
+						self._mpiCommand = bytes(mpiBuffer[0:1])
+						self._mpiLen = int(mpiBuffer[1:])
+					else:
+						# Invalid MPI command or length.
+						self.inMPI = False
+					del mpiBuffer[:]
+				else:
+					mpiBuffer.append(byte)
+					if self._mpiLen is not None and len(mpiBuffer) >= self._mpiLen:
+						# The last byte in the MPI data has been reached.
+						yield (TOKEN_MPI, (self._mpiCommand, bytes(mpiBuffer)))
+						del mpiBuffer[:]
+						self._mpiCommand = None
+						self._mpiLen = None
+						self.inMPI = False
+			elif byte == 126 and self._mpiCounter == 0 and self._isLineStart(data, position - 1) or byte == 36 and self._mpiCounter == 1 or byte == 35 and self._mpiCounter == 2:
+				# Byte is one of the first 3 bytes in the 4-byte MPI sequence (~$#E).
+				self._mpiCounter += 1
+			elif byte == 69 and self._mpiCounter == 3:
+				# Byte is the final byte in the 4-byte MPI sequence (~$#E).
+				self.inMPI = True
+				self._mpiCounter = 0
+			elif self.readingTag:
+				self._mpiCounter = 0
+				if byte == 62:  # >
+					# End of XML tag reached.
+					self.readingTag = False
+					tag = bytes(tagBuffer)
+					del tagBuffer[:]
+					yield (TOKEN_TAG, tag)
+				else:
+					tagBuffer.append(byte)
+			elif byte == 60:  # <
+				# Start of new XML tag.
+				self._mpiCounter = 0
+				self.readingTag = True
+			else:
+				# Byte is not part of a Telnet negotiation, MPI negotiation, or XML tag name.
+				self._mpiCounter = 0
+				if byte == ORD_LF:
+					yield (TOKEN_NEWLINE, data[position - 1:position])
+				else:
+					yield (TOKEN_TEXT, data[position - 1:position])
+		if length:
+			self._lastByte = data[-1]
@@ -6,19 +6,42 @@
 import gc
 import heapq
 import itertools
+import logging
 import operator
+import os
 try:
 	from Queue import Queue
 except ImportError:
 	from queue import Queue
 import re
+try:
+	from sys import intern
+except ImportError:
+	pass
 import threading
+from timeit import default_timer
 
 from . import roomdata
+from .config import Config, config_lock
+from .timers import RepeatingTimer
 from .utils import regexFuzzy
 
 
+logger = logging.getLogger(__name__)
+
 DIRECTIONS = ["north", "east", "south", "west", "up", "down"]
+# The default number of results shown by the find commands.
+FIND_LIMIT = 20
+# The map database file is rewritten once the journal of changes made since it was last written holds this many records.
+JOURNAL_COMPACT_RECORDS = 5000
+# The map is saved automatically once this many rooms have been changed, or once it has been left alone for this many seconds after a change.
+# Either can be changed, or set to 0 to turn it off, with the autosave_changes and autosave_idle_seconds settings in the config file.
+AUTOSAVE_CHANGES = 200
+AUTOSAVE_IDLE_SECONDS = 60
+# How often, in seconds, the autosave thresholds are checked.
+AUTOSAVE_CHECK_INTERVAL = 1
+# The number of rooms gathered from the map at a time while it's being saved.
+SAVE_BATCH_ROOMS = 500
 DIRECTION_COORDINATES = {
 	"north": (0, 1, 0),
 	"south": (0, -1, 0),
@@ -27,13 +50,13 @@ DIRECTION_COORDINATES = {
 	"up": (0, 0, 1),
 	"down": (0, 0, -1)
 }
-LEAD_BEFORE_ENTERING_VNUMS = [
-	"196",
-	"3473",
-	"3474",
-	"12138",
-	"12637"
-]
+LEAD_BEFORE_ENTERING_VNUMS = frozenset([
+	196,
+	3473,
+	3474,
+	12138,
+	12637
+])
 LIGHT_SYMBOLS = {
 	"@": "lit",
 	"*": "lit",
@@ -41,6 +64,36 @@ LIGHT_SYMBOLS = {
 	")": "lit",
 	"o": "dark"
 }
+# Older map database files use different names for some terrains and flags.
+TERRAIN_REPLACEMENTS = {
+	"random": "undefined",
+	"death": "deathtrap",
+	"shallowwater": "shallow"
+}
+MOB_FLAG_REPLACEMENTS = {
+	"any": "passive_mob",
+	"smob": "aggressive_mob",
+	"quest": "quest_mob",
+	"scoutguild": "scout_guild",
+	"mageguild": "mage_guild",
+	"clericguild": "cleric_guild",
+	"warriorguild": "warrior_guild",
+	"rangerguild": "ranger_guild",
+	"armourshop": "armour_shop",
+	"foodshop": "food_shop",
+	"petshop": "pet_shop",
+	"weaponshop": "weapon_shop"
+}
+LOAD_FLAG_REPLACEMENTS = {
+	"packhorse": "pack_horse",
+	"trainedhorse": "trained_horse"
+}
+DOOR_FLAG_REPLACEMENTS = {
+	"noblock": "no_block",
+	"nobreak": "no_break",
+	"nopick": "no_pick",
+	"needkey": "need_key"
+}
 REVERSE_DIRECTIONS = {
 	"north": "south",
 	"south": "north",
@@ -49,7 +102,11 @@ REVERSE_DIRECTIONS = {
 	"up": "down",
 	"down": "up"
 }
+NEAREST_DESTINATION_REGEX = re.compile(r"^nearest\s+(?:of\s+(?P<labels>.+)|(?P<query>.+))$", re.IGNORECASE)
+# The flags which can be given after the destination of the path, run, and step commands.
+PATH_FLAGS = frozenset(["verify"] + list(roomdata.graph.PATH_ALGORITHMS) + ["no{}".format(terrain) for terrain in roomdata.objects.TERRAIN_COSTS])
 RUN_DESTINATION_REGEX = re.compile(r"^(?P<destination>.+?)(?:\s+(?P<flags>\S+))?$")
+SEARCH_TERMS_REGEX = re.compile(r"\"(?P<quoted>[^\"]*)\"|(?P<word>\S+)")
 TERRAIN_SYMBOLS = {
 	":": "brush",
 	"O": "cavern",
@@ -70,11 +127,123 @@ TERRAIN_SYMBOLS = {
 }
 
 
+class VnumAllocator(object):
+	"""Hands out vnums for new rooms in constant time by tracking the highest vnum in use."""
+	def __init__(self):
+		self.highest = -1
+
+	def reset(self, vnums):
+		self.highest = max(vnums, default=-1)
+
+	def claim(self, vnum):
+		if vnum > self.highest:
+			self.highest = vnum
+
+	def allocate(self):
+		self.highest += 1
+		return self.highest
+
+
+class BackgroundSaver(object):
+	"""
+	Runs named save jobs one at a time in a background thread, so that writing files doesn't hold up the mapper.
+	A job which is submitted again before it starts only runs once, and a job which is submitted while it's running runs once more afterwards, so a burst of changes is saved at most twice.
+	"""
+	def __init__(self):
+		self._jobs = {}
+		self._thread = None
+		self._lock = threading.Lock()
+		self._idle = threading.Event()
+		self._idle.set()
+
+	def submit(self, name, function):
+		with self._lock:
+			if name not in self._jobs:
+				self._jobs[name] = function
+			self._idle.clear()
+			if self._thread is None:
+				# The thread isn't a daemon, so that a save which is in progress is finished when the program exits.
+				self._thread = threading.Thread(target=self._run, name="Saver")
+				self._thread.start()
+
+	def isBusy(self):
+		return not self._idle.is_set()
+
+	def wait(self, timeout=None):
+		"""Wait until every submitted job has finished. Return False if timeout seconds passed first."""
+		return self._idle.wait(timeout)
+
+	def _run(self):
+		while True:
+			with self._lock:
+				if not self._jobs:
+					self._thread = None
+					self._idle.set()
+					return
+				name = next(iter(self._jobs))
+				function = self._jobs.pop(name)
+			try:
+				function()
+			except Exception:
+				logger.exception("Error while running save job '{}'.".format(name))
+
+
+class Autosaver(object):
+	"""Saves a map in the background once enough rooms have been changed, or the map has been left alone for long enough after a change."""
+	def __init__(self, world, changes=AUTOSAVE_CHANGES, idleSeconds=AUTOSAVE_IDLE_SECONDS):
+		self._world = world
+		self.changes = changes
+		self.idleSeconds = idleSeconds
+		self._timer = None
+
+	def start(self):
+		if self._timer is None and (self.changes or self.idleSeconds):
+			self._timer = RepeatingTimer(AUTOSAVE_CHECK_INTERVAL, self.check)
+			self._timer.start()
+
+	def stop(self):
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+
+	def check(self):
+		"""Start saving the map if it has unsaved changes which meet either threshold. The save itself runs in the saving thread."""
+		# An error mustn't stop the timer, or the map would no longer be saved automatically.
+		try:
+			journal = self._world.journal
+			if not journal.dirty or self._world.saver.isBusy():
+				return
+			elif self.changes and len(journal.dirty) >= self.changes or self.idleSeconds and journal.lastChanged is not None and default_timer() - journal.lastChanged >= self.idleSeconds:
+				self._world.saveRooms(announce=False)
+		except Exception:
+			logger.exception("Error while checking whether to save the map automatically.")
+
+
 class World(object):
-	def __init__(self, interface="text"):
+	findLimit = FIND_LIMIT
+	pathAlgorithm = "dijkstra"
+	# The number of landmarks used to speed up path finding. Set to 0 to turn off building them.
+	landmarkCount = roomdata.graph.LANDMARK_COUNT
+
+	def __init__(self, interface="text", sharedWorld=None):
 		self.isSynced = False
-		self.rooms = {}
+		# Room objects are only created for the rooms in the map snapshot when they're first looked up.
+		self.rooms = roomdata.snapshot.LazyRooms()
 		self.labels = {}
+		# Mutations of a map which is shared between multiple sessions must be done while holding this lock.
+		self.mapLock = threading.RLock()
+		self.vnumAllocator = VnumAllocator()
+		self.spatialIndex = roomdata.indexes.SpatialIndex(self.rooms)
+		self.reverseExits = roomdata.indexes.ReverseExitIndex()
+		self.roomText = roomdata.indexes.RoomTextIndex()
+		self.searchIndex = roomdata.indexes.TextSearchIndex()
+		self.pathGraph = roomdata.graph.GraphCache()
+		self.routeCache = roomdata.graph.RouteCache()
+		self.landmarks = roomdata.graph.LandmarkCache()
+		self.journal = roomdata.journal.Journal()
+		self.saver = BackgroundSaver()
+		self.autosaver = None
+		self.lastRouteTarget = None
 		self._interface = interface
 		if interface != "text":
 			self._gui_queue = Queue()
@@ -85,8 +254,34 @@ class World(object):
 				from .gui.sighted import Window
 			self.window = Window(self)
 		self._currentRoom = None
-		self.loadRooms()
-		self.loadLabels()
+		if sharedWorld is not None:
+			self.shareMap(sharedWorld)
+			self.currentRoom = self.rooms.get(0)
+		else:
+			self.loadRooms()
+			self.loadLabels()
+			# The proxy starts the autosaver once the session is running, so that other users of the map, such as the emulator, don't save it in the background.
+			with config_lock:
+				cfg = Config()
+				self.autosaver = Autosaver(self, cfg.get("autosave_changes", AUTOSAVE_CHANGES), cfg.get("autosave_idle_seconds", AUTOSAVE_IDLE_SECONDS))
+				del cfg
+
+	def shareMap(self, world):
+		"""Use the map which was loaded by another world instance, rather than loading a separate copy."""
+		self.rooms = world.rooms
+		self.labels = world.labels
+		self.mapLock = world.mapLock
+		self.vnumAllocator = world.vnumAllocator
+		self.spatialIndex = world.spatialIndex
+		self.reverseExits = world.reverseExits
+		self.roomText = world.roomText
+		self.searchIndex = world.searchIndex
+		self.pathGraph = world.pathGraph
+		self.routeCache = world.routeCache
+		self.landmarks = world.landmarks
+		self.journal = world.journal
+		self.saver = world.saver
+		self.autosaver = world.autosaver
 
 	@property
 	def currentRoom(self):
@@ -113,152 +308,395 @@ class World(object):
 		print(text)
 		return None
 
+	def notify(self, text):
+		"""Show a message from a thread other than the one which handles the user's commands, such as the saving thread."""
+		self.output(text)
+
 	def loadRooms(self):
 		if gc.isenabled():
 			gc.disable()
 		self.output("Loading the database file.")
+		data = roomdata.database.loadRoomsData()
+		checksum = roomdata.snapshot.checksum(data) if data is not None else None
+		del data
+		snapshot = roomdata.database.loadSnapshot(checksum) if checksum is not None else None
+		if snapshot is not None:
+			self.output("Indexing the map snapshot.")
+			snapshot = roomdata.snapshot.Snapshot(snapshot, roomdata.database.SNAPSHOT_HEADER.size)
+			self.rooms.load(snapshot)
+			snapshot.index(self.rooms.rows(), self.spatialIndex, self.reverseExits, self.roomText, self.searchIndex)
+		elif not self.loadRoomsFromDatabase():
+			return
+		elif checksum is not None:
+			self.saveSnapshot(checksum)
+		if checksum is not None:
+			self.loadJournal(checksum)
+		self.vnumAllocator.reset(self.rooms)
+		self.mapModified()
+		self.currentRoom = self.rooms[0]
+		if not gc.isenabled():
+			gc.enable()
+			gc.collect()
+		self.output("Map database loaded.")
+
+	def addLoadedRoom(self, newRoom):
+		self.rooms[newRoom.vnum] = newRoom
+		self.spatialIndex.add(newRoom)
+		self.roomText.add(newRoom)
+		self.searchIndex.add(newRoom)
+		for newExit in newRoom.exits.values():
+			self.reverseExits.add(newExit)
+
+	def removeLoadedRoom(self, vnum):
+		"""Remove a room and its exits from the map and the indexes. Exits in other rooms which lead to it are left alone."""
+		roomObj = self.rooms[vnum]
+		for exitObj in roomObj.exits.values():
+			self.reverseExits.remove(exitObj)
+		self.spatialIndex.remove(roomObj)
+		self.roomText.remove(roomObj)
+		self.searchIndex.remove(roomObj)
+		del self.rooms[vnum]
+
+	def loadJournal(self, checksum):
+		"""Apply the changes which were recorded in the map journal since the map database file with the given checksum was written."""
+		try:
+			records = self.journal.load(checksum)
+			records = [(vnum, self.roomFromDict(vnum, roomDict) if roomDict is not None else None) for vnum, roomDict in records]
+		except EnvironmentError as e:
+			self.output("Unable to open the map journal, changes won't be recorded until the map is saved: {}".format(e))
+			return
+		except ValueError as e:
+			self.output("The map journal is corrupted, so the changes in it weren't applied: {}".format(e))
+			try:
+				self.output("The corrupted journal was moved to {}.".format(self.journal.discard(checksum)))
+			except EnvironmentError as e:
+				self.output("Unable to replace the map journal, changes won't be recorded until the map is saved: {}".format(e))
+			return
+		if records:
+			self.output("Applying {} changes from the map journal.".format(len(records)))
+		for vnum, newRoom in records:
+			if vnum in self.rooms:
+				self.removeLoadedRoom(vnum)
+			if newRoom is not None:
+				self.addLoadedRoom(newRoom)
+		if self.journal.records >= JOURNAL_COMPACT_RECORDS:
+			self.saveRooms()
+
+	def _peekRooms(self, vnums):
+		"""Yield the rooms with the given vnums which are still in the map, without keeping the objects for rooms which haven't been used. The map stays locked while each batch of rooms is used, so the caller must use up or close the generator."""
+		for start in range(0, len(vnums), SAVE_BATCH_ROOMS):
+			with self.mapLock:
+				for vnum in vnums[start:start + SAVE_BATCH_ROOMS]:
+					if vnum in self.rooms:
+						yield self.rooms.peek(vnum)
+
+	def saveSnapshot(self, checksum):
+		"""
+		Write a snapshot of the rooms of the map, which is loaded in place of the map database file with the given checksum next time. The rooms which haven't been used are then read from the new snapshot.
+		Rooms which are changed while the snapshot is written may be in either state, so changes since the file was written must be in the journal.
+		"""
+		with self.mapLock:
+			vnums = list(self.rooms)
+		rooms = self._peekRooms(vnums)
+		try:
+			body = roomdata.snapshot.pack(rooms)
+		finally:
+			rooms.close()
+		del vnums
+		if os.name == "nt":
+			with self.mapLock:
+				# The old snapshot file can't be replaced on Windows while it's memory mapped.
+				self.rooms.close()
+		try:
+			roomdata.database.dumpSnapshot(checksum, body)
+		except EnvironmentError as e:
+			self.notify("Unable to save the map snapshot: {}".format(e))
+			return
+		del body
+		snapshot = roomdata.database.loadSnapshot(checksum)
+		if snapshot is not None:
+			with self.mapLock:
+				self.rooms.load(roomdata.snapshot.Snapshot(snapshot, roomdata.database.SNAPSHOT_HEADER.size))
+
+	def loadRoomsFromDatabase(self):
+		"""Create the room objects from the map database file. Return False if it couldn't be loaded."""
 		errors, db = roomdata.database.loadRooms()
 		if db is None:
-			return self.output(errors)
+			self.output(errors)
+			return False
 		self.output("Creating room objects.")
-		terrainReplacements = {
-			"random": "undefined",
-			"death": "deathtrap",
-			"shallowwater": "shallow"
-		}
-		mobFlagReplacements = {
-			"any": "passive_mob",
-			"smob": "aggressive_mob",
-			"quest": "quest_mob",
-			"scoutguild": "scout_guild",
-			"mageguild": "mage_guild",
-			"clericguild": "cleric_guild",
-			"warriorguild": "warrior_guild",
-			"rangerguild": "ranger_guild",
-			"armourshop": "armour_shop",
-			"foodshop": "food_shop",
-			"petshop": "pet_shop",
-			"weaponshop": "weapon_shop"
-		}
-		loadFlagReplacements = {
-			"packhorse": "pack_horse",
-			"trainedhorse": "trained_horse"
-		}
-		doorFlagReplacements = {
-			"noblock": "no_block",
-			"nobreak": "no_break",
-			"nopick": "no_pick",
-			"needkey": "need_key"
-		}
+		# Every room is checked before any are added, so that a corrupted file doesn't leave part of the map loaded.
+		newRooms = []
 		for vnum, roomDict in db.items():
-			newRoom = roomdata.objects.Room(vnum)
-			newRoom.name = roomDict["name"]
-			newRoom.desc = roomDict["desc"]
-			newRoom.dynamicDesc = roomDict["dynamicDesc"]
-			newRoom.note = roomDict["note"]
-			terrain = roomDict["terrain"]
-			newRoom.terrain = terrain if terrain not in terrainReplacements else terrainReplacements[terrain]
-			newRoom.light = roomDict["light"]
-			newRoom.align = roomDict["align"]
-			newRoom.portable = roomDict["portable"]
-			newRoom.ridable = roomDict["ridable"]
 			try:
-				newRoom.avoid = roomDict["avoid"]
-			except KeyError:
-				pass
-			newRoom.mobFlags = {flag if flag not in mobFlagReplacements else mobFlagReplacements[flag] for flag in roomDict["mobFlags"]}
-			newRoom.loadFlags = {flag if flag not in loadFlagReplacements else loadFlagReplacements[flag] for flag in roomDict["loadFlags"]}
-			newRoom.x = roomDict["x"]
-			newRoom.y = roomDict["y"]
-			newRoom.z = roomDict["z"]
-			newRoom.calculateCost()
-			for direction, exitDict in roomDict["exits"].items():
-				newExit = self.getNewExit(direction, exitDict["to"], vnum)
-				newExit.exitFlags = set(exitDict["exitFlags"])
-				newExit.doorFlags = {flag if flag not in doorFlagReplacements else doorFlagReplacements[flag] for flag in exitDict["doorFlags"]}
-				newExit.door = exitDict["door"]
-				newRoom.exits[direction] = newExit
-			self.rooms[vnum] = newRoom
+				newRooms.append(self.roomFromDict(int(vnum), roomDict))
+			except ValueError as e:
+				self.output("Corrupted database file: room {}: {}".format(vnum, e))
+				return False
 			roomDict.clear()
 			del roomDict
-		self.currentRoom = self.rooms["0"]
-		if not gc.isenabled():
-			gc.enable()
-			gc.collect()
-		self.output("Map database loaded.")
+		del db
+		for newRoom in newRooms:
+			self.addLoadedRoom(newRoom)
+		return True
 
-	def saveRooms(self):
-		if gc.isenabled():
-			gc.disable()
-		self.output("Creating dict from room objects.")
-		db = {}
-		for vnum, roomObj in self.rooms.items():
-			newRoom = {}
-			newRoom["name"] = roomObj.name
-			newRoom["desc"] = roomObj.desc
-			newRoom["dynamicDesc"] = roomObj.dynamicDesc
-			newRoom["note"] = roomObj.note
-			newRoom["terrain"] = roomObj.terrain
-			newRoom["light"] = roomObj.light
-			newRoom["align"] = roomObj.align
-			newRoom["portable"] = roomObj.portable
-			newRoom["ridable"] = roomObj.ridable
-			newRoom["avoid"] = roomObj.avoid
-			newRoom["mobFlags"] = sorted(roomObj.mobFlags)
-			newRoom["loadFlags"] = sorted(roomObj.loadFlags)
-			newRoom["x"] = roomObj.x
-			newRoom["y"] = roomObj.y
-			newRoom["z"] = roomObj.z
-			newRoom["exits"] = {}
-			for direction, exitObj in roomObj.exits.items():
-				newExit = {}
-				newExit["exitFlags"] = sorted(exitObj.exitFlags)
-				newExit["doorFlags"] = sorted(exitObj.doorFlags)
-				newExit["door"] = exitObj.door
-				newExit["to"] = exitObj.to
-				newRoom["exits"][direction] = newExit
-			db[vnum] = newRoom
-		self.output("Saving the database.")
-		roomdata.database.dumpRooms(db)
-		if not gc.isenabled():
-			gc.enable()
-			gc.collect()
-		self.output("Map Database saved.")
+	def roomFromDict(self, vnum, roomDict):
+		"""Create a room object from its entry in the map database file."""
+		newRoom = roomdata.objects.Room(vnum)
+		newRoom.name = roomDict["name"]
+		newRoom.desc = roomDict["desc"]
+		newRoom.dynamicDesc = roomDict["dynamicDesc"]
+		newRoom.note = roomDict["note"]
+		terrain = roomDict["terrain"]
+		# The values of these fields come from small sets of strings. Interning them means that every room shares the same string objects.
+		newRoom.terrain = intern(terrain if terrain not in TERRAIN_REPLACEMENTS else TERRAIN_REPLACEMENTS[terrain])
+		newRoom.light = intern(roomDict["light"])
+		newRoom.align = intern(roomDict["align"])
+		newRoom.portable = intern(roomDict["portable"])
+		newRoom.ridable = intern(roomDict["ridable"])
+		try:
+			newRoom.avoid = roomDict["avoid"]
+		except KeyError:
+			pass
+		newRoom.mobFlags = {flag if flag not in MOB_FLAG_REPLACEMENTS else MOB_FLAG_REPLACEMENTS[flag] for flag in roomDict["mobFlags"]}
+		newRoom.loadFlags = {flag if flag not in LOAD_FLAG_REPLACEMENTS else LOAD_FLAG_REPLACEMENTS[flag] for flag in roomDict["loadFlags"]}
+		newRoom.x = roomDict["x"]
+		newRoom.y = roomDict["y"]
+		newRoom.z = roomDict["z"]
+		newRoom.calculateCost()
+		vnumFromString = roomdata.objects.vnumFromString
+		for direction, exitDict in roomDict["exits"].items():
+			direction = intern(direction)
+			newExit = self.getNewExit(direction, vnumFromString(exitDict["to"]), vnum)
+			newExit.exitFlags = set(exitDict["exitFlags"])
+			newExit.doorFlags = {flag if flag not in DOOR_FLAG_REPLACEMENTS else DOOR_FLAG_REPLACEMENTS[flag] for flag in exitDict["doorFlags"]}
+			newExit.door = exitDict["door"]
+			newRoom.exits[direction] = newExit
+		return newRoom
+
+	def roomToDict(self, roomObj):
+		"""Return the entry for a room in the map database file."""
+		vnumToString = roomdata.objects.vnumToString
+		newRoom = {}
+		newRoom["name"] = roomObj.name
+		newRoom["desc"] = roomObj.desc
+		newRoom["dynamicDesc"] = roomObj.dynamicDesc
+		newRoom["note"] = roomObj.note
+		newRoom["terrain"] = roomObj.terrain
+		newRoom["light"] = roomObj.light
+		newRoom["align"] = roomObj.align
+		newRoom["portable"] = roomObj.portable
+		newRoom["ridable"] = roomObj.ridable
+		newRoom["avoid"] = roomObj.avoid
+		newRoom["mobFlags"] = sorted(roomObj.mobFlags)
+		newRoom["loadFlags"] = sorted(roomObj.loadFlags)
+		newRoom["x"] = roomObj.x
+		newRoom["y"] = roomObj.y
+		newRoom["z"] = roomObj.z
+		newRoom["exits"] = {}
+		for direction, exitObj in roomObj.exits.items():
+			newExit = {}
+			newExit["exitFlags"] = sorted(exitObj.exitFlags)
+			newExit["doorFlags"] = sorted(exitObj.doorFlags)
+			newExit["door"] = exitObj.door
+			newExit["to"] = vnumToString(exitObj.to)
+			newRoom["exits"][direction] = newExit
+		return newRoom
+
+	def saveRooms(self, announce=True):
+		"""Write the map database file in the background."""
+		self.saver.submit("rooms", lambda: self._saveRooms(announce))
+
+	def saveOnExit(self):
+		"""Stop saving automatically, save any unsaved changes, and wait for every save to finish. Called when the program exits cleanly."""
+		if self.autosaver is not None:
+			self.autosaver.stop()
+		if self.journal.dirty:
+			self.saveRooms(announce=False)
+		self.saver.wait()
+
+	def _saveRooms(self, announce):
+		# Runs in the saving thread. The map is only locked while each batch of rooms is gathered, so that the mapper carries on handling events while the file is written.
+		# A room which is changed after the journal was taken may be written in either state, but it's carried over to the new journal, which is replayed on top of the file.
+		vnumToString = roomdata.objects.vnumToString
+		with self.mapLock:
+			dirty = self.journal.takeDirty()
+			vnums = sorted((vnumToString(vnum), vnum) for vnum in self.rooms)
+		hasher = roomdata.snapshot.checksumHasher()
+
+		def roomItems():
+			for start in range(0, len(vnums), SAVE_BATCH_ROOMS):
+				with self.mapLock:
+					batch = [(vnumString, self.roomToDict(self.rooms.peek(vnum))) for vnumString, vnum in vnums[start:start + SAVE_BATCH_ROOMS] if vnum in self.rooms]
+				for item in batch:
+					yield item
+
+		def chunks():
+			for chunk in roomdata.database.encodeRoomItems(roomItems()):
+				hasher.update(chunk)
+				yield chunk
+
+		def markJournal():
+			with self.mapLock:
+				self.journal.mark(hasher.digest())
+
+		try:
+			roomdata.database.dumpRoomsData(chunks(), markJournal)
+		except (EnvironmentError, ValueError) as e:
+			with self.mapLock:
+				self.journal.dirty.update(dirty)
+			self.notify("Unable to save the map database: {}".format(e))
+			return
+		checksum = hasher.digest()
+		with self.mapLock:
+			# The rooms which were changed while the file was being written are carried over to the new journal.
+			try:
+				self.journal.reset(checksum, ((vnum, self.roomToDict(self.rooms[vnum]) if vnum in self.rooms else None) for vnum in self.journal.dirty))
+			except EnvironmentError as e:
+				self.notify("Unable to reset the map journal: {}".format(e))
+		# The snapshot of the old file would no longer be used, so replace it with one for the file which was just written.
+		self.saveSnapshot(checksum)
+		if announce:
+			self.notify("Map Database saved.")
 
 	def loadLabels(self):
 		errors, labels = roomdata.database.loadLabels()
 		if labels is None:
 			return self.output(errors)
-		self.labels.update(labels)
+		invalid = []
+		for label, vnum in labels.items():
+			try:
+				self.labels[label] = roomdata.objects.vnumFromString(vnum)
+			except ValueError:
+				invalid.append(label)
+		if invalid:
+			self.output("Ignoring labels with invalid vnums: {}".format(", ".join(sorted(invalid))))
 		orphans = [label for label, vnum in self.labels.items() if vnum not in self.rooms]
 		for label in orphans:
 			del self.labels[label]
 
 	def saveLabels(self):
-		roomdata.database.dumpLabels(self.labels)
+		"""Write the labels file in the background."""
+		self.saver.submit("labels", self._saveLabels)
+
+	def _saveLabels(self):
+		with self.mapLock:
+			labels = {label: roomdata.objects.vnumToString(vnum) for label, vnum in self.labels.items()}
+		try:
+			roomdata.database.dumpLabels(labels)
+		except EnvironmentError as e:
+			self.notify("Unable to save the labels: {}".format(e))
+
+	def roomsChanged(self, *vnums):
+		"""Record the rooms with the given vnums in the map journal, after they were added, removed, or changed in any way."""
+		if not vnums:
+			return
+		# The journal is also used by the saving thread.
+		with self.mapLock:
+			records = self.journal.records
+			try:
+				self.journal.append((vnum, self.roomToDict(self.rooms[vnum]) if vnum in self.rooms else None) for vnum in vnums)
+			except EnvironmentError as e:
+				self.output("Unable to write to the map journal: {}".format(e))
+		if records < JOURNAL_COMPACT_RECORDS <= self.journal.records:
+			self.output("Compacting the map journal.")
+			self.saveRooms()
+
+	def mapModified(self, *vnums):
+		"""Notify the data derived from the map that the rooms with the given vnums, or their exits, were added, removed, or changed in a way which affects path finding."""
+		self.roomsChanged(*vnums)
+		self.pathGraph.invalidate()
+		self.routeCache.roomsModified(self.rooms, self.reverseExits, vnums)
+		# Landmarks for a newly loaded map are needed straight away, but there's no point rebuilding them after every change while the map is being edited.
+		self.landmarks.invalidate(self._landmarkGraph, roomdata.graph.LANDMARK_REBUILD_DELAY if vnums else 0, self.landmarkCount)
+		if self.pathAlgorithm == "landmarks":
+			# Landmarks are otherwise only built once a path is first found with them.
+			self.landmarks.request(self._landmarkGraph, self.landmarkCount)
 
-	def getNewExit(self, direction, to="undefined", parent=None):
+	def _landmarkGraph(self):
+		# Called from the thread which builds the landmarks, so the map mustn't change while the graph is being built from it.
+		with self.mapLock:
+			return self.pathGraph.get(self.rooms)
+
+	def getNewExit(self, direction, to=roomdata.objects.VNUM_UNDEFINED, parent=None):
 		newExit = roomdata.objects.Exit()
 		newExit.direction = direction
 		newExit.to = to
 		newExit.vnum = self.currentRoom.vnum if parent is None else parent
 		return newExit
 
+	def setExit(self, roomObj, exitObj):
+		"""Add an exit to a room, replacing any existing exit in the same direction."""
+		self.searchIndex.remove(roomObj, ("door",))
+		if exitObj.direction in roomObj.exits:
+			self.reverseExits.remove(roomObj.exits[exitObj.direction])
+		roomObj.exits[exitObj.direction] = exitObj
+		self.reverseExits.add(exitObj)
+		self.searchIndex.add(roomObj, ("door",))
+		self.mapModified(roomObj.vnum)
+
+	def deleteExit(self, roomObj, direction):
+		self.searchIndex.remove(roomObj, ("door",))
+		self.reverseExits.remove(roomObj.exits.pop(direction))
+		self.searchIndex.add(roomObj, ("door",))
+		self.mapModified(roomObj.vnum)
+
+	def setDoor(self, roomObj, direction, door):
+		"""Change the door name of an exit, updating the search index."""
+		self.searchIndex.remove(roomObj, ("door",))
+		roomObj.exits[direction].door = door
+		self.searchIndex.add(roomObj, ("door",))
+		self.roomsChanged(roomObj.vnum)
+
+	def linkExit(self, exitObj, vnum):
+		"""Change the vnum that an exit leads to."""
+		self.reverseExits.remove(exitObj)
+		exitObj.to = vnum
+		self.reverseExits.add(exitObj)
+		self.mapModified(exitObj.vnum)
+
+	def setRoomText(self, roomObj, name=None, desc=None, dynamicDesc=None, note=None):
+		"""Change the text fields of a room, updating the text indexes."""
+		self.roomText.remove(roomObj)
+		self.searchIndex.remove(roomObj)
+		if name is not None:
+			roomObj.name = name
+		if desc is not None:
+			roomObj.desc = desc
+		if dynamicDesc is not None:
+			roomObj.dynamicDesc = dynamicDesc
+		if note is not None:
+			roomObj.note = note
+		self.roomText.add(roomObj)
+		self.searchIndex.add(roomObj)
+		self.roomsChanged(roomObj.vnum)
+
+	def getRoomsByNameAndDesc(self, name, desc):
+		"""Return a list of the rooms with the given name and description, ignoring case and surrounding white space."""
+		name = roomdata.indexes.normalizeText(name)
+		desc = roomdata.indexes.normalizeText(desc)
+		candidates = (self.rooms[vnum] for vnum in self.roomText.withNameAndDesc(name, desc))
+		return [roomObj for roomObj in candidates if roomdata.indexes.normalizeText(roomObj.name) == name and roomdata.indexes.normalizeText(roomObj.desc) == desc]
+
+	def getIncomingExits(self, vnum):
+		"""Return a list of the exit objects which lead to the given vnum."""
+		return [self.rooms[source].exits[direction] for source, direction in self.reverseExits.incoming(vnum)]
+
 	def sortExits(self, exitsDict):
 		return sorted(exitsDict.items(), key=lambda direction: DIRECTIONS.index(direction[0]) if direction[0] in DIRECTIONS else len(DIRECTIONS))
 
 	def isBidirectional(self, exitObj):
 		"""Returns True if an exit is bidirectional, False if unidirectional.
 		I.E. True if moving in a given direction then moving back in the direction you just came from would put you back where you started, False otherwise."""
-		try:
-			dest = self.rooms[exitObj.to]
-		except KeyError:
-			return False
-		revdir = REVERSE_DIRECTIONS[exitObj.direction]
-		if revdir in dest.exits and dest.exits[revdir].to == exitObj.vnum:
-			return True
-		else:
-			return False
+		return exitObj.to in self.rooms and self.reverseExits.hasExit(exitObj.to, REVERSE_DIRECTIONS[exitObj.direction], exitObj.vnum)
+
+	def roomsAt(self, x, y, z):
+		"""Return a list of the rooms located at the given X-Y-Z coordinates."""
+		return self.spatialIndex.roomsAt(x, y, z)
+
+	def roomsInBox(self, x1, y1, z1, x2, y2, z2):
+		"""A generator which yields the rooms located between the given X-Y-Z coordinates, inclusive."""
+		return self.spatialIndex.roomsInBox(x1, y1, z1, x2, y2, z2)
 
 	def getNeighborsFromCoordinates(self, start=None, radius=1):
 		"""A generator which yields all rooms in the vicinity of the given X-Y-Z coordinates.
@@ -271,11 +709,11 @@ class World(object):
 			iter(radius)
 		except TypeError:
 			radius = (int(radius),) * 3
-		for vnum, obj in self.rooms.items():
-			coords = (obj.x, obj.y, obj.z)
-			delta = self.coordinatesSubtract(coords, start)
-			if coords != start and all(abs(d) <= r for d, r in zip(delta, radius)):
-				yield(vnum, obj, *delta)
+		x, y, z = start
+		radiusX, radiusY, radiusZ = radius
+		for obj in self.roomsInBox(x - radiusX, y - radiusY, z - radiusZ, x + radiusX, y + radiusY, z + radiusZ):
+			if (obj.x, obj.y, obj.z) != (x, y, z):
+				yield(obj.vnum, obj, obj.x - x, obj.y - y, obj.z - z)
 
 	def getNeighborsFromRoom(self, start=None, radius=1):
 		"""A generator which yields all rooms in the vicinity of a room object.
@@ -289,19 +727,16 @@ class World(object):
 			radiusX = radiusY = radiusZ = int(radius)
 		else:
 			radiusX, radiusY, radiusZ = radius
-		for vnum, obj in self.rooms.items():
-			differenceX, differenceY, differenceZ = obj.x - x, obj.y - y, obj.z - z
-			if abs(differenceX) <= radiusX and abs(differenceY) <= radiusY and abs(differenceZ) <= radiusZ and obj is not start:
-				yield(vnum, obj, differenceX, differenceY, differenceZ)
+		for obj in self.roomsInBox(x - radiusX, y - radiusY, z - radiusZ, x + radiusX, y + radiusY, z + radiusZ):
+			if obj is not start:
+				yield(obj.vnum, obj, obj.x - x, obj.y - y, obj.z - z)
 
 	def getVnum(self, roomObj=None):
 		result = None
 		if roomObj is None:
 			roomObj = self.currentRoom
-		for vnum, obj in self.rooms.items():
-			if obj is roomObj:
-				result = vnum
-				break
+		if roomObj is not None and self.rooms.get(roomObj.vnum) is roomObj:
+			result = roomObj.vnum
 		return result
 
 	def coordinatesSubtract(self, first, second):
@@ -318,7 +753,18 @@ class World(object):
 		return self.coordinatesAdd(first, second)
 
 	def getNewVnum(self):
-		return str(max(int(i) for i in self.rooms) + 1)
+		return self.vnumAllocator.allocate()
+
+	def lookupVnum(self, text):
+		"""Return the vnum for a label or a vnum given by the user, or None if it isn't valid."""
+		if isinstance(text, int):
+			return text
+		text = text.strip().lower()
+		if text in self.labels:
+			return self.labels[text]
+		elif text.isdigit():
+			return int(text)
+		return None
 
 	def revnum(self, *args):
 		if not args or not args[0]:
@@ -333,91 +779,133 @@ class World(object):
 		if not matchDict["destination"]:
 			self.output("Error: you need to supply a destination VNum.")
 			return None
-		destination = matchDict["destination"]
+		destination = int(matchDict["destination"])
 		if not matchDict["origin"]:
 			origin = self.currentRoom.vnum
 			self.output("Changing the VNum of the current room to '{}'.".format(destination))
 		else:
-			origin = matchDict["origin"]
+			origin = int(matchDict["origin"])
 			self.output("Changing the Vnum '{}' to '{}'.".format(origin, destination))
-		for roomVnum, roomObj in self.rooms.items():
-			for direction, exitObj in roomObj.exits.items():
-				if roomVnum == origin:
-					exitObj.vnum = destination
-				if exitObj.to == origin:
-					self.rooms[roomVnum].exits[direction].to = destination
+		outgoingExits = list(self.rooms[origin].exits.values())
+		incomingExits = self.getIncomingExits(origin)
+		for exitObj in outgoingExits + incomingExits:
+			self.reverseExits.remove(exitObj)
+		for exitObj in outgoingExits:
+			exitObj.vnum = destination
+		for exitObj in incomingExits:
+			exitObj.to = destination
+		for exitObj in outgoingExits + incomingExits:
+			self.reverseExits.add(exitObj)
+		self.spatialIndex.remove(self.rooms[origin])
+		self.roomText.remove(self.rooms[origin])
+		self.searchIndex.remove(self.rooms[origin])
 		self.rooms[origin].vnum = destination
+		self.spatialIndex.add(self.rooms[origin])
+		self.roomText.add(self.rooms[origin])
+		self.searchIndex.add(self.rooms[origin])
 		self.rooms[destination] = self.rooms[origin]
 		del self.rooms[origin]
+		self.vnumAllocator.claim(destination)
+		self.mapModified(origin, destination, *{exitObj.vnum for exitObj in incomingExits})
 
 	def rdelete(self, *args):
 		if args and args[0] is not None and args[0].strip().isdigit():
-			if args[0].strip() in self.rooms:
-				vnum = args[0].strip()
+			if int(args[0].strip()) in self.rooms:
+				vnum = int(args[0].strip())
 			else:
 				return "Error: the vnum '{}' does not exist.".format(args[0].strip())
 		elif self.isSynced:
 			vnum = self.currentRoom.vnum
 			self.isSynced = False
-			self.currentRoom = self.rooms["0"]
+			self.currentRoom = self.rooms[0]
 		else:
 			return "Syntax: rdelete [vnum]"
 		output = "Deleting room '{}' with name '{}'.".format(vnum, self.rooms[vnum].name)
-		for roomVnum, roomObj in self.rooms.items():
-			for direction, exitObj in roomObj.exits.items():
-				if exitObj.to == vnum:
-					self.rooms[roomVnum].exits[direction].to = "undefined"
-		del self.rooms[vnum]
+		for exitObj in self.getIncomingExits(vnum):
+			self.linkExit(exitObj, roomdata.objects.VNUM_UNDEFINED)
+		self.removeLoadedRoom(vnum)
+		self.mapModified(vnum)
 		self.GUIRefresh()
 		return output
 
 	def searchRooms(self, *args, **kwArgs):
 		exactMatch = bool(kwArgs.get("exactMatch"))
 		validArgs = ("name", "desc", "dynamicDesc", "note", "terrain", "light", "align", "portable", "ridable", "x", "y", "z", "mobFlags", "loadFlags", "exitFlags", "doorFlags", "to", "door")
-		kwArgs = dict((key, value.strip().lower()) for key, value in kwArgs.items() if key.strip() in validArgs and value.strip())
-		results = []
+		kwArgs = dict((key, value.strip()) for key, value in kwArgs.items() if key.strip() in validArgs and value.strip())
 		if not kwArgs:
-			return results
-		for vnum, roomObj in self.rooms.items():
-			keysMatched = 0
-			for key, value in kwArgs.items():
-				if key in ("name", "desc", "dynamicDesc", "note"):
-					roomData = getattr(roomObj, key, "").strip().lower()
-					if exactMatch and roomData == value or value in roomData:
-						keysMatched += 1
-				elif key in ("terrain", "light", "align", "portable", "ridable", "x", "y", "z") and getattr(roomObj, key, "").strip().lower() == value:
-					keysMatched += 1
-				elif key in ("mobFlags", "loadFlags") and getattr(roomObj, key, set()).intersection(value):
-					keysMatched += 1
-			for direction, exitObj in roomObj.exits.items():
-				for key, value in kwArgs.items():
-					if key in ("exitFlags", "doorFlags") and getattr(exitObj, key, set()).intersection(value):
-						keysMatched += 1
-					elif key in ("to", "door") and getattr(exitObj, key, "").strip().lower() == value:
-						keysMatched += 1
-			if len(kwArgs) == keysMatched:
-				results.append(roomObj)
-		return results
+			return []
+		try:
+			query = roomdata.query.compileFields(kwArgs, exactMatch)
+		except roomdata.query.QueryError:
+			return []
+		return list(query.rooms(self))
+
+	def queryRooms(self, text, origin=None):
+		"""Return an iterator over the rooms matching a query, such as 'terrain=forest loadFlags:herb door~"gate" near 50'. Raises roomdata.query.QueryError if the query is invalid."""
+		return roomdata.query.compileQuery(text).rooms(self, origin)
+
+	def searchTerms(self, text):
+		"""Split the text of a find command into lower case search terms. Terms are separated by white space, unless they are enclosed in double quotes."""
+		terms = (match.group("quoted") if match.group("word") is None else match.group("word") for match in SEARCH_TERMS_REGEX.finditer(text.lower()))
+		return [term.strip() for term in terms if term.strip()]
+
+	def findRooms(self, field, text):
+		"""Return an iterator over the rooms where every search term in text occurs in the given text field, ignoring case. The field can also be 'door', to search the door names of exits."""
+		terms = self.searchTerms(text)
+		if not terms:
+			return iter(())
+		candidates = None
+		for term in terms:
+			vnums = self.searchIndex.candidates(field, term)
+			if vnums is not None:
+				candidates = vnums if candidates is None else candidates & vnums
+
+		def predicate(roomObj):
+			if field == "door":
+				return all(any(term in exitObj.door.lower() for exitObj in roomObj.exits.values()) for term in terms)
+			return all(term in getattr(roomObj, field).lower() for term in terms)
+
+		if candidates is None:
+			return self.rooms.matching(predicate)
+		return (roomObj for roomObj in (self.rooms[vnum] for vnum in candidates) if predicate(roomObj))
+
+	def nearestRooms(self, roomObjs, origin=None):
+		"""Return a list of the findLimit rooms from roomObjs which are closest to origin (the current room by default), closest first."""
+		if origin is None:
+			origin = self.currentRoom
+		# Selecting the closest rooms with a heap avoids sorting every match when a search matches most of the map.
+		return heapq.nsmallest(self.findLimit, roomObjs, key=origin.manhattanDistance)
+
+	def find(self, findFormat, *args):
+		if not args or args[0] is None or not args[0].strip():
+			return "Usage: 'find [query]'."
+		try:
+			results = self.nearestRooms(self.queryRooms(args[0]))
+		except roomdata.query.QueryError as e:
+			return "Error: {}.".format(e)
+		if not results:
+			return "Nothing found."
+		currentRoom = self.currentRoom
+		return "\n".join(findFormat.format(attribute="" if "{name}" in findFormat and "{attribute}" in findFormat else roomObj.name, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **roomObj.toDict()) for roomObj in reversed(results))
 
 	def fdoor(self, findFormat, *args):
 		if not args or args[0] is None or not args[0].strip():
 			return "Usage: 'fdoor [text]'."
-		results = self.searchRooms(door=args[0])
+		results = self.nearestRooms(self.findRooms("door", args[0]))
 		if not results:
 			return "Nothing found."
+		terms = self.searchTerms(args[0])
 		currentRoom = self.currentRoom
-		results.sort(key=lambda roomObj: roomObj.manhattanDistance(currentRoom))
-		return "\n".join(findFormat.format(attribute=", ".join(exitDir + ": " + exitObj.door for exitDir, exitObj in roomObj.exits.items() if args[0].strip() in exitObj.door), direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **vars(roomObj)) for roomObj in reversed(results[:20]))
+		return "\n".join(findFormat.format(attribute=", ".join(exitDir + ": " + exitObj.door for exitDir, exitObj in roomObj.exits.items() if any(term in exitObj.door.lower() for term in terms)), direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **roomObj.toDict()) for roomObj in reversed(results))
 
 	def fdynamic(self, findFormat, *args):
 		if not args or args[0] is None or not args[0].strip():
 			return "Usage: 'fdynamic [text]'."
-		results = self.searchRooms(dynamicDesc=args[0])
+		results = self.nearestRooms(self.findRooms("dynamicDesc", args[0]))
 		if not results:
 			return "Nothing found."
 		currentRoom = self.currentRoom
-		results.sort(key=lambda roomObj: roomObj.manhattanDistance(currentRoom))
-		return "\n".join(findFormat.format(attribute=roomObj.dynamicDesc, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **vars(roomObj)) for roomObj in reversed(results[:20]))
+		return "\n".join(findFormat.format(attribute=roomObj.dynamicDesc, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **roomObj.toDict()) for roomObj in reversed(results))
 
 	def flabel(self, findFormat, *args):
 		if not self.labels:
@@ -426,31 +914,29 @@ class World(object):
 			text = ""
 		else:
 			text = args[0].strip().lower()
-		results = {self.rooms[vnum] for label, vnum in self.labels.items() if text and text in label.strip().lower() or not text}
+		results = self.nearestRooms({self.rooms[vnum] for label, vnum in self.labels.items() if text and text in label.strip().lower() or not text})
 		if not results:
 			return "Nothing found."
 		currentRoom = self.currentRoom
-		return "\n".join(findFormat.format(attribute=self.getlabel(roomObj.vnum), direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **vars(roomObj)) for roomObj in reversed(sorted(results, key=lambda r: r.manhattanDistance(currentRoom))[:20]))
+		return "\n".join(findFormat.format(attribute=self.getlabel(roomObj.vnum), direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **roomObj.toDict()) for roomObj in reversed(results))
 
 	def fname(self, findFormat, *args):
 		if not args or args[0] is None or not args[0].strip():
 			return "Usage: 'fname [text]'."
-		results = self.searchRooms(name=args[0])
+		results = self.nearestRooms(self.findRooms("name", args[0]))
 		if not results:
 			return "Nothing found."
 		currentRoom = self.currentRoom
-		results.sort(key=lambda roomObj: roomObj.manhattanDistance(currentRoom))
-		return "\n".join(findFormat.format(attribute="" if "{name}" in findFormat and "{attribute}" in findFormat else roomObj.name, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **vars(roomObj)) for roomObj in reversed(results[:20]))
+		return "\n".join(findFormat.format(attribute="" if "{name}" in findFormat and "{attribute}" in findFormat else roomObj.name, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **roomObj.toDict()) for roomObj in reversed(results))
 
 	def fnote(self, findFormat, *args):
 		if not args or args[0] is None or not args[0].strip():
 			return "Usage: 'fnote [text]'."
-		results = self.searchRooms(note=args[0])
+		results = self.nearestRooms(self.findRooms("note", args[0]))
 		if not results:
 			return "Nothing found."
 		currentRoom = self.currentRoom
-		results.sort(key=lambda roomObj: roomObj.manhattanDistance(currentRoom))
-		return "\n".join(findFormat.format(attribute=roomObj.note, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **vars(roomObj)) for roomObj in reversed(results[:20]))
+		return "\n".join(findFormat.format(attribute=roomObj.note, direction=currentRoom.directionTo(roomObj), clockPosition=currentRoom.clockPositionTo(roomObj), distance=currentRoom.manhattanDistance(roomObj), **roomObj.toDict()) for roomObj in reversed(results))
 
 	def rnote(self, *args):
 		if not args or args[0] is None or not args[0].strip():
@@ -459,14 +945,14 @@ class World(object):
 		if note.lower().startswith("-r"):
 			if len(note) > 2:
 				return "Error: '-r' requires no extra arguments. Change aborted."
-			self.currentRoom.note = ""
+			self.setRoomText(self.currentRoom, note="")
 			return "Note removed."
 		elif note.lower().startswith("-a"):
 			if len(note) == 2:
 				return "Error: '-a' requires text to be appended. Change aborted."
-			self.currentRoom.note = "{} {}".format(self.currentRoom.note.strip(), note[2:].strip())
+			self.setRoomText(self.currentRoom, note="{} {}".format(self.currentRoom.note.strip(), note[2:].strip()))
 		else:
-			self.currentRoom.note = note
+			self.setRoomText(self.currentRoom, note=note)
 		return "Room note now set to '{}'.".format(self.currentRoom.note)
 
 	def ralign(self, *args):
@@ -474,6 +960,7 @@ class World(object):
 		if not args or not args[0] or args[0].strip().lower() not in validValues:
 			return "Room alignment set to '{}'. Use 'ralign [{}]' to change it.".format(self.currentRoom.align, " | ".join(validValues))
 		self.currentRoom.align = args[0].strip().lower()
+		self.roomsChanged(self.currentRoom.vnum)
 		return "Setting room align to '{}'.".format(self.currentRoom.align)
 
 	def rlight(self, *args):
@@ -483,6 +970,7 @@ class World(object):
 			self.currentRoom.light = LIGHT_SYMBOLS[args[0].strip()]
 		except KeyError:
 			self.currentRoom.light = args[0].strip().lower()
+		self.roomsChanged(self.currentRoom.vnum)
 		return "Setting room light to '{}'.".format(self.currentRoom.light)
 
 	def rportable(self, *args):
@@ -490,6 +978,7 @@ class World(object):
 		if not args or not args[0] or args[0].strip().lower() not in validValues:
 			return "Room portable set to '{}'. Use 'rportable [{}]' to change it.".format(self.currentRoom.portable, " | ".join(validValues))
 		self.currentRoom.portable = args[0].strip().lower()
+		self.roomsChanged(self.currentRoom.vnum)
 		return "Setting room portable to '{}'.".format(self.currentRoom.portable)
 
 	def rridable(self, *args):
@@ -498,6 +987,7 @@ class World(object):
 			return "Room ridable set to '{}'. Use 'rridable [{}]' to change it.".format(self.currentRoom.ridable, " | ".join(validValues))
 		self.currentRoom.ridable = args[0].strip().lower()
 		self.currentRoom.calculateCost()
+		self.mapModified(self.currentRoom.vnum)
 		return "Setting room ridable to '{}'.".format(self.currentRoom.ridable)
 
 	def ravoid(self, *args):
@@ -506,6 +996,7 @@ class World(object):
 			return "Room avoid {}. Use 'ravoid [{}]' to change it.".format("enabled" if self.currentRoom.avoid else "disabled", " | ".join(validValues))
 		self.currentRoom.avoid = args[0].strip() == "+"
 		self.currentRoom.calculateCost()
+		self.mapModified(self.currentRoom.vnum)
 		return "{} room avoid.".format("Enabling" if self.currentRoom.avoid else "Disabling")
 
 	def rterrain(self, *args):
@@ -516,13 +1007,15 @@ class World(object):
 		except KeyError:
 			self.currentRoom.terrain = args[0].strip().lower()
 		self.currentRoom.calculateCost()
+		self.mapModified(self.currentRoom.vnum)
 		self.GUIRefresh()
 		return "Setting room terrain to '{}'.".format(self.currentRoom.terrain)
 
 	def rx(self, *args):
 		if args and args[0] and args[0].strip():
 			try:
-				self.currentRoom.x = int(args[0].strip())
+				self.spatialIndex.move(self.currentRoom, x=int(args[0].strip()))
+				self.mapModified(self.currentRoom.vnum)
 				self.GUIRefresh()
 				return "Setting room X coordinate to '{}'.".format(self.currentRoom.x)
 			except ValueError:
@@ -532,7 +1025,8 @@ class World(object):
 	def ry(self, *args):
 		if args and args[0] and args[0].strip():
 			try:
-				self.currentRoom.y = int(args[0].strip())
+				self.spatialIndex.move(self.currentRoom, y=int(args[0].strip()))
+				self.mapModified(self.currentRoom.vnum)
 				self.GUIRefresh()
 				return "Setting room Y coordinate to '{}'.".format(self.currentRoom.y)
 			except ValueError:
@@ -542,7 +1036,8 @@ class World(object):
 	def rz(self, *args):
 		if args and args[0] and args[0].strip():
 			try:
-				self.currentRoom.z = int(args[0].strip())
+				self.spatialIndex.move(self.currentRoom, z=int(args[0].strip()))
+				self.mapModified(self.currentRoom.vnum)
 				self.GUIRefresh()
 				return "Setting room Z coordinate to '{}'.".format(self.currentRoom.z)
 			except ValueError:
@@ -558,6 +1053,7 @@ class World(object):
 		if "remove".startswith(matchDict["mode"]):
 			if matchDict["flag"] in self.currentRoom.mobFlags:
 				self.currentRoom.mobFlags.remove(matchDict["flag"])
+				self.roomsChanged(self.currentRoom.vnum)
 				return "Mob flag '{}' removed.".format(matchDict["flag"])
 			else:
 				return "Mob flag '{}' not set.".format(matchDict["flag"])
@@ -566,6 +1062,7 @@ class World(object):
 				return "Mob flag '{}' already set.".format(matchDict["flag"])
 			else:
 				self.currentRoom.mobFlags.add(matchDict["flag"])
+				self.roomsChanged(self.currentRoom.vnum)
 				return "Mob flag '{}' added.".format(matchDict["flag"])
 
 	def rloadflags(self, *args):
@@ -577,6 +1074,7 @@ class World(object):
 		if "remove".startswith(matchDict["mode"]):
 			if matchDict["flag"] in self.currentRoom.loadFlags:
 				self.currentRoom.loadFlags.remove(matchDict["flag"])
+				self.roomsChanged(self.currentRoom.vnum)
 				return "Load flag '{}' removed.".format(matchDict["flag"])
 			else:
 				return "Load flag '{}' not set.".format(matchDict["flag"])
@@ -585,6 +1083,7 @@ class World(object):
 				return "Load flag '{}' already set.".format(matchDict["flag"])
 			else:
 				self.currentRoom.loadFlags.add(matchDict["flag"])
+				self.roomsChanged(self.currentRoom.vnum)
 				return "Load flag '{}' added.".format(matchDict["flag"])
 
 	def exitflags(self, *args):
@@ -601,6 +1100,7 @@ class World(object):
 		elif "remove".startswith(matchDict["mode"]):
 			if matchDict["flag"] in self.currentRoom.exits[direction].exitFlags:
 				self.currentRoom.exits[direction].exitFlags.remove(matchDict["flag"])
+				self.mapModified(self.currentRoom.vnum)
 				return "Exit flag '{}' in direction '{}' removed.".format(matchDict["flag"], direction)
 			else:
 				return "Exit flag '{}' in direction '{}' not set.".format(matchDict["flag"], direction)
@@ -609,6 +1109,7 @@ class World(object):
 				return "Exit flag '{}' in direction '{}' already set.".format(matchDict["flag"], direction)
 			else:
 				self.currentRoom.exits[direction].exitFlags.add(matchDict["flag"])
+				self.mapModified(self.currentRoom.vnum)
 				return "Exit flag '{}' in direction '{}' added.".format(matchDict["flag"], direction)
 
 	def doorflags(self, *args):
@@ -625,6 +1126,7 @@ class World(object):
 		elif "remove".startswith(matchDict["mode"]):
 			if matchDict["flag"] in self.currentRoom.exits[direction].doorFlags:
 				self.currentRoom.exits[direction].doorFlags.remove(matchDict["flag"])
+				self.roomsChanged(self.currentRoom.vnum)
 				return "Door flag '{}' in direction '{}' removed.".format(matchDict["flag"], direction)
 			else:
 				return "Door flag '{}' in direction '{}' not set.".format(matchDict["flag"], direction)
@@ -633,6 +1135,7 @@ class World(object):
 				return "Door flag '{}' in direction '{}' already set.".format(matchDict["flag"], direction)
 			else:
 				self.currentRoom.exits[direction].doorFlags.add(matchDict["flag"])
+				self.roomsChanged(self.currentRoom.vnum)
 				return "Door flag '{}' in direction '{}' added.".format(matchDict["flag"], direction)
 
 	def secret(self, *args):
@@ -646,10 +1149,11 @@ class World(object):
 			if not matchDict["name"]:
 				return "Error: 'add' expects a name for the secret."
 			elif direction not in self.currentRoom.exits:
-				self.currentRoom.exits[direction] = self.getNewExit(direction)
+				self.setExit(self.currentRoom, self.getNewExit(direction))
 			self.currentRoom.exits[direction].exitFlags.add("door")
 			self.currentRoom.exits[direction].doorFlags.add("hidden")
-			self.currentRoom.exits[direction].door = matchDict["name"]
+			self.setDoor(self.currentRoom, direction, matchDict["name"])
+			self.mapModified(self.currentRoom.vnum)
 			self.GUIRefresh()
 			return "Adding secret '{}' to direction '{}'.".format(matchDict["name"], direction)
 		elif direction not in self.currentRoom.exits:
@@ -663,7 +1167,8 @@ class World(object):
 				self.currentRoom.exits[direction].exitFlags.remove("door")
 			if "hidden" in self.currentRoom.exits[direction].doorFlags:
 				self.currentRoom.exits[direction].doorFlags.remove("hidden")
-			self.currentRoom.exits[direction].door = ""
+			self.setDoor(self.currentRoom, direction, "")
+			self.mapModified(self.currentRoom.vnum)
 			self.GUIRefresh()
 			return "Secret {} removed.".format(direction)
 
@@ -674,35 +1179,36 @@ class World(object):
 		except (NameError, IndexError, AttributeError):
 			return "Syntax: 'rlink [add | remove] [oneway] [vnum] [{}]'.".format(" | ".join(DIRECTIONS))
 		direction = "".join(dir for dir in DIRECTIONS if dir.startswith(matchDict["direction"]))
+		vnum = roomdata.objects.vnumFromString(matchDict["vnum"]) if matchDict["vnum"] else None
 		if matchDict["mode"] and "add".startswith(matchDict["mode"]):
 			reversedDirection = REVERSE_DIRECTIONS[direction]
-			if not matchDict["vnum"]:
+			if vnum is None:
 				return "Error: 'add' expects a vnum or 'undefined'."
-			elif matchDict["vnum"] != "undefined" and matchDict["vnum"] not in self.rooms:
+			elif vnum != roomdata.objects.VNUM_UNDEFINED and vnum not in self.rooms:
 				return "Error: vnum {} not in database.".format(matchDict["vnum"])
 			elif direction not in self.currentRoom.exits:
-				self.currentRoom.exits[direction] = self.getNewExit(direction)
-			self.currentRoom.exits[direction].to = matchDict["vnum"]
-			if matchDict["vnum"] == "undefined":
+				self.setExit(self.currentRoom, self.getNewExit(direction))
+			self.linkExit(self.currentRoom.exits[direction], vnum)
+			if vnum == roomdata.objects.VNUM_UNDEFINED:
 				self.GUIRefresh()
 				return "Direction {} now undefined.".format(direction)
 			elif not matchDict["oneway"]:
-				if reversedDirection not in self.rooms[matchDict["vnum"]].exits or self.rooms[matchDict["vnum"]].exits[reversedDirection].to == "undefined":
-					self.rooms[matchDict["vnum"]].exits[reversedDirection] = self.getNewExit(reversedDirection, self.currentRoom.vnum)
+				if reversedDirection not in self.rooms[vnum].exits or self.rooms[vnum].exits[reversedDirection].to == roomdata.objects.VNUM_UNDEFINED:
+					self.setExit(self.rooms[vnum], self.getNewExit(reversedDirection, self.currentRoom.vnum, vnum))
 					self.GUIRefresh()
-					return "Linking direction {} to {} with name '{}'.\nLinked exit {} in second room with this room.".format(direction, matchDict["vnum"], self.rooms[matchDict["vnum"]].name if matchDict["vnum"] in self.rooms else "", reversedDirection)
+					return "Linking direction {} to {} with name '{}'.\nLinked exit {} in second room with this room.".format(direction, vnum, self.rooms[vnum].name if vnum in self.rooms else "", reversedDirection)
 				else:
 					self.GUIRefresh()
-					return "Linking direction {} to {} with name '{}'.\nUnable to link exit {} in second room with this room: exit already defined.".format(direction, matchDict["vnum"], self.rooms[matchDict["vnum"]].name if matchDict["vnum"] in self.rooms else "", reversedDirection)
+					return "Linking direction {} to {} with name '{}'.\nUnable to link exit {} in second room with this room: exit already defined.".format(direction, vnum, self.rooms[vnum].name if vnum in self.rooms else "", reversedDirection)
 			else:
 				self.GUIRefresh()
-				return "Linking direction {} one way to {} with name '{}'.".format(direction, matchDict["vnum"], self.rooms[matchDict["vnum"]].name if matchDict["vnum"] in self.rooms else "")
+				return "Linking direction {} one way to {} with name '{}'.".format(direction, vnum, self.rooms[vnum].name if vnum in self.rooms else "")
 		elif direction not in self.currentRoom.exits:
 			return "Exit {} does not exist.".format(direction)
 		elif not matchDict["mode"]:
-			return "Exit '{}' links to '{}' with name '{}'.".format(direction, self.currentRoom.exits[direction].to, self.rooms[self.currentRoom.exits[direction].to].name if self.currentRoom.exits[direction].to in self.rooms else "")
+			return "Exit '{}' links to '{}' with name '{}'.".format(direction, roomdata.objects.vnumToString(self.currentRoom.exits[direction].to), self.rooms[self.currentRoom.exits[direction].to].name if self.currentRoom.exits[direction].to in self.rooms else "")
 		elif "remove".startswith(matchDict["mode"]):
-			del self.currentRoom.exits[direction]
+			self.deleteExit(self.currentRoom, direction)
 			self.GUIRefresh()
 			return "Exit {} removed.".format(direction)
 
@@ -710,7 +1216,7 @@ class World(object):
 		if not args or not args[0] or not args[0].strip().isdigit():
 			findVnum = self.currentRoom.vnum
 		else:
-			findVnum = args[0].strip()
+			findVnum = int(args[0].strip())
 		result = ", ".join(sorted(label for label, vnum in self.labels.items() if vnum == findVnum))
 		if result:
 			return "Room labels: {}".format(result)
@@ -736,7 +1242,7 @@ class World(object):
 				vnum = self.currentRoom.vnum
 				self.output("adding the label '{0}' to current room with VNum '{1}'.".format(label, vnum))
 			else:
-				vnum = matchDict["vnum"]
+				vnum = int(matchDict["vnum"])
 				self.output("adding the label '{0}' with VNum '{1}'.".format(label, vnum))
 			self.labels[label] = vnum
 			self.saveLabels()
@@ -768,13 +1274,11 @@ class World(object):
 		if not args or not args[0]:
 			vnum = self.currentRoom.vnum
 		else:
-			vnum = args[0].strip().lower()
-		if vnum in self.labels:
-			vnum = self.labels[vnum]
+			vnum = self.lookupVnum(args[0])
 		if vnum in self.rooms:
 			room = self.rooms[vnum]
 		else:
-			return ["Error: No such vnum or label, '{0}'".format(vnum)]
+			return ["Error: No such vnum or label, '{0}'".format(args[0].strip().lower())]
 		info = []
 		info.append("vnum: '{0}'".format(room.vnum))
 		info.append("Name: '{0}'".format(room.name))
@@ -800,7 +1304,7 @@ class World(object):
 		for direction, exitcls in self.sortExits(room.exits):
 			info.append("-----")
 			info.append("Direction: '{0}'".format(direction))
-			info.append("To: '{0}'".format(exitcls.to))
+			info.append("To: '{0}'".format(roomdata.objects.vnumToString(exitcls.to)))
 			info.append("Exit Flags: '{0}'".format(", ".join(exitcls.exitFlags)))
 			info.append("Door Name: '{0}'".format(exitcls.door))
 			info.append("Door Flags: '{0}'".format(", ".join(exitcls.doorFlags)))
@@ -833,92 +1337,161 @@ class World(object):
 			result.extend(compressDirections(directionsBuffer))
 		return ", ".join(result)
 
-	def path(self, *args):
-		if not args or not args[0]:
-			return "Usage: path [label|vnum]"
-		match = RUN_DESTINATION_REGEX.match(args[0].strip())
-		destination = match.group("destination")
+	def parsePathArguments(self, text):
+		"""Split the arguments of the path, run, and step commands into the destination and a list of flags, or None if there are no flags. The last word is only treated as flags if they are all valid."""
+		match = RUN_DESTINATION_REGEX.match(text.strip())
 		flags = match.group("flags")
-		if flags:
-			flags = flags.split("|")
+		if flags and all(flag in PATH_FLAGS for flag in flags.lower().split("|")):
+			return match.group("destination"), flags.lower().split("|")
+		return text.strip(), None
+
+	def lookupDestinations(self, text, origin):
+		"""
+		Return a tuple of the vnums of the destination rooms and a function which checks if a room is a destination, for a destination given by the user. One of them is always None.
+		The destination can be a label or vnum, 'nearest of' followed by labels or vnums separated by commas, or 'nearest' followed by a mob or load flag, or a query as used by the find command.
+		Return (None, None) if a label or vnum isn't valid. Raises roomdata.query.QueryError if the query is invalid.
+		"""
+		match = NEAREST_DESTINATION_REGEX.match(text.strip())
+		if match is None:
+			vnums = [self.lookupVnum(text)]
+		elif match.group("labels") is not None:
+			vnums = [self.lookupVnum(label) for label in match.group("labels").split(",") if label.strip()]
 		else:
-			flags = None
+			query = match.group("query").strip()
+			# A single flag name is a shortcut for searching for rooms with that flag.
+			if query.lower() in roomdata.objects.MOB_FLAG_TABLE.bits:
+				query = "mobFlags:{}".format(query)
+			elif query.lower() in roomdata.objects.LOAD_FLAG_TABLE.bits:
+				query = "loadFlags:{}".format(query)
+			return None, roomdata.query.compileQuery(query).compile(origin)
+		if not vnums or any(vnum not in self.rooms for vnum in vnums):
+			return None, None
+		return tuple(vnums), None
+
+	def path(self, *args):
+		if not args or not args[0]:
+			return "Usage: path [label|vnum|nearest [query]|nearest of [labels]]"
+		destination, flags = self.parsePathArguments(args[0])
 		result = self.pathFind(destination=destination, flags=flags)
 		if result is not None:
 			return self.createSpeedWalk(result)
 
+	def lookupRoomList(self, text):
+		"""Return a list of (name, vnum) tuples for labels or vnums separated by commas, or None if any of them isn't valid."""
+		names = [name.strip() for name in text.split(",") if name.strip()]
+		vnums = [self.lookupVnum(name) for name in names]
+		if not names or any(vnum not in self.rooms for vnum in vnums):
+			return None
+		return list(zip(names, vnums))
+
+	def distanceMatrix(self, vnums, flags=None):
+		"""Return a list of rows with the cost of the cheapest path from each of the rooms with the given vnums to each of the others, or INFINITY if there is no path."""
+		avoidTerrains = frozenset(terrain for terrain in roomdata.objects.TERRAIN_COSTS if "no{0}".format(terrain) in flags) if flags else frozenset()
+		return self.pathGraph.get(self.rooms).distanceMatrix(vnums, avoidTerrains)
+
+	def formatCost(self, cost):
+		return "unreachable" if cost == roomdata.graph.INFINITY else "{:.0f}".format(cost)
+
+	def distances(self, *args):
+		if not args or not args[0] or not args[0].strip():
+			return "Usage: distances [label|vnum],[label|vnum],... [flags]"
+		text, flags = self.parsePathArguments(args[0])
+		rooms = self.lookupRoomList(text)
+		if rooms is None or len(rooms) < 2:
+			return "Error: give at least two valid labels or vnums, separated by commas."
+		matrix = self.distanceMatrix([vnum for name, vnum in rooms], flags)
+		results = []
+		for (name, vnum), row in zip(rooms, matrix):
+			results.append("From {}: {}".format(name, ", ".join("{} {}".format(targetName, self.formatCost(cost)) for (targetName, targetVnum), cost in zip(rooms, row) if targetVnum != vnum)))
+		return "\n".join(results)
+
+	def tour(self, *args):
+		if not args or not args[0] or not args[0].strip():
+			return "Usage: tour [label|vnum],[label|vnum],... [flags]"
+		text, flags = self.parsePathArguments(args[0])
+		rooms = self.lookupRoomList(text)
+		if rooms is None:
+			return "Error: invalid label or vnum."
+		elif not self.currentRoom:
+			return "Error: Invalid origin."
+		rooms.insert(0, ("here", self.currentRoom.vnum))
+		matrix = self.distanceMatrix([vnum for name, vnum in rooms], flags)
+		order = roomdata.graph.tourOrder(matrix)
+		results = []
+		for source, target in zip(order, order[1:]):
+			results.append("{} ({})".format(rooms[target][0], self.formatCost(matrix[source][target])))
+		return "Visit order: {}. Total cost: {}.".format(", ".join(results), self.formatCost(roomdata.graph.tourCost(matrix, order)))
+
 	def pathFind(self, origin=None, destination=None, flags=None):
-		"""Find the path"""
+		"""Find the path to a destination room, or to the nearest of several. The destination can be a room object, or any of the destinations accepted by lookupDestinations."""
 		if not origin:
 			origin = self.currentRoom
-		if destination and destination.strip().lower() in self.labels:
-			destination = self.labels[destination.strip().lower()]
-		if destination and destination in self.rooms:
-			destination = self.rooms[destination]
-		if not origin or not destination:
+		destinations = isDestination = None
+		if isinstance(destination, roomdata.objects.Room):
+			destinations = (destination.vnum,)
+		elif destination is not None and origin:
+			try:
+				destinations, isDestination = self.lookupDestinations(destination, origin)
+			except roomdata.query.QueryError as e:
+				self.output("Error: {}.".format(e))
+				return None
+		if not origin or destinations is None and isDestination is None:
 			self.output("Error: Invalid origin or destination.")
 			return None
-		if origin is destination:
+		if origin.vnum in (destinations or ()) or isDestination is not None and isDestination(origin):
 			self.output("You are already there!")
 			return []
 		if flags:
 			avoidTerrains = frozenset(terrain for terrain in roomdata.objects.TERRAIN_COSTS if "no{0}".format(terrain) in flags)
+			algorithm = next((algorithm for algorithm in roomdata.graph.PATH_ALGORITHMS if algorithm in flags), self.pathAlgorithm)
 		else:
 			avoidTerrains = frozenset()
-		ignoreVnums = frozenset(("undefined", "death"))
-		isDestinationFunc = lambda currentRoomObj: currentRoomObj is destination  # NOQA: E731
-		exitIgnoreFunc = lambda exitObj: exitObj.to in ignoreVnums  # NOQA: E731
-		exitCostFunc = lambda exitObj, neighborRoomObj: (5 if "door" in exitObj.exitFlags or "climb" in exitObj.exitFlags else 0) + (1000 if "avoid" in exitObj.exitFlags else 0) + (10 if neighborRoomObj.terrain in avoidTerrains else 0)  # NOQA: E731
-		exitDestinationFunc = None
-		return self._pathFind(origin, isDestinationFunc, exitIgnoreFunc, exitCostFunc, exitDestinationFunc)
-
-	def _pathFind(self, origin, isDestinationFunc=None, exitIgnoreFunc=None, exitCostFunc=None, exitDestinationFunc=None):
-		# Each key-value pare that gets added to this dict will be a parent room and child room respectively.
-		parents = {origin: origin}
-		# unprocessed rooms.
-		opened = []
-		# Using a binary heap for storing unvisited rooms significantly increases performance.
-		# https://en.wikipedia.org/wiki/Binary_heap
-		heapq.heapify(opened)
-		# Put the origin cost and origin room on the opened rooms heap to be processed first.
-		heapq.heappush(opened, (origin.cost, origin))
-		# previously processed rooms.
-		closed = {}
-		# Ignore the origin from the search by adding it to the closed rooms dict.
-		closed[origin] = origin.cost
-		# Search while there are rooms left in the opened heap.
-		while opened:
-			# Pop the last room cost and room object reference off the opened heap for processing.
-			currentRoomCost, currentRoomObj = heapq.heappop(opened)
-			if isDestinationFunc and isDestinationFunc(currentRoomObj):
-				# We successfully found a path from the origin to the destination.
-				break
-			# Loop through the exits, and process each room linked to the current room.
-			for exitDirection, exitObj in currentRoomObj.exits.items():
-				if exitIgnoreFunc and exitIgnoreFunc(exitObj):
-					continue
-				# Get a reference to the room object that the exit leads to using the room's vnum.
-				neighborRoomObj = self.rooms[exitObj.to]
-				# The neighbor room cost should be the sum of all movement costs to get to the neighbor room from the origin room.
-				neighborRoomCost = currentRoomCost + neighborRoomObj.cost + exitCostFunc(exitObj, neighborRoomObj) if exitCostFunc else 0
-				# We're only interested in the neighbor room if it hasn't been encountered yet, or if the cost of moving from the current room to the neighbor room is less than the cost of moving to the neighbor room from a previously discovered room.
-				if neighborRoomObj not in closed or closed[neighborRoomObj] > neighborRoomCost:
-					# Add the room object and room cost to the dict of closed rooms, and put it on the opened rooms heap to be processed.
-					closed[neighborRoomObj] = neighborRoomCost
-					heapq.heappush(opened, (neighborRoomCost, neighborRoomObj))
-					# Since the current room is so far the most optimal way into the neighbor room, set it as the parent of the neighbor room.
-					parents[neighborRoomObj] = (currentRoomObj, exitDirection)
-					if exitDestinationFunc and exitDestinationFunc(exitObj, neighborRoomObj):
-						break
+			algorithm = self.pathAlgorithm
+		landmarks = None
+		if isDestination is not None:
+			# The destination rooms aren't known in advance, so only Dijkstra's algorithm can be used.
+			algorithm = "dijkstra"
+		elif algorithm == "landmarks":
+			self.landmarks.request(self._landmarkGraph, self.landmarkCount)
+			landmarks = self.landmarks.get()
+			if landmarks is None:
+				self.output("The landmarks aren't ready yet. Using Dijkstra's algorithm.")
+				algorithm = "dijkstra"
+		if isDestination is not None:
+			result = self.pathGraph.get(self.rooms).nearestPath(origin.vnum, isDestination, self.rooms, avoidTerrains)
+		elif algorithm == "dijkstra":
+			# Players often return to the same places, so the cheapest routes to the destination from every room are kept for later.
+			result = self.routeCache.get(self.pathGraph, self.rooms, destinations, avoidTerrains).route(self.rooms, origin.vnum)
 		else:
-			# The while loop terminated normally (I.E. without encountering a break statement), and the destination was *not* found.
+			result = self.pathGraph.get(self.rooms).shortestPath(origin.vnum, destinations, avoidTerrains, algorithm, landmarks)
+		if result is None:
 			self.output("No routes found.")
 			return None
-		# The while statement was broken prematurely, meaning that the destination was found.
-		# Find the path from the origin to the destination by traversing the hierarchy of room parents, starting with the current room.
+		cost, path = result
+		if flags and "verify" in flags and algorithm != "dijkstra":
+			# Check the route against the one found by Dijkstra's algorithm, which is always the cheapest.
+			shortestCost, shortestPath = self.pathGraph.get(self.rooms).shortestPath(origin.vnum, destinations, avoidTerrains, "dijkstra")
+			if abs(cost - shortestCost) > 1e-6:
+				self.output("Warning: the {} route costs {:.2f}, but the cheapest route costs {:.2f}. Using the cheapest route.".format(algorithm, cost, shortestCost))
+				path = shortestPath
+			else:
+				self.output("Verified: the {} route has the same cost as the cheapest route ({:.2f}).".format(algorithm, cost))
+		if destinations is None or len(destinations) > 1:
+			vnum, direction = path[-1]
+			destination = self.rooms[self.rooms[vnum].exits[direction].to]
+			self.output("The nearest destination is {}, {}.".format(destination.vnum, destination.name))
+			if destinations is None:
+				destinations = (destination.vnum,)
+		# Auto-walking uses these to find a new route if the player is moved off this one.
+		self.lastRouteTarget = (frozenset(destinations), avoidTerrains)
+		return self.pathCommands(origin, path)
+
+	def pathCommands(self, origin, path):
+		"""Return the list of commands for following a path of (vnum, direction) tuples from the origin room, in reverse order."""
+		# Build the list of commands in reverse order, starting from the destination.
 		results = []
-		while currentRoomObj is not origin:
-			currentRoomObj, direction = parents[currentRoomObj]
+		for vnum, direction in reversed(path):
+			currentRoomObj = self.rooms[vnum]
 			if currentRoomObj.vnum in LEAD_BEFORE_ENTERING_VNUMS and currentRoomObj.exits[direction].to not in LEAD_BEFORE_ENTERING_VNUMS and currentRoomObj is not origin:
 				results.append("ride")
 			results.append(direction)
@@ -32,13 +32,16 @@ if __name__ == "__main__":
 	parser.add_argument("-nssl", "--no-ssl", help="Disable encrypted communication between the local and remote hosts.", action="store_true")
 	parser.add_argument("-ptlf", "--prompt-terminator-lf", help="Terminate game prompts with new line characters (IAC + GA is default).", action="store_true")
 	parser.add_argument("-gp", "--gag-prompts", help="Gag emulated prompts.", action="store_true")
+	parser.add_argument("-en", "--engine", help="Select how the proxy, mapper, and timers are run. Either in separate threads, or as coroutines on a single asyncio event loop.", choices=["thread", "asyncio"], default="thread")
+	parser.add_argument("-mc", "--multi-client", help="Accept multiple client connections. Each client gets its own connection to the game and mapper session, but all sessions share a single copy of the map. Implies the text interface.", action="store_true")
 	parser.add_argument("-ff", "--find-format", help="The format string for controlling output of the find commands. Accepts the following placeholders in braces: {attribute}, {direction}, {clockPosition}, {distance}, {name}, {vnum}. Where {attribute} represents the attribute on which the search is performed.", default="{vnum}, {name}, {attribute}")
+	parser.add_argument("-fl", "--find-limit", metavar="number", type=int, help="The maximum number of results shown by the find commands.", default=20)
 	args = parser.parse_args()
 	try:
 		if args.emulation:
-			mapper.emulation.main(interface=args.interface, findFormat=args.find_format)
+			mapper.emulation.main(interface=args.interface, findFormat=args.find_format, findLimit=args.find_limit)
 		else:
-			mapper.main.main(outputFormat=args.format, interface=args.interface, promptTerminator=b"\r\n" if args.prompt_terminator_lf else None, gagPrompts=args.gag_prompts, findFormat=args.find_format, localHost=args.local_host, localPort=args.local_port, remoteHost=args.remote_host, remotePort=args.remote_port, noSsl=args.no_ssl)
+			mapper.main.main(outputFormat=args.format, interface=args.interface, promptTerminator=b"\r\n" if args.prompt_terminator_lf else None, gagPrompts=args.gag_prompts, findFormat=args.find_format, findLimit=args.find_limit, localHost=args.local_host, localPort=args.local_port, remoteHost=args.remote_host, remotePort=args.remote_port, noSsl=args.no_ssl, engine=args.engine, multiClient=args.multi_client)
 	except:  # NOQA: E722
 		traceback.print_exception(*sys.exc_info())
 		logging.exception("OOPS!")
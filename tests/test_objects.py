@@ -0,0 +1,26 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import unittest
+
+from mapper.roomdata.objects import VNUM_DEATH, VNUM_UNDEFINED, vnumFromString, vnumToString
+
+
+class TestVnums(unittest.TestCase):
+	def testFromString(self):
+		self.assertEqual(vnumFromString("1234"), 1234)
+		self.assertEqual(vnumFromString("undefined"), VNUM_UNDEFINED)
+		self.assertEqual(vnumFromString("death"), VNUM_DEATH)
+		for text in ("", "12a", "nowhere", "Undefined"):
+			with self.assertRaises(ValueError):
+				vnumFromString(text)
+
+	def testRoundTrip(self):
+		for vnum in (0, 1234, VNUM_UNDEFINED, VNUM_DEATH):
+			self.assertEqual(vnumFromString(vnumToString(vnum)), vnum)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,119 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+import unittest
+
+from mapper.roomdata.objects import Exit, Room
+from mapper.roomdata.query import And, Near, Not, Or, Predicate, QueryError, TextMatch, ValueMatch, compileQuery
+
+
+def makeRoom(vnum, name="", terrain="undefined", x=0, y=0, z=0, loadFlags=(), doors=()):
+	roomObj = Room(vnum)
+	roomObj.name = name
+	roomObj.terrain = terrain
+	roomObj.x = x
+	roomObj.y = y
+	roomObj.z = z
+	roomObj.loadFlags = loadFlags
+	for direction, door in doors:
+		exitObj = Exit()
+		exitObj.direction = direction
+		exitObj.vnum = vnum
+		exitObj.door = door
+		roomObj.exits[direction] = exitObj
+	return roomObj
+
+
+class TestParser(unittest.TestCase):
+	def testAndBindsTighterThanOr(self):
+		plan = compileQuery("road or forest trail").plan
+		self.assertIsInstance(plan, Or)
+		self.assertIsInstance(plan.children[0], TextMatch)
+		self.assertIsInstance(plan.children[1], And)
+		plan = compileQuery("road and forest or trail").plan
+		self.assertIsInstance(plan, Or)
+		self.assertIsInstance(plan.children[0], And)
+		self.assertIsInstance(plan.children[1], TextMatch)
+
+	def testParenthesesGroupTerms(self):
+		plan = compileQuery("(road or forest) trail").plan
+		self.assertIsInstance(plan, And)
+		self.assertEqual(sorted(type(child).__name__ for child in plan.children), ["Or", "TextMatch"])
+		with self.assertRaises(QueryError):
+			compileQuery("(road or forest")
+
+	def testNotAppliesToTheNextTerm(self):
+		plan = compileQuery("not terrain=forest road").plan
+		self.assertIsInstance(plan, And)
+		negated = [child for child in plan.children if isinstance(child, Not)]
+		self.assertEqual(len(negated), 1)
+		self.assertIsInstance(negated[0].child, ValueMatch)
+		plan = compileQuery("not (road or trail)").plan
+		self.assertIsInstance(plan, Not)
+		self.assertIsInstance(plan.child, Or)
+		with self.assertRaises(QueryError):
+			compileQuery("road not")
+
+	def testQuotedValues(self):
+		plan = compileQuery('name="  The Dark Forest "').plan
+		self.assertEqual((plan.attribute, plan.text, plan.exact), ("name", "the dark forest", True))
+		plan = compileQuery('"forest trail"').plan
+		self.assertEqual((plan.attribute, plan.text, plan.exact), ("name", "forest trail", False))
+		plan = compileQuery('note~"or not"').plan
+		self.assertEqual((plan.attribute, plan.text, plan.exact), ("note", "or not", False))
+
+	def testNear(self):
+		plan = compileQuery("near 5").plan
+		self.assertIsInstance(plan, Near)
+		self.assertEqual(plan.distance, 5)
+		for text in ("near", "near far", "near (5)"):
+			with self.assertRaises(QueryError):
+				compileQuery(text)
+
+	def testInvalidQueries(self):
+		for text in ("", "   ", "colour=red", "terrain~forest", "x=north", "loadflags:nothing", "road )"):
+			with self.assertRaises(QueryError):
+				compileQuery(text)
+
+	def testPredicateIsAbstract(self):
+		with self.assertRaises(TypeError):
+			Predicate()
+
+
+class TestMatching(unittest.TestCase):
+	def setUp(self):
+		self.origin = makeRoom(0, "Town Square")
+		self.rooms = [
+			self.origin,
+			makeRoom(1, "Forest Trail", "forest", x=1, loadFlags=["herb"]),
+			makeRoom(2, "Old Road", "road", x=2, doors=[("north", "gate")]),
+			makeRoom(3, "Deep Forest", "forest", x=10),
+		]
+
+	def matching(self, text):
+		predicate = compileQuery(text).compile(self.origin)
+		return [roomObj.vnum for roomObj in self.rooms if predicate(roomObj)]
+
+	def testPrecedence(self):
+		self.assertEqual(self.matching("road or forest trail"), [1, 2])
+		self.assertEqual(self.matching("(road or forest) trail"), [1])
+
+	def testNot(self):
+		self.assertEqual(self.matching("not terrain=forest"), [0, 2])
+		self.assertEqual(self.matching("forest not trail"), [3])
+
+	def testFieldsAndQuoting(self):
+		self.assertEqual(self.matching('name="old road"'), [2])
+		self.assertEqual(self.matching('door="gate"'), [2])
+		self.assertEqual(self.matching("loadflags:herb|treasure"), [1])
+		self.assertEqual(self.matching("terrain=forest|road x=2|10"), [2, 3])
+
+	def testNear(self):
+		self.assertEqual(self.matching("near 2"), [0, 1, 2])
+		self.assertEqual(self.matching("forest near 5"), [1])
+
+
+if __name__ == "__main__":
+	unittest.main()